@@ -0,0 +1,130 @@
+"""Bounded admission pools for expensive endpoints, shared by the Flask and ASGI apps."""
+import asyncio
+import math
+import threading
+import time
+from collections import Counter
+
+# How often a queued ASGI request checks for a free slot
+ADMISSION_POLL_SECONDS = 0.02
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code, message, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionPool:
+    """Bounded concurrency with a bounded wait queue, queue deadline and per-key share"""
+    
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout, per_key):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.per_key = per_key
+        self.cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.held_by_key = Counter()
+        self.admitted = 0
+        self.rejected = Counter()
+        self.avg_service_seconds = 1.0
+    
+    def retry_after(self):
+        """Seconds until a slot is likely free, from the average service time"""
+        backlog = (self.waiting + 1) / max(self.max_concurrent, 1)
+        return max(1, math.ceil(self.avg_service_seconds * backlog))
+    
+    def reject(self, reason, status_code, message):
+        self.rejected[reason] += 1
+        raise AdmissionRejected(status_code, message, self.retry_after())
+    
+    def enter(self, key):
+        """Take a slot or join the queue; returns True if a slot was taken. Caller holds cond."""
+        if self.held_by_key[key] >= self.per_key:
+            self.reject("per_key", 429, f"Too many concurrent {self.name} requests for this user")
+        self.held_by_key[key] += 1
+        
+        if self.active < self.max_concurrent:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if self.waiting >= self.max_queue:
+            self.drop(key)
+            self.reject("queue_full", 429, f"{self.name} is busy, try again shortly")
+        self.waiting += 1
+        return False
+    
+    def drop(self, key):
+        self.held_by_key[key] -= 1
+        if self.held_by_key[key] <= 0:
+            del self.held_by_key[key]
+    
+    def promote(self):
+        self.waiting -= 1
+        self.active += 1
+        self.admitted += 1
+    
+    def give_up(self, key):
+        self.waiting -= 1
+        self.drop(key)
+        self.reject("queue_timeout", 503, f"{self.name} queue wait exceeded {self.queue_timeout}s")
+    
+    def acquire(self, key):
+        deadline = time.monotonic() + self.queue_timeout
+        with self.cond:
+            if self.enter(key):
+                return
+            while self.active >= self.max_concurrent:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.give_up(key)
+                self.cond.wait(remaining)
+            self.promote()
+    
+    async def acquire_async(self, key):
+        """acquire() for the ASGI mode; polls instead of blocking the event loop"""
+        deadline = time.monotonic() + self.queue_timeout
+        with self.cond:
+            if self.enter(key):
+                return
+        try:
+            while True:
+                await asyncio.sleep(ADMISSION_POLL_SECONDS)
+                with self.cond:
+                    if self.active < self.max_concurrent:
+                        self.promote()
+                        return
+                    if time.monotonic() >= deadline:
+                        self.give_up(key)
+        except asyncio.CancelledError:
+            # Client went away while queued: free its place in the queue
+            with self.cond:
+                self.waiting -= 1
+                self.drop(key)
+            raise
+    
+    def release(self, key, service_seconds):
+        with self.cond:
+            self.active -= 1
+            self.drop(key)
+            self.avg_service_seconds = 0.8 * self.avg_service_seconds + 0.2 * service_seconds
+            self.cond.notify()
+    
+    def snapshot(self):
+        return {
+            "limits": {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "queue_timeout": self.queue_timeout,
+                "per_key": self.per_key
+            },
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "avg_service_ms": round(self.avg_service_seconds * 1000)
+        }
@@ -1,14 +1,36 @@
-from flask import Flask, jsonify, request, send_from_directory, send_file
+from flask import Flask, jsonify, request, send_from_directory, send_file, Response, stream_with_context
 from flask_cors import CORS
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance, PointStruct, Filter, FieldCondition, MatchValue
+from qdrant_client.models import (
+    VectorParams, Distance, PointStruct, Filter, FieldCondition, MatchValue,
+    IsEmptyCondition, PayloadField, FilterSelector, HnswConfigDiff, VectorParamsDiff,
+    CollectionParamsDiff, ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    BinaryQuantization, BinaryQuantizationConfig, QuantizationSearchParams,
+    SearchParams, Disabled, ShardingMethod, PayloadSchemaType, DatetimeRange,
+    HasIdCondition, MatchAny
+)
 from dataclasses import dataclass
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import uuid
+from urllib.parse import quote
+import zlib
+import click
+import hashlib
+import hmac
+import gzip
+import mimetypes
+import shutil
+import csv
+import json
+import time
+import functools
+from collections import deque, Counter
 from fastembed import TextEmbedding
 import numpy as np
 import os
+import re
+import sqlite3
 import logging
 import bcrypt
 import base64
@@ -19,7 +41,13 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
 from reportlab.lib.units import inch
 import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dateutil import tz
+from admission import AdmissionPool, AdmissionRejected
+from extraction import extraction_process_main
+from cohort import compute_timeline_insights, partition_metrics, percentiles
 
 LOCAL_TZ = tz.tzlocal()
 
@@ -39,6 +67,177 @@ logger = logging.getLogger(__name__)
 COLLECTION_NAME = "medical_events"
 VECTOR_DIM = 384
 
+def env_flag(name, default=False):
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+# Collection storage and index tuning. Applied when the collection is created;
+# use `flask --app app migrate-collection` to apply changes to an existing one.
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "none").lower()  # none | int8 | binary
+QDRANT_QUANTIZATION_ALWAYS_RAM = env_flag("QDRANT_QUANTIZATION_ALWAYS_RAM", True)
+QDRANT_RESCORE = env_flag("QDRANT_RESCORE", True)
+QDRANT_OVERSAMPLING = float(os.getenv("QDRANT_OVERSAMPLING", "2.0"))
+QDRANT_ON_DISK_VECTORS = env_flag("QDRANT_ON_DISK_VECTORS")
+QDRANT_ON_DISK_PAYLOAD = env_flag("QDRANT_ON_DISK_PAYLOAD")
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCT = int(os.getenv("HNSW_EF_CONSTRUCT", "100"))
+HNSW_EF = int(os.getenv("HNSW_EF")) if os.getenv("HNSW_EF") else None
+
+# Long content is split into overlapping windows before embedding. FastEmbed
+# truncates anything past the model's sequence limit, so without chunking
+# most of a long discharge summary would never be searchable.
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+SEARCH_CANDIDATE_FACTOR = 4
+
+# The AI overview sees only the most recent events (older ones as counts),
+# and long document text is cut, so big timelines fit the context window.
+SUMMARY_MAX_EVENTS = max(int(os.getenv("SUMMARY_MAX_EVENTS", "40")), 1)
+SUMMARY_MAX_EVENT_CHARS = int(os.getenv("SUMMARY_MAX_EVENT_CHARS", "1500"))
+
+# Uploaded files are parsed in worker processes after the upload returns.
+# OCR_HOOK is an optional "module:function" called with the file path.
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "2"))
+EXTRACTION_TIMEOUT_SECONDS = int(os.getenv("EXTRACTION_TIMEOUT_SECONDS", "60"))
+EXTRACTION_JOB_HISTORY = 1000
+OCR_HOOK = os.getenv("OCR_HOOK")
+
+# Bulk importer (flask --app app import-history ...)
+IMPORT_NAMESPACE = uuid.UUID("6f1c2d4e-8a3b-5c7d-9e0f-1a2b3c4d5e6f")
+IMPORT_EMBED_BATCH = 256
+IMPORT_UPSERT_RETRIES = 3
+
+# Bulk export (/export-events and flask --app app export-events)
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "500"))
+EXPORT_COLUMNS = [
+    "patient_id", "timestamp", "event_type", "modality", "content",
+    "doctor_name", "hospital_name", "filename", "file_path", "file_extension",
+    "extraction_status", "record_type", "parent_event_id", "chunk_index",
+    "chunk_count", "import_source", "file_sha256", "storage_tier", "duplicate_of"
+]
+
+# Bearer token for collection-wide admin endpoints; unset disables them
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+
+# Local state (journal, caches, ...) lives in a SQLite file
+LOCAL_STATE_DIR = os.getenv("LOCAL_STATE_DIR", "data")
+LOCAL_DB_PATH = os.path.join(LOCAL_STATE_DIR, "meditrack.db")
+
+# Multi-tenant routing, keyed by tenant id or hospital_name:
+#   shared     - every tenant in COLLECTION_NAME (original behaviour)
+#   shard_key  - one Qdrant custom shard key per tenant in SHARDED_COLLECTION_NAME
+#   collection - one "<COLLECTION_NAME>__<tenant>" collection per tenant
+TENANCY_MODE = os.getenv("TENANCY_MODE", "shared").lower()
+SHARDED_COLLECTION_NAME = f"{COLLECTION_NAME}_sharded"
+SHARED_TENANT = "shared"
+DEFAULT_TENANT = "default"
+TENANT_REBALANCE_THRESHOLD = int(os.getenv("TENANT_REBALANCE_THRESHOLD", "50000"))
+# Tenants and patient pins are stored in a small Qdrant collection so every
+# process on every host sees the same routes. Each process caches patient
+# pins for ROUTE_CACHE_SECONDS; a move waits that long before copying.
+ROUTING_COLLECTION_NAME = f"{COLLECTION_NAME}_routing"
+ROUTING_NAMESPACE = uuid.UUID("2d7b9c1e-4f3a-5b6c-8d9e-0a1b2c3d4e5f")
+ROUTE_CACHE_SECONDS = float(os.getenv("ROUTE_CACHE_SECONDS", "30"))
+ROUTE_CACHE_MAX_PATIENTS = 100000
+
+# Write-ahead ingest journal. Events are acknowledged once they are in the
+# local SQLite journal; a background flusher embeds and upserts them in batches.
+INGEST_JOURNAL = env_flag("INGEST_JOURNAL", True)
+JOURNAL_BATCH_SIZE = int(os.getenv("JOURNAL_BATCH_SIZE", "64"))
+JOURNAL_FLUSH_INTERVAL_SECONDS = float(os.getenv("JOURNAL_FLUSH_INTERVAL_SECONDS", "1.0"))
+JOURNAL_CLAIM_TIMEOUT_SECONDS = 300
+JOURNAL_MAX_BACKOFF_SECONDS = 300
+# Entries that keep failing on their own are parked in journal_dead
+JOURNAL_MAX_ATTEMPTS = int(os.getenv("JOURNAL_MAX_ATTEMPTS", "8"))
+
+# Admission control for expensive endpoints (per worker process). Each pool
+# caps concurrent requests, how many may wait, how long they may wait, and
+# how many slots (running + waiting) one user or patient may hold.
+# Defaults are sized for a gthread worker with 16 threads: running + queued
+# slots across all pools stay below the thread count so cheap routes are
+# still served while every pool is full. asgi.py applies its own defaults.
+# ADMISSION_LIMITS='{"export-pdf": {"max_concurrent": 4}}' overrides defaults.
+ADMISSION_DEFAULTS = {
+    "timeline-summary": {"max_concurrent": 4, "max_queue": 2, "queue_timeout": 10, "per_key": 2},
+    "export-pdf": {"max_concurrent": 1, "max_queue": 2, "queue_timeout": 15, "per_key": 1},
+    "upload-document": {"max_concurrent": 2, "max_queue": 2, "queue_timeout": 10, "per_key": 2}
+}
+ADMISSION_OVERRIDES = json.loads(os.getenv("ADMISSION_LIMITS", "{}"))
+
+def valid_admission_value(key, value):
+    """Limits are positive ints (max_queue may be 0); queue_timeout may be fractional"""
+    if isinstance(value, bool):
+        return False
+    if key == "queue_timeout":
+        return isinstance(value, (int, float)) and value > 0
+    return isinstance(value, int) and value >= (0 if key == "max_queue" else 1)
+
+def admission_limits(defaults, overrides):
+    """Merge ADMISSION_LIMITS overrides into the defaults, skipping unknown pools, keys and bad values"""
+    limits = {name: dict(values) for name, values in defaults.items()}
+    for name, values in overrides.items():
+        if name not in limits or not isinstance(values, dict):
+            logger.warning(f"⚠️  ADMISSION_LIMITS: unknown pool '{name}' ignored (pools: {', '.join(limits)})")
+            continue
+        for key, value in values.items():
+            if key not in limits[name]:
+                logger.warning(f"⚠️  ADMISSION_LIMITS: unknown setting '{name}.{key}' ignored "
+                               f"(settings: {', '.join(limits[name])})")
+                continue
+            if not valid_admission_value(key, value):
+                logger.warning(f"⚠️  ADMISSION_LIMITS: invalid value {value!r} for '{name}.{key}' ignored "
+                               f"(keeping {limits[name][key]})")
+                continue
+            limits[name][key] = value
+    return limits
+
+ADMISSION_LIMITS = admission_limits(ADMISSION_DEFAULTS, ADMISSION_OVERRIDES)
+
+# Near-duplicate detection. New text events are compared against the same
+# patient's events of the same type within the window before they are
+# upserted; "merge" drops the copy and counts it on the original, "flag"
+# stores it with duplicate_of set. Re-uploaded files are matched by hash.
+DEDUP_ENABLED = env_flag("DEDUP_ENABLED")
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.97"))
+DEDUP_WINDOW_DAYS = float(os.getenv("DEDUP_WINDOW_DAYS", "30"))
+DEDUP_ACTION = os.getenv("DEDUP_ACTION", "merge").lower()  # merge | flag
+
+# Cohort analytics snapshots for /analytics/cohort. Writes mark patients
+# dirty and the refresher recomputes only those; 0 disables the background
+# refresh (use `flask cohort-refresh` instead).
+COHORT_WORKERS = int(os.getenv("COHORT_WORKERS", "4"))
+COHORT_REFRESH_INTERVAL_SECONDS = int(os.getenv("COHORT_REFRESH_INTERVAL_SECONDS", "600"))
+COHORT_PARALLEL_MIN_PATIENTS = 2000
+COHORT_PATIENTS_PER_SCROLL = 256
+COHORT_FULL_REFRESH_PATIENTS = 20000
+# Dirty marks are local to each host, so writes made on another host only
+# reach this snapshot through a periodic full refresh (0 = never).
+COHORT_FULL_REFRESH_INTERVAL_SECONDS = int(os.getenv("COHORT_FULL_REFRESH_INTERVAL_SECONDS", "86400"))
+
+# Materialized timeline views are local to each host as well. A view built
+# from Qdrant longer ago than this is rebuilt on the next read, so writes
+# made on other hosts show up within that window (0 = single host, never).
+TIMELINE_VIEW_MAX_AGE_SECONDS = int(os.getenv("TIMELINE_VIEW_MAX_AGE_SECONDS", "300"))
+
+# Storage compaction for uploads/ and the events collections (see
+# `flask compact-storage`). Unreferenced files and points whose file is gone
+# are removed once older than the grace period; retention is off by default.
+UPLOADS_DIR = os.path.join(os.getcwd(), "uploads")
+COLD_STORAGE_DIR = os.path.join(UPLOADS_DIR, "cold")
+STORAGE_GRACE_HOURS = float(os.getenv("STORAGE_GRACE_HOURS", "24"))
+STORAGE_COLD_AFTER_DAYS = int(os.getenv("STORAGE_COLD_AFTER_DAYS", "0"))  # 0 = keep uploads hot
+STORAGE_RETENTION_DAYS = int(os.getenv("STORAGE_RETENTION_DAYS", "0"))  # 0 = never expire events
+STORAGE_COMPACTION_INTERVAL_SECONDS = int(os.getenv("STORAGE_COMPACTION_INTERVAL_SECONDS", "0"))  # 0 = CLI only
+# If more document files than this are missing, the uploads volume is most
+# likely not mounted (or the job runs from the wrong directory), so the
+# reconcile step is skipped instead of touching every document event.
+STORAGE_MISSING_FILE_MAX_FRACTION = float(os.getenv("STORAGE_MISSING_FILE_MAX_FRACTION", "0.05"))
+# The same guard for the other direction: an empty or wrong Qdrant makes every
+# upload look unreferenced. Orphans are moved to quarantine, not deleted, and
+# purged only after STORAGE_QUARANTINE_DAYS.
+STORAGE_ORPHAN_FILE_MAX_FRACTION = float(os.getenv("STORAGE_ORPHAN_FILE_MAX_FRACTION", "0.05"))
+STORAGE_QUARANTINE_DIR = os.path.join(UPLOADS_DIR, "quarantine")
+STORAGE_QUARANTINE_DAYS = int(os.getenv("STORAGE_QUARANTINE_DAYS", "30"))  # 0 = keep quarantined files
+
 # ==================== FLASK APP ====================
 app = Flask(__name__, static_folder='static', static_url_path='')
 app.secret_key = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
@@ -53,6 +252,27 @@ qdrant_client = None
 embedding_model = None
 groq_client = None
 users_db = {}
+extraction_jobs = {}
+extraction_jobs_lock = threading.Lock()
+extraction_dispatcher = ThreadPoolExecutor(max_workers=EXTRACTION_WORKERS, thread_name_prefix="extract")
+local_db_state = threading.local()
+routing_ready = threading.Event()
+routing_lock = threading.Lock()
+patient_route_cache = {}
+tenant_list_cache = {"tenants": None, "fetched_at": 0}
+journal_wakeup = threading.Event()
+journal_stop = threading.Event()
+journal_flusher = None
+maintenance_stop = threading.Event()
+cohort_refresher = None
+storage_compactor = None
+journal_metrics = {
+    "flushed_events": 0,
+    "failed_batches": 0,
+    "parked_events": 0,
+    "last_flush_at": None,
+    "last_error": None
+}
 initialization_status = {
     "qdrant": False,
     "embedding": False,
@@ -144,14 +364,20 @@ def initialize_app():
         if COLLECTION_NAME in collection_names:
             logger.info(f"   ℹ️  Collection '{COLLECTION_NAME}' already exists")
         else:
-            qdrant_client.create_collection(
-                collection_name=COLLECTION_NAME,
-                vectors_config=VectorParams(
-                    size=VECTOR_DIM,
-                    distance=Distance.COSINE
-                )
-            )
-            logger.info(f"   ✅ Collection '{COLLECTION_NAME}' created")
+            create_events_collection(COLLECTION_NAME)
+            logger.info(f"   ✅ Collection '{COLLECTION_NAME}' created (quantization={QDRANT_QUANTIZATION}, "
+                        f"on_disk_vectors={QDRANT_ON_DISK_VECTORS}, hnsw m={HNSW_M})")
+        
+        if TENANCY_MODE == "shard_key" and SHARDED_COLLECTION_NAME not in collection_names:
+            create_events_collection(SHARDED_COLLECTION_NAME, sharded=True)
+            logger.info(f"   ✅ Sharded collection '{SHARDED_COLLECTION_NAME}' created")
+        logger.info(f"   ℹ️  Tenancy mode: {TENANCY_MODE}")
+        
+        for route in event_routes():
+            if qdrant_client.collection_exists(route.collection):
+                added = ensure_payload_indexes(route.collection)
+                if added:
+                    logger.info(f"   ✅ Payload indexes added to '{route.collection}': {', '.join(added)}")
         
         initialization_status["collection"] = True
     except Exception as e:
@@ -172,17 +398,65 @@ def initialize_app():
     
     return True
 
-# Initialize on import
-if not initialize_app():
+# Initialize on import. Skipped when `python app.py` is re-imported as
+# __mp_main__ by a spawned extraction or cohort worker, which needs neither
+# Qdrant nor the embedding model.
+if __name__ != "__mp_main__" and not initialize_app():
     logger.error("🛑 Initialization failed - server will not start properly")
     raise RuntimeError("Failed to initialize application")
 
 # Cleanup on shutdown
 def cleanup():
     logger.info("🔚 Shutting down gracefully...")
+    journal_stop.set()
+    journal_wakeup.set()
+    maintenance_stop.set()
+    extraction_dispatcher.shutdown(wait=False)
 
 atexit.register(cleanup)
 
+# ==================== ADMISSION CONTROL ====================
+
+def build_admission_pools(limits):
+    return {name: AdmissionPool(name, **values) for name, values in limits.items()}
+
+admission_pools = build_admission_pools(ADMISSION_LIMITS)
+
+def admission_key():
+    """Fair-share key: the logged-in user, else the patient, else the client address"""
+    if current_user.is_authenticated:
+        return f"user:{current_user.id}"
+    data = request.get_json(silent=True) or request.form
+    patient_id = data.get("patient_id") if data else None
+    return f"patient:{patient_id}" if patient_id else f"ip:{request.remote_addr}"
+
+def admission_response(rejection):
+    response = jsonify({"error": str(rejection), "retry_after": rejection.retry_after})
+    response.headers["Retry-After"] = str(rejection.retry_after)
+    return response, rejection.status_code
+
+def admission_controlled(name):
+    """Run the view inside the named admission pool, failing fast when saturated"""
+    pool = admission_pools[name]
+    
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = admission_key()
+            try:
+                pool.acquire(key)
+            except AdmissionRejected as rejection:
+                logger.warning(f"🚦 {name} rejected for {key}: {rejection}")
+                return admission_response(rejection)
+            
+            started = time.monotonic()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                pool.release(key, time.monotonic() - started)
+        return wrapper
+    return decorator
+
 # ==================== USER MANAGEMENT ====================
 
 class User(UserMixin):
@@ -235,7 +509,10 @@ def patient_view(patient_id):
 @app.route("/health")
 def health():
     """Health check endpoint"""
-    return jsonify({
+    return jsonify(health_status())
+
+def health_status():
+    return {
         "status": "healthy" if initialization_status["initialized"] else "initializing",
         "components": {
             "qdrant": initialization_status["qdrant"],
@@ -244,7 +521,7 @@ def health():
             "groq": initialization_status["groq"]
         },
         "timestamp": datetime.now(timezone.utc).isoformat()
-    })
+    }
 
 @app.route("/api/status")
 def api_status():
@@ -259,7 +536,9 @@ def api_status():
                 info = qdrant_client.get_collection(COLLECTION_NAME)
                 stats = {
                     "points_count": info.points_count,
-                    "vectors_count": info.vectors_count
+                    "vectors_count": info.vectors_count,
+                    "indexed_vectors_count": info.indexed_vectors_count,
+                    "optimizer_status": str(info.status)
                 }
             except:
                 pass
@@ -275,7 +554,16 @@ def api_status():
             "collection": {
                 "name": COLLECTION_NAME,
                 "exists": collection_exists,
-                "stats": stats
+                "stats": stats,
+                "tuning": {
+                    "quantization": QDRANT_QUANTIZATION,
+                    "rescore": QDRANT_RESCORE,
+                    "on_disk_vectors": QDRANT_ON_DISK_VECTORS,
+                    "on_disk_payload": QDRANT_ON_DISK_PAYLOAD,
+                    "hnsw_m": HNSW_M,
+                    "hnsw_ef_construct": HNSW_EF_CONSTRUCT,
+                    "hnsw_ef": HNSW_EF
+                }
             },
             "embedding": {
                 "loaded": initialization_status["embedding"],
@@ -288,7 +576,16 @@ def api_status():
             },
             "users": {
                 "registered": len(users_db)
-            }
+            },
+            "ingest_journal": journal_status(),
+            "admission": {name: pool.snapshot() for name, pool in admission_pools.items()},
+            "tenancy": {
+                "mode": TENANCY_MODE,
+                "tenants": len(routed_tenants()),
+                "routed_patients": routed_patient_count()
+            },
+            "cohort_snapshot": cohort_snapshot_status(),
+            "storage": storage_status()
         })
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -409,8 +706,9 @@ def update_profile():
 # ==================== DOCUMENT UPLOAD WITH OCR ====================
 
 @app.route("/upload-document", methods=["POST"])
+@admission_controlled("upload-document")
 def upload_document():
-    """Upload document with OCR text extraction"""
+    """Upload document; text extraction runs in the background"""
     try:
         if 'file' not in request.files:
             return jsonify({"error": "No file uploaded"}), 400
@@ -419,118 +717,91 @@ def upload_document():
         patient_id = request.form.get('patient_id')
         doctor_name = request.form.get('doctor_name', 'Unknown')
         hospital_name = request.form.get('hospital_name', 'Unknown')
+        tenant_id = request.form.get('tenant_id')
         
         if not patient_id:
             return jsonify({"error": "patient_id required"}), 400
         
-        logger.info(f"📄 Processing document for patient: {patient_id}")
-        
-        # Read file and save it
-        file_content = file.read()
-        file_extension = os.path.splitext(file.filename)[1]
-        
-        # Create uploads directory if it doesn't exist
-        uploads_dir = os.path.join(os.getcwd(), 'uploads')
-        os.makedirs(uploads_dir, exist_ok=True)
-        
-        # Generate unique filename
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(uploads_dir, unique_filename)
-        
-        # Save file to disk
-        with open(file_path, 'wb') as f:
-            f.write(file_content)
-        
-        logger.info(f"📁 File saved to: {file_path}")
-        
-        # Get manual notes if provided
-        extracted_text = f"Document: {file.filename}"
-        additional_notes = request.form.get('notes', '')
-        if additional_notes:
-            extracted_text += f"\n\nNotes: {additional_notes}"
-        
-        # Create event with extracted text
-        doc_date = datetime.now(timezone.utc).isoformat()
-        event = create_medical_event(
-            extracted_text, 
-            patient_id, 
-            "document", 
-            doc_date,
-            doctor_name=doctor_name,
-            hospital_name=hospital_name
-        )
-        
-        vector = list(embedding_model.embed(event.content))[0].tolist()
-        
-        qdrant_client.upsert(
-            collection_name=COLLECTION_NAME,
-            points=[PointStruct(
-                id=event.event_id,
-                vector=vector,
-                payload={
-                    "patient_id": event.patient_id,
-                    "timestamp": event.timestamp,
-                    "event_type": event.event_type,
-                    "modality": "document",
-                    "content": event.content,
-                    "filename": file.filename,
-                    "file_path": unique_filename,  # Store relative path
-                    "file_extension": file_extension,
-                    "doctor_name": event.doctor_name,
-                    "hospital_name": event.hospital_name
-                }
-            )]
+        response = store_uploaded_document(
+            file.read(),
+            file.filename,
+            patient_id,
+            doctor_name,
+            hospital_name,
+            request.form.get('notes', ''),
+            tenant_id
         )
+        return jsonify(response)
         
-        logger.info(f"✅ Document stored: {event.event_id[:8]}...")
+    except Exception as e:
+        logger.error(f"Document upload error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/document-status/<event_id>")
+def document_status(event_id):
+    """Report background text extraction status for an uploaded document"""
+    job = extraction_jobs.get(event_id)
+    if job:
+        return jsonify({"event_id": event_id, **job})
+    
+    try:
+        points = []
+        for route in lookup_routes(request.args.get("patient_id")):
+            points = qdrant_client.retrieve(**route.kwargs(), ids=[event_id], with_payload=True)
+            if points:
+                break
+        if not points or points[0].payload.get("modality") != "document":
+            return jsonify({"error": "Document not found"}), 404
         
+        payload = points[0].payload
         return jsonify({
-            "status": "success",
-            "event_id": event.event_id,
-            "extracted_text": extracted_text,
-            "filename": file.filename,
-            "file_path": unique_filename,
-            "document_type": "document",
-            "note": "Document stored. You can download it anytime from your timeline."
+            "event_id": event_id,
+            "status": payload.get("extraction_status", "unknown"),
+            "method": payload.get("extraction_method"),
+            "error": payload.get("extraction_error")
         })
-        
     except Exception as e:
-        logger.error(f"Document upload error: {e}")
+        logger.error(f"Document status error: {e}")
         return jsonify({"error": str(e)}), 500
 
 @app.route("/download-document/<filename>")
 def download_document(filename):
     """Download uploaded document"""
     try:
-        uploads_dir = os.path.join(os.getcwd(), 'uploads')
-        file_path = os.path.join(uploads_dir, filename)
+        file_path, tier = upload_location(filename)
         
-        if not os.path.exists(file_path):
+        if not file_path:
             return jsonify({"error": "File not found"}), 404
         
         # Get original filename from Qdrant if possible
         try:
-            results = qdrant_client.scroll(
-                collection_name=COLLECTION_NAME,
-                scroll_filter=Filter(must=[
-                    FieldCondition(key="file_path", match=MatchValue(value=filename))
-                ]),
-                limit=1,
-                with_payload=True
-            )
-            if results[0]:
-                original_filename = results[0][0].payload.get("filename", filename)
-            else:
-                original_filename = filename
+            original_filename = filename
+            for route in lookup_routes(request.args.get("patient_id")):
+                results = qdrant_client.scroll(
+                    **route.kwargs(),
+                    scroll_filter=Filter(must=[
+                        FieldCondition(key="file_path", match=MatchValue(value=filename))
+                    ]),
+                    limit=1,
+                    with_payload=True
+                )
+                if results[0]:
+                    original_filename = results[0][0].payload.get("filename", filename)
+                    break
         except:
             original_filename = filename
         
-        logger.info(f"📥 Downloading document: {original_filename}")
+        logger.info(f"📥 Downloading document: {original_filename} ({tier})")
         
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=original_filename
+        if tier == "hot":
+            return send_file(file_path, as_attachment=True, download_name=original_filename)
+        
+        # Cold uploads are streamed decompressed; handing send_file a GzipFile
+        # would let gunicorn sendfile() the compressed bytes via its fileno().
+        return Response(
+            stream_with_context(iter_upload_chunks(file_path, tier)),
+            mimetype=upload_mimetype(original_filename),
+            headers={"Content-Disposition": attachment_disposition(original_filename)}
         )
         
     except Exception as e:
@@ -561,28 +832,11 @@ def ingest():
             hospital_name
         )
         
-        vector = list(embedding_model.embed(event.content))[0].tolist()
-        
-        qdrant_client.upsert(
-            collection_name=COLLECTION_NAME,
-            points=[PointStruct(
-                id=event.event_id,
-                vector=vector,
-                payload={
-                    "patient_id": event.patient_id,
-                    "timestamp": event.timestamp,
-                    "event_type": event.event_type,
-                    "modality": "text",
-                    "content": event.content,
-                    "doctor_name": event.doctor_name,
-                    "hospital_name": event.hospital_name
-                }
-            )]
-        )
+        status = record_event(event, "text", tenant_id=data.get("tenant_id"))
         
-        logger.info(f"📝 Event ingested: {event.event_id[:8]}... ({event.event_type})")
+        logger.info(f"📝 Event ingested: {event.event_id[:8]}... ({event.event_type}, {status})")
         
-        return jsonify({"status": "stored", "event_id": event.event_id})
+        return jsonify({"status": status, "event_id": event.event_id})
     except Exception as e:
         logger.error(f"Ingest error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -590,118 +844,77 @@ def ingest():
 # ==================== TIMELINE & ANALYSIS ====================
 
 @app.route("/timeline-summary", methods=["POST"])
+@admission_controlled("timeline-summary")
 def timeline_summary():
     try:
         patient_id = request.json.get("patient_id")
         if not patient_id:
             return jsonify({"error": "Missing patient_id"}), 400
         
-        points = fetch_timeline_events(patient_id)
+        view = load_patient_timeline(patient_id)
         
-        if not points:
+        if not view:
             return jsonify({"error": "No events found"}), 404
         
-        timeline = build_patient_timeline(points)
-        
-        if len(points) == 1:
-            return jsonify({
-                "timeline": timeline,
-                "timeline_insights": {
-                    "activity_rate": 0,
-                    "activity_level": "N/A",
-                    "activity_description": "Only one event recorded",
-                    "longest_gap_days": 0,
-                    "continuity": "N/A",
-                    "continuity_description": "Need more events for analysis",
-                    "completeness": 100 if timeline[0]["doctor_name"] != "Unknown" else 0,
-                    "event_breakdown": {timeline[0]["event_type"]: 100},
-                    "unique_hospitals": 1 if timeline[0]["hospital_name"] != "Unknown" else 0,
-                    "unique_doctors": 1 if timeline[0]["doctor_name"] != "Unknown" else 0,
-                    "total_days": 1,
-                    "total_events": 1
-                },
-                "overall_summary": "Only one event recorded. Add more medical events to see detailed timeline analysis.",
-                "data_quality": compute_data_quality(timeline)
-            })
+        timeline = view["timeline"]
+        
+        if len(timeline) == 1:
+            return jsonify(single_event_response(timeline))
         
-        insights = compute_timeline_insights(timeline)
         summary = ai_explain(build_overview_prompt(timeline))
         
-        logger.info(f"📊 Timeline generated for {patient_id}: {len(points)} events")
+        logger.info(f"📊 Timeline generated for {patient_id}: {len(timeline)} events")
         
         return jsonify({
             "timeline": timeline,
-            "timeline_insights": insights,
+            "timeline_insights": view["timeline_insights"],
             "overall_summary": summary,
-            "data_quality": compute_data_quality(timeline)
+            "data_quality": view["data_quality"]
         })
     except Exception as e:
         logger.error(f"Timeline error: {e}")
         return jsonify({"error": str(e)}), 500
 
+# ==================== SEMANTIC SEARCH ====================
+
+@app.route("/search", methods=["POST"])
+def search():
+    """Semantic search over a patient's events, one hit per event"""
+    try:
+        data = request.json
+        patient_id = data.get("patient_id")
+        query = data.get("query")
+        limit = int(data.get("limit", 10))
+        
+        if not patient_id or not query:
+            return jsonify({"error": "patient_id and query required"}), 400
+        
+        query_vector = list(embedding_model.embed([query]))[0].tolist()
+        hits = qdrant_client.query_points(**search_query_args(patient_id, query_vector, limit)).points
+        results = collapse_search_hits(hits, limit)
+        
+        logger.info(f"🔍 Search for {patient_id}: {len(results)} results")
+        
+        return jsonify({"query": query, "results": results})
+    except Exception as e:
+        logger.error(f"Search error: {e}")
+        return jsonify({"error": str(e)}), 500
+
 # ==================== PDF EXPORT ====================
 
 @app.route("/export-pdf", methods=["POST"])
+@admission_controlled("export-pdf")
 def export_pdf():
     try:
         patient_id = request.json.get("patient_id")
         if not patient_id:
             return jsonify({"error": "patient_id required"}), 400
         
-        points = fetch_timeline_events(patient_id)
-        if not points:
+        view = load_patient_timeline(patient_id)
+        if not view:
             return jsonify({"error": "No events found"}), 404
         
-        timeline = build_patient_timeline(points)
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        story = []
-        styles = getSampleStyleSheet()
-        
-        title_style = ParagraphStyle(
-            'Title',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor=colors.HexColor('#1e40af'),
-            spaceAfter=20
-        )
-        
-        # Get hospital name if available
-        hospital_name = timeline[0].get('hospital_name', 'General Hospital') if timeline else 'General Hospital'
-        
-        story.append(Paragraph("Medical Timeline Report", title_style))
-        story.append(Paragraph(f"Hospital: {hospital_name}", styles['Normal']))
-        story.append(Paragraph(f"Patient ID: {patient_id}", styles['Normal']))
-        story.append(Paragraph(f"Generated: {datetime.now().strftime('%B %d, %Y at %I:%M %p')}", styles['Normal']))
-        story.append(Spacer(1, 0.4*inch))
-        
-        table_data = [['Date', 'Type', 'Details']]
-        for e in timeline:
-            utc_time = datetime.fromisoformat(e['timestamp'])
-            local_time = utc_time.astimezone(LOCAL_TZ)
-
-            date = local_time.strftime('%b %d, %Y %I:%M %p')
-            table_data.append([
-                Paragraph(date, styles['Normal']),
-                Paragraph(e['event_type'], styles['Normal']),
-                Paragraph(e['content'][:200] + ('...' if len(e['content']) > 200 else ''), styles['Normal'])
-            ])
-        
-        table = Table(table_data, colWidths=[1.5*inch, 1.5*inch, 4*inch])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#1e40af')),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-            ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0,0), (-1,0), 11),
-            ('BOTTOMPADDING', (0,0), (-1,0), 12),
-            ('GRID', (0,0), (-1,-1), 1, colors.black),
-            ('VALIGN', (0,0), (-1,-1), 'TOP')
-        ]))
-        
-        story.append(table)
-        doc.build(story)
-        buffer.seek(0)
+        buffer = build_timeline_pdf(patient_id, view["timeline"])
         
         logger.info(f"📄 PDF exported for {patient_id}")
         
@@ -709,251 +922,3042 @@ def export_pdf():
             buffer,
             mimetype='application/pdf',
             as_attachment=True,
-            download_name=f'medical_timeline_{patient_id}_{datetime.now().strftime("%Y%m%d")}.pdf'
+            download_name=pdf_download_name(patient_id)
         )
     except Exception as e:
         logger.error(f"PDF export error: {e}")
         return jsonify({"error": str(e)}), 500
 
-# ==================== HELPER FUNCTIONS ====================
+# ==================== BULK EXPORT ====================
 
-def create_medical_event(content, patient_id, event_type, timestamp=None, doctor_name="", hospital_name=""):
-    log_time_utc = (
-        datetime.fromisoformat(timestamp).astimezone(timezone.utc)
-        if timestamp
-        else datetime.now(timezone.utc)
+@app.route("/export-events")
+def export_events():
+    """Stream the collection (or a filtered subset) as NDJSON or column blocks"""
+    denied = require_admin_token()
+    if denied:
+        return denied
+    
+    file_format = request.args.get("format", "ndjson")
+    if file_format not in ("ndjson", "columnar"):
+        return jsonify({"error": "format must be ndjson or columnar"}), 400
+    
+    scroll_filter = export_filter(
+        patient_id=request.args.get("patient_id"),
+        hospital_name=request.args.get("hospital_name"),
+        event_type=request.args.get("event_type"),
+        include_chunks=request.args.get("include_chunks") == "1"
     )
-    return MedicalEvent(
-        event_id=str(uuid.uuid4()),
-        patient_id=patient_id,
-        timestamp=log_time_utc.isoformat(),
-        event_type=event_type,
-        modality="text",
-        content=content,
-        doctor_name=doctor_name,
-        hospital_name=hospital_name
+    with_vectors = request.args.get("include_vectors") == "1"
+    routes = lookup_routes(request.args.get("patient_id"))
+    
+    logger.info(f"📤 Streaming {file_format} export (vectors={with_vectors})")
+    
+    return Response(
+        stream_with_context(iter_export_lines(file_format, scroll_filter, with_vectors, routes)),
+        mimetype="application/x-ndjson",
+        headers={
+            "Content-Disposition": f'attachment; filename="medical_events_{datetime.now().strftime("%Y%m%d")}.{file_format}.jsonl"'
+        }
     )
 
-def fetch_timeline_events(patient_id):
+# ==================== COHORT ANALYTICS ====================
+
+@app.route("/analytics/cohort")
+def cohort_analytics():
+    """Aggregate timeline metrics across patients from the latest cohort snapshot"""
+    denied = require_admin_token()
+    if denied:
+        return denied
+    
+    hospital_name = request.args.get("hospital")
+    doctor_name = request.args.get("doctor")
+    group_by = request.args.get("group_by")
+    if group_by not in (None, "hospital", "doctor"):
+        return jsonify({"error": "group_by must be hospital or doctor"}), 400
+    
     try:
-        results = qdrant_client.scroll(
-            collection_name=COLLECTION_NAME,
-            scroll_filter=Filter(must=[
-                FieldCondition(key="patient_id", match=MatchValue(value=patient_id))
-            ]),
-            limit=100,
-            with_payload=True
-        )
-        points = results[0]
-        return sorted(points, key=lambda p: datetime.fromisoformat(p.payload["timestamp"]))
+        response = {
+            "filters": {"hospital": hospital_name, "doctor": doctor_name},
+            "snapshot": cohort_snapshot_status(),
+            "cohort": cohort_summary(hospital_name, doctor_name)
+        }
+        
+        if group_by:
+            column = "hospital_name" if group_by == "hospital" else "doctor_name"
+            conditions = [(name, value) for name, value in
+                          [("hospital_name", hospital_name), ("doctor_name", doctor_name)] if value]
+            where = f"WHERE {' AND '.join(f'{name} = ?' for name, _ in conditions)}" if conditions else ""
+            names = local_db().execute(
+                f"SELECT {column}, SUM(events) FROM cohort_event_mix {where} GROUP BY {column} ORDER BY 2 DESC LIMIT ?",
+                [value for _, value in conditions] + [int(request.args.get("limit", 50))]
+            ).fetchall()
+            response["groups"] = {
+                name: cohort_summary(
+                    name if group_by == "hospital" else hospital_name,
+                    name if group_by == "doctor" else doctor_name
+                )
+                for name, _ in names
+            }
+        
+        return jsonify(response)
     except Exception as e:
-        logger.error(f"Fetch timeline error: {e}")
-        return []
+        logger.error(f"Cohort analytics error: {e}")
+        return jsonify({"error": str(e)}), 500
 
-def build_patient_timeline(points):
-    timeline = []
+# ==================== LOCAL STATE STORE ====================
 
-    for p in sorted(points, key=lambda x: datetime.fromisoformat(x.payload["timestamp"])):
-        utc_time = datetime.fromisoformat(p.payload["timestamp"])
-        local_time = utc_time.astimezone(LOCAL_TZ)
+LOCAL_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tenants (
+    tenant_id TEXT PRIMARY KEY,
+    mode TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    shard_key TEXT,
+    created_at TEXT NOT NULL
+);
+-- Pins from before routes moved to Qdrant; pushed there and cleared on first use
+CREATE TABLE IF NOT EXISTS patient_tenants (
+    patient_id TEXT PRIMARY KEY,
+    tenant_id TEXT NOT NULL REFERENCES tenants (tenant_id),
+    assigned_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ingest_journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    tenant_id TEXT,
+    modality TEXT NOT NULL,
+    replace_chunks INTEGER NOT NULL DEFAULT 0,
+    event_json TEXT NOT NULL,
+    extra_payload TEXT,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    claimed_by TEXT,
+    claimed_at REAL
+);
+CREATE INDEX IF NOT EXISTS ingest_journal_patient ON ingest_journal (patient_id);
+CREATE INDEX IF NOT EXISTS ingest_journal_event ON ingest_journal (event_id, seq);
+CREATE TABLE IF NOT EXISTS journal_dead (
+    seq INTEGER PRIMARY KEY,
+    event_id TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    tenant_id TEXT,
+    modality TEXT NOT NULL,
+    replace_chunks INTEGER NOT NULL DEFAULT 0,
+    event_json TEXT NOT NULL,
+    extra_payload TEXT,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    parked_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS journal_dead_event ON journal_dead (event_id);
+CREATE TABLE IF NOT EXISTS cohort_patients (
+    patient_id TEXT PRIMARY KEY,
+    events INTEGER NOT NULL,
+    first_event_at REAL NOT NULL,
+    last_event_at REAL NOT NULL,
+    total_days INTEGER NOT NULL,
+    activity_rate REAL NOT NULL,
+    activity_level TEXT NOT NULL,
+    longest_gap_days INTEGER NOT NULL,
+    median_gap_days REAL,
+    refreshed_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cohort_event_mix (
+    patient_id TEXT NOT NULL,
+    hospital_name TEXT NOT NULL,
+    doctor_name TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    events INTEGER NOT NULL,
+    PRIMARY KEY (patient_id, hospital_name, doctor_name, event_type)
+);
+CREATE INDEX IF NOT EXISTS cohort_event_mix_hospital ON cohort_event_mix (hospital_name, doctor_name);
+CREATE INDEX IF NOT EXISTS cohort_event_mix_doctor ON cohort_event_mix (doctor_name);
+CREATE TABLE IF NOT EXISTS cohort_dirty_patients (
+    patient_id TEXT PRIMARY KEY,
+    marked_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cohort_refreshes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mode TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    patients INTEGER,
+    events INTEGER
+);
+CREATE TABLE IF NOT EXISTS patient_timelines (
+    patient_id TEXT PRIMARY KEY,
+    view TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    built_at REAL
+);
+CREATE TABLE IF NOT EXISTS storage_compactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    report TEXT
+);
+"""
 
-        timeline.append({
-            "timestamp": utc_time.isoformat(),               
-            "local_time": local_time.isoformat(),            
-            "event_type": p.payload["event_type"],
-            "content": p.payload["content"],
-            "doctor_name": p.payload.get("doctor_name", "Unknown"),
-            "hospital_name": p.payload.get("hospital_name", "Unknown"),
-            "filename": p.payload.get("filename"),
-            "file_path": p.payload.get("file_path"),
-            "file_extension": p.payload.get("file_extension"),
-            "timestamp_type": "log_time"                     
-        })
+def migrate_local_db(conn):
+    """Add columns introduced after a table was first created"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(patient_timelines)")}
+    if "built_at" not in columns:
+        try:
+            conn.execute("ALTER TABLE patient_timelines ADD COLUMN built_at REAL")
+        except sqlite3.OperationalError as e:
+            # Another process added it first
+            if "duplicate column" not in str(e):
+                raise
+
+def local_db():
+    """Per-thread connection to the local SQLite state database"""
+    conn = getattr(local_db_state, "conn", None)
+    if conn is None:
+        os.makedirs(LOCAL_STATE_DIR, exist_ok=True)
+        conn = sqlite3.connect(LOCAL_DB_PATH, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # FULL so an acknowledged journal entry survives power loss, not just a crash
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.executescript(LOCAL_DB_SCHEMA)
+        migrate_local_db(conn)
+        conn.execute(
+            "INSERT OR IGNORE INTO tenants (tenant_id, mode, collection, shard_key, created_at) VALUES (?, 'shared', ?, NULL, ?)",
+            (SHARED_TENANT, COLLECTION_NAME, datetime.now(timezone.utc).isoformat())
+        )
+        local_db_state.conn = conn
+    return conn
 
-    return timeline
+# ==================== MULTI-TENANT ROUTING ====================
 
-def compute_timeline_insights(timeline):
-    """Calculate meaningful timeline metrics"""
-    if not timeline:
+@dataclass
+class TenantRoute:
+    tenant_id: str
+    collection: str
+    shard_key: str = None
+    
+    def kwargs(self):
+        """collection_name/shard_key_selector arguments for qdrant_client calls"""
+        kwargs = {"collection_name": self.collection}
+        if self.shard_key:
+            kwargs["shard_key_selector"] = self.shard_key
+        return kwargs
+
+SHARED_ROUTE = TenantRoute(SHARED_TENANT, COLLECTION_NAME)
+
+def tenant_id_for(hospital_name=None, tenant_id=None):
+    slug = re.sub(r"[^a-z0-9]+", "-", (tenant_id or hospital_name or "").lower()).strip("-")
+    return slug if slug and slug not in ("unknown", SHARED_TENANT) else DEFAULT_TENANT
+
+# Payload indexes every events collection should have. Collections created
+# before an index was added here get it at startup or from migrate-collection.
+EVENT_PAYLOAD_INDEXES = {
+    "patient_id": PayloadSchemaType.KEYWORD,
+    "timestamp": PayloadSchemaType.DATETIME,
+    # Downloads without a patient_id look the file up across every tenant
+    "file_path": PayloadSchemaType.KEYWORD,
+    # Upload dedup matches on the file hash
+    "file_sha256": PayloadSchemaType.KEYWORD
+}
+
+def create_events_collection(collection_name, sharded=False):
+    """Create an events collection with the configured storage and index tuning"""
+    qdrant_client.create_collection(
+        collection_name=collection_name,
+        vectors_config=VectorParams(
+            size=VECTOR_DIM,
+            distance=Distance.COSINE,
+            on_disk=QDRANT_ON_DISK_VECTORS
+        ),
+        hnsw_config=hnsw_config(),
+        quantization_config=quantization_config(),
+        on_disk_payload=QDRANT_ON_DISK_PAYLOAD,
+        sharding_method=ShardingMethod.CUSTOM if sharded else None
+    )
+    ensure_payload_indexes(collection_name)
+
+def ensure_payload_indexes(collection_name):
+    """Create any missing EVENT_PAYLOAD_INDEXES on a collection; returns the fields added"""
+    existing = qdrant_client.get_collection(collection_name).payload_schema or {}
+    added = []
+    for field_name, schema in EVENT_PAYLOAD_INDEXES.items():
+        if field_name in existing:
+            continue
+        qdrant_client.create_payload_index(
+            collection_name=collection_name,
+            field_name=field_name,
+            field_schema=schema,
+            wait=True
+        )
+        added.append(field_name)
+    return added
+
+def routing_point_id(kind, key):
+    return str(uuid.uuid5(ROUTING_NAMESPACE, f"{kind}:{key}"))
+
+def routing_point(kind, key, payload):
+    # The routing collection is only read by id and payload filter; the
+    # one-dimensional vector is a placeholder.
+    return PointStruct(id=routing_point_id(kind, key), vector=[0.0], payload={"kind": kind, **payload})
+
+def tenant_point(tenant_id, mode, collection, shard_key, created_at):
+    return routing_point("tenant", tenant_id, {
+        "tenant_id": tenant_id, "mode": mode, "collection": collection,
+        "shard_key": shard_key, "created_at": created_at
+    })
+
+def pin_point(patient_id, tenant_id, assigned_at):
+    return routing_point("patient", patient_id, {
+        "patient_id": patient_id, "tenant_id": tenant_id, "assigned_at": assigned_at
+    })
+
+def ensure_routing_collection():
+    """Create the shared routing collection and push routes still only in local SQLite"""
+    if routing_ready.is_set():
+        return
+    with routing_lock:
+        if routing_ready.is_set():
+            return
+        if not qdrant_client.collection_exists(ROUTING_COLLECTION_NAME):
+            try:
+                qdrant_client.create_collection(
+                    collection_name=ROUTING_COLLECTION_NAME,
+                    vectors_config=VectorParams(size=1, distance=Distance.DOT)
+                )
+            except Exception as e:
+                if "already exists" not in str(e).lower():
+                    raise
+            for field_name in ("kind", "tenant_id"):
+                qdrant_client.create_payload_index(
+                    collection_name=ROUTING_COLLECTION_NAME,
+                    field_name=field_name,
+                    field_schema=PayloadSchemaType.KEYWORD
+                )
+        
+        # Routes written before the routing collection existed live only in
+        # this host's SQLite file. Push the ones Qdrant doesn't have yet.
+        conn = local_db()
+        points = [
+            tenant_point(*row) for row in conn.execute(
+                "SELECT tenant_id, mode, collection, shard_key, created_at FROM tenants WHERE tenant_id != ?",
+                (SHARED_TENANT,)
+            )
+        ] + [
+            pin_point(*row) for row in conn.execute("SELECT patient_id, tenant_id, assigned_at FROM patient_tenants")
+        ]
+        pushed = 0
+        for start in range(0, len(points), 256):
+            batch = points[start:start + 256]
+            existing = {
+                str(p.id) for p in qdrant_client.retrieve(
+                    ROUTING_COLLECTION_NAME, ids=[p.id for p in batch], with_payload=False
+                )
+            }
+            missing = [p for p in batch if p.id not in existing]
+            if missing:
+                qdrant_client.upsert(collection_name=ROUTING_COLLECTION_NAME, points=missing, wait=True)
+                pushed += len(missing)
+        conn.execute("DELETE FROM patient_tenants")
+        if pushed:
+            logger.info(f"🏥 Pushed {pushed} local routes to {ROUTING_COLLECTION_NAME}")
+        routing_ready.set()
+
+def cache_tenant(payload):
+    """Tenants never change once created, so the local copy is kept for good"""
+    local_db().execute(
+        "INSERT OR IGNORE INTO tenants (tenant_id, mode, collection, shard_key, created_at) VALUES (?, ?, ?, ?, ?)",
+        (payload["tenant_id"], payload["mode"], payload["collection"], payload.get("shard_key"), payload["created_at"])
+    )
+
+def tenant_route(tenant_id):
+    if tenant_id == SHARED_TENANT:
+        return SHARED_ROUTE
+    row = local_db().execute(
+        "SELECT tenant_id, collection, shard_key FROM tenants WHERE tenant_id = ?", (tenant_id,)
+    ).fetchone()
+    if row:
+        return TenantRoute(*row)
+    
+    ensure_routing_collection()
+    points = qdrant_client.retrieve(
+        ROUTING_COLLECTION_NAME, ids=[routing_point_id("tenant", tenant_id)], with_payload=True
+    )
+    if not points:
         return None
+    cache_tenant(points[0].payload)
+    return TenantRoute(tenant_id, points[0].payload["collection"], points[0].payload.get("shard_key"))
+
+def routed_tenants():
+    """Every tenant in the shared routing collection, cached for ROUTE_CACHE_SECONDS"""
+    if tenant_list_cache["tenants"] is not None and time.monotonic() - tenant_list_cache["fetched_at"] < ROUTE_CACHE_SECONDS:
+        return tenant_list_cache["tenants"]
     
-    # Sort by timestamp
-    sorted_timeline = sorted(timeline, key=lambda x: datetime.fromisoformat(x["timestamp"]))
-    
-    # Calculate time span
-    first_date = datetime.fromisoformat(sorted_timeline[0]["timestamp"])
-    last_date = datetime.fromisoformat(sorted_timeline[-1]["timestamp"])
-    total_days = (last_date - first_date).days + 1
-    
-    # Calculate activity rate (events per month)
-    months = max(total_days / 30, 1)  # At least 1 month
-    activity_rate = len(timeline) / months
-    
-    # Find longest gap between events
-    max_gap_days = 0
-    for i in range(1, len(sorted_timeline)):
-        prev_date = datetime.fromisoformat(sorted_timeline[i-1]["timestamp"])
-        curr_date = datetime.fromisoformat(sorted_timeline[i]["timestamp"])
-        gap = (curr_date - prev_date).days
-        max_gap_days = max(max_gap_days, gap)
-    
-    # Event type breakdown (percentages)
-    event_types = {}
-    for event in timeline:
-        event_type = event["event_type"]
-        event_types[event_type] = event_types.get(event_type, 0) + 1
-    
-    event_breakdown = {
-        event_type: round((count / len(timeline)) * 100, 1)
-        for event_type, count in event_types.items()
-    }
+    ensure_routing_collection()
+    tenants, offset = [], None
+    while True:
+        points, offset = qdrant_client.scroll(
+            collection_name=ROUTING_COLLECTION_NAME,
+            scroll_filter=Filter(must=[FieldCondition(key="kind", match=MatchValue(value="tenant"))]),
+            limit=256,
+            offset=offset,
+            with_payload=True
+        )
+        tenants.extend(p.payload for p in points)
+        if offset is None:
+            break
+    for payload in tenants:
+        cache_tenant(payload)
+    tenant_list_cache.update(tenants=tenants, fetched_at=time.monotonic())
+    return tenants
+
+def ensure_tenant(tenant_id, mode=TENANCY_MODE):
+    """Create the tenant's shard key or collection and record it in the routing collection"""
+    route = tenant_route(tenant_id)
+    if route:
+        return route
     
-    # Unique care providers
-    hospitals = set(e["hospital_name"] for e in timeline if e["hospital_name"] != "Unknown")
-    doctors = set(e["doctor_name"] for e in timeline if e["doctor_name"] != "Unknown")
-    
-    # Data completeness (percentage of events with doctor/hospital info)
-    complete_events = sum(1 for e in timeline 
-                         if e["doctor_name"] != "Unknown" and e["hospital_name"] != "Unknown")
-    completeness = round((complete_events / len(timeline)) * 100, 1) if timeline else 0
-    
-    # Activity level assessment
-    if activity_rate >= 3:
-        activity_level = "High"
-        activity_desc = "Frequent medical visits"
-    elif activity_rate >= 1:
-        activity_level = "Moderate"
-        activity_desc = "Regular checkups"
-    else:
-        activity_level = "Low"
-        activity_desc = "Infrequent visits"
-    
-    # Continuity assessment (based on gaps)
-    if max_gap_days <= 14:
-        continuity = "Excellent"
-        continuity_desc = "No significant gaps in care"
-    elif max_gap_days <= 60:
-        continuity = "Good"
-        continuity_desc = "Minor gaps between visits"
-    elif max_gap_days <= 180:
-        continuity = "Fair"
-        continuity_desc = "Some gaps in care history"
+    if mode == "shard_key":
+        if not qdrant_client.collection_exists(SHARDED_COLLECTION_NAME):
+            create_events_collection(SHARDED_COLLECTION_NAME, sharded=True)
+        try:
+            qdrant_client.create_shard_key(SHARDED_COLLECTION_NAME, tenant_id)
+        except Exception as e:
+            if "already exists" not in str(e).lower():
+                raise
+        route = TenantRoute(tenant_id, SHARDED_COLLECTION_NAME, tenant_id)
+    elif mode == "collection":
+        route = TenantRoute(tenant_id, f"{COLLECTION_NAME}__{tenant_id}")
+        if not qdrant_client.collection_exists(route.collection):
+            create_events_collection(route.collection)
     else:
-        continuity = "Poor"
-        continuity_desc = "Large gaps in documentation"
+        route = TenantRoute(tenant_id, COLLECTION_NAME)
     
-    return {
-        "activity_rate": round(activity_rate, 1),
-        "activity_level": activity_level,
-        "activity_description": activity_desc,
-        "longest_gap_days": max_gap_days,
-        "continuity": continuity,
-        "continuity_description": continuity_desc,
-        "completeness": completeness,
-        "event_breakdown": event_breakdown,
-        "unique_hospitals": len(hospitals),
-        "unique_doctors": len(doctors),
-        "total_days": total_days,
-        "total_events": len(timeline)
-    }
+    point = tenant_point(tenant_id, mode, route.collection, route.shard_key, datetime.now(timezone.utc).isoformat())
+    qdrant_client.upsert(collection_name=ROUTING_COLLECTION_NAME, points=[point], wait=True)
+    cache_tenant(point.payload)
+    tenant_list_cache["tenants"] = None
+    logger.info(f"🏥 Tenant '{tenant_id}' routed to {route.collection}"
+                + (f" (shard key {route.shard_key})" if route.shard_key else ""))
+    return tenant_route(tenant_id)
 
-def compute_data_quality(timeline):
-    count = len(timeline)
-    if count == 0:
-        return {"label": "No Data", "description": "No medical records available"}
-    
-    times = [datetime.fromisoformat(e["timestamp"]) for e in timeline]
-    span = (max(times) - min(times)).days + 1
-    avg_len = sum(len(e["content"]) for e in timeline) / count
+def route_for_patient(patient_id, cached=True):
+    """Where a patient's events live; unrouted patients are in the shared collection"""
+    entry = patient_route_cache.get(patient_id)
+    if cached and entry and time.monotonic() - entry[1] < ROUTE_CACHE_SECONDS:
+        return entry[0]
     
-    if count >= 6 and span >= 7 and avg_len >= 40:
-        return {"label": "Rich", "description": "Sufficient records for comprehensive analysis"}
-    if count >= 3 and span >= 2:
-        return {"label": "Moderate", "description": "Some continuity present, insights may be limited"}
-    return {"label": "Sparse", "description": "Limited data, interpretation constrained"}
+    ensure_routing_collection()
+    points = qdrant_client.retrieve(
+        ROUTING_COLLECTION_NAME, ids=[routing_point_id("patient", patient_id)], with_payload=True
+    )
+    route = (tenant_route(points[0].payload["tenant_id"]) or SHARED_ROUTE) if points else SHARED_ROUTE
+    if len(patient_route_cache) >= ROUTE_CACHE_MAX_PATIENTS:
+        patient_route_cache.clear()
+    patient_route_cache[patient_id] = (route, time.monotonic())
+    return route
 
-def human_time(iso_ts):
-    if not iso_ts:
-        return "unknown time"
-    dt = datetime.fromisoformat(iso_ts)
-    local_dt = dt.astimezone(LOCAL_TZ)
-    return local_dt.strftime("%b %d, %Y at %I:%M %p")
+def pin_patient(patient_id, tenant_id):
+    ensure_routing_collection()
+    qdrant_client.upsert(
+        collection_name=ROUTING_COLLECTION_NAME,
+        points=[pin_point(patient_id, tenant_id, datetime.now(timezone.utc).isoformat())],
+        wait=True
+    )
+    patient_route_cache[patient_id] = (tenant_route(tenant_id), time.monotonic())
 
-def build_overview_prompt(timeline):
-    entries = "\n".join([
-        (
-            f"- Event was logged on {human_time(e.get('timestamp'))}."
-            f"\n  Type: {e['event_type']}"
-            f"\n  Details: {e['content']}"
-        )
-        for e in timeline
-    ])
+def routed_patient_count(tenant_id=None):
+    ensure_routing_collection()
+    conditions = [FieldCondition(key="kind", match=MatchValue(value="patient"))]
+    if tenant_id:
+        conditions.append(FieldCondition(key="tenant_id", match=MatchValue(value=tenant_id)))
+    return qdrant_client.count(
+        collection_name=ROUTING_COLLECTION_NAME, count_filter=Filter(must=conditions), exact=True
+    ).count
 
-    return f"""
-You are a medical timeline summarization assistant.
+def assign_route(patient_id, hospital_name=None, tenant_id=None):
+    """
+    Route for a write. A patient is pinned to the tenant of their first write
+    so their whole timeline stays on one shard even when they visit other
+    hospitals later.
+    """
+    route = route_for_patient(patient_id)
+    if route is not SHARED_ROUTE or TENANCY_MODE == "shared":
+        return route
+    
+    # Patients with history in the shared collection stay there until
+    # `tenant-migrate` moves them, otherwise their old events would vanish
+    # from timeline reads.
+    legacy = qdrant_client.count(
+        collection_name=COLLECTION_NAME,
+        count_filter=Filter(must=[FieldCondition(key="patient_id", match=MatchValue(value=patient_id))]),
+        exact=False
+    ).count
+    if legacy:
+        tenant = SHARED_ROUTE
+    else:
+        # Only tenants registered with `tenant-create` (or promoted by
+        # `tenant-rebalance`) get their own shard; a free-text hospital name
+        # must not create a collection or shard key on its own.
+        requested = tenant_id_for(hospital_name, tenant_id)
+        tenant = tenant_route(requested)
+        if tenant is None:
+            logger.info(f"🏥 Unregistered tenant '{requested}' for {patient_id}, routing to '{DEFAULT_TENANT}'")
+            tenant = ensure_tenant(DEFAULT_TENANT)
+    pin_patient(patient_id, tenant.tenant_id)
+    return tenant
 
-IMPORTANT CONTEXT:
-- All times refer to documentation (log) time unless explicitly stated as "occurred on".
-- Logged times may differ from actual medical event dates.
-- Do NOT output raw timestamps or ISO date strings.
+def event_routes():
+    """One route per events collection, without shard keys, for full scans"""
+    collections = [COLLECTION_NAME] + [tenant["collection"] for tenant in routed_tenants()]
+    return [TenantRoute(SHARED_TENANT, name) for name in dict.fromkeys(collections)]
 
-STRICT RULES:
-- Do NOT infer exact onset times
-- Do NOT assume events occurred at log time
-- Use clear, human-readable time references only
+def lookup_routes(patient_id=None):
+    """Routes to search when only an id or filename is known"""
+    return [route_for_patient(patient_id)] if patient_id else event_routes()
 
-Timeline:
-{entries}
+# ==================== INGEST JOURNAL ====================
 
-Write a clear, professional medical summary suitable for clinicians.
-"""
+@dataclass
+class JournalPoint:
+    """A journaled event that has not reached Qdrant yet, shaped like a scroll result"""
+    id: str
+    payload: dict
 
+def record_event(event, modality, extra_payload=None, replace=False, tenant_id=None):
+    """Persist an event write; returns 'journaled', 'stored' or 'merged' (duplicate)"""
+    if not INGEST_JOURNAL:
+        points = index_medical_event(event, modality, extra_payload, replace, tenant_id)
+        return "stored" if points else "merged"
+    
+    local_db().execute(
+        "INSERT INTO ingest_journal (event_id, patient_id, tenant_id, modality, replace_chunks, "
+        "event_json, extra_payload, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            event.event_id,
+            event.patient_id,
+            tenant_id,
+            modality,
+            int(replace),
+            json.dumps(event.__dict__),
+            json.dumps(extra_payload) if extra_payload else None,
+            time.time()
+        )
+    )
+    ensure_journal_flusher()
+    journal_wakeup.set()
+    return "journaled"
 
-def ai_explain(prompt):
-    """AI explanation using Groq"""
+def pending_journal_points(patient_id):
+    rows = local_db().execute(
+        "SELECT event_id, modality, event_json, extra_payload FROM ingest_journal WHERE patient_id = ? ORDER BY seq",
+        (patient_id,)
+    ).fetchall()
+    
+    points = {}
+    for event_id, modality, event_json, extra_payload in rows:
+        event = MedicalEvent(**json.loads(event_json))
+        payload = event_payload(event, modality, json.loads(extra_payload) if extra_payload else None)
+        # Later entries for the same event (e.g. extraction write-back) win
+        points[event_id] = JournalPoint(id=event_id, payload={**payload, "journal_status": "pending"})
+    return list(points.values())
+
+def claim_journal_batch():
+    """Claim the oldest ready entries, at most one per event and only its earliest"""
+    now = time.time()
+    claimer = str(os.getpid())
+    conn = local_db()
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        if not groq_client:
-            logger.warning("Groq client not initialized")
-            return "AI analysis unavailable. Groq API not configured."
-        
-        response = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=2048,
-            temperature=0.7
+        # An entry is only eligible once every earlier entry for the same
+        # event has been flushed, so writes to one event apply in order even
+        # with several workers flushing the same journal. Later entries of a
+        # parked event are held back until journal-requeue restores it.
+        rows = conn.execute(
+            "SELECT seq, event_id, tenant_id, modality, replace_chunks, event_json, extra_payload, attempts "
+            "FROM ingest_journal j WHERE next_attempt_at <= ? AND (claimed_by IS NULL OR claimed_at < ?) "
+            "AND NOT EXISTS (SELECT 1 FROM ingest_journal o WHERE o.event_id = j.event_id AND o.seq < j.seq) "
+            "AND NOT EXISTS (SELECT 1 FROM journal_dead d WHERE d.event_id = j.event_id) "
+            "ORDER BY seq LIMIT ?",
+            (now, now - JOURNAL_CLAIM_TIMEOUT_SECONDS, JOURNAL_BATCH_SIZE)
+        ).fetchall()
+        conn.executemany(
+            "UPDATE ingest_journal SET claimed_by = ?, claimed_at = ? WHERE seq = ?",
+            [(claimer, now, row[0]) for row in rows]
         )
-        
-        if response.choices and response.choices[0].message.content:
-            return response.choices[0].message.content
-        else:
-            return "AI returned empty response. Timeline data is still accessible."
-            
-    except Exception as e:
-        error_msg = str(e).lower()
-        
-        if "rate limit" in error_msg or "quota" in error_msg:
-            logger.error(f"Groq rate limit: {e}")
-            return "⚠️ AI rate limit reached. Timeline data is available below."
-        elif "auth" in error_msg or "invalid" in error_msg:
-            logger.error(f"Groq auth failed: {e}")
-            return "⚠️ AI authentication failed. Check GROQ_API_KEY."
-        else:
-            logger.error(f"Groq error: {e}")
-            return "⚠️ AI analysis temporarily unavailable. Timeline data is still visible below."
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return rows
 
-# ==================== ERROR HANDLERS ====================
+def write_journal_rows(rows):
+    """Embed and upsert claimed journal entries; raises if any write fails"""
+    items = [
+        (MedicalEvent(**json.loads(event_json)), modality, json.loads(extra) if extra else None, tenant_id)
+        for _, _, tenant_id, modality, _, event_json, extra, _ in rows
+    ]
+    prepared = dedup_event_points(prepare_event_batch(items), [row[4] for row in rows])
+    
+    groups = {}
+    for row, pair in zip(rows, prepared):
+        if pair is None:
+            continue
+        route, points = pair
+        if row[4]:
+            delete_event_chunks(row[1], route)
+        groups.setdefault((route.collection, route.shard_key), (route, []))[1].extend(points)
+    for route, points in groups.values():
+        qdrant_client.upsert(**route.kwargs(), points=points, wait=True)
+        apply_timeline_events(points)
+    mark_cohort_dirty(event.patient_id for event, *_ in items)
 
-@app.errorhandler(404)
-def not_found(error):
-    return jsonify({"error": "Endpoint not found"}), 404
+def fail_journal_rows(rows, error):
+    """Back off failed entries; a lone entry out of attempts is parked in journal_dead"""
+    now = time.time()
+    parked = [row for row in rows if len(rows) == 1 and row[7] + 1 >= JOURNAL_MAX_ATTEMPTS]
+    retried = [row for row in rows if row not in parked]
+    
+    conn = local_db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "UPDATE ingest_journal SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?, "
+            "claimed_by = NULL, claimed_at = NULL WHERE seq = ?",
+            [(now + min(2 ** (row[7] + 1), JOURNAL_MAX_BACKOFF_SECONDS), str(error), row[0]) for row in retried]
+        )
+        for row in parked:
+            conn.execute(
+                "INSERT OR REPLACE INTO journal_dead (seq, event_id, patient_id, tenant_id, modality, replace_chunks, "
+                "event_json, extra_payload, created_at, attempts, last_error, parked_at) "
+                "SELECT seq, event_id, patient_id, tenant_id, modality, replace_chunks, event_json, extra_payload, "
+                "created_at, attempts + 1, ?, ? FROM ingest_journal WHERE seq = ?",
+                (str(error), now, row[0])
+            )
+            conn.execute("DELETE FROM ingest_journal WHERE seq = ?", (row[0],))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    
+    journal_metrics["failed_batches"] += 1
+    journal_metrics["parked_events"] += len(parked)
+    journal_metrics["last_error"] = str(error)
+    if parked:
+        logger.error(f"❌ Journal entry for event {parked[0][1][:8]}... failed {JOURNAL_MAX_ATTEMPTS} times, "
+                     f"parked in journal_dead: {error}")
+    else:
+        logger.warning(f"⚠️  Journal flush failed for {len(rows)} events, will retry: {error}")
 
-@app.errorhandler(500)
-def internal_error(error):
-    logger.error(f"Internal server error: {error}")
-    return jsonify({"error": "Internal server error"}), 500
+def flush_journal_batch():
+    """Embed and upsert one batch of journal entries; returns the number flushed"""
+    rows = claim_journal_batch()
+    if not rows:
+        return 0
+    
+    # Entries that already failed in a batch are retried one at a time, so a
+    # single bad record can't hold back the others or retry forever.
+    fresh = [row for row in rows if not row[7]]
+    groups = ([fresh] if fresh else []) + [[row] for row in rows if row[7]]
+    
+    flushed = 0
+    for group in groups:
+        try:
+            write_journal_rows(group)
+        except Exception as e:
+            fail_journal_rows(group, e)
+            continue
+        local_db().executemany("DELETE FROM ingest_journal WHERE seq = ?", [(row[0],) for row in group])
+        flushed += len(group)
+    
+    if flushed:
+        journal_metrics["flushed_events"] += flushed
+        journal_metrics["last_flush_at"] = datetime.now(timezone.utc).isoformat()
+    return flushed
+
+def journal_flush_loop():
+    logger.info(f"📒 Ingest journal flusher started (pid {os.getpid()})")
+    while not journal_stop.is_set():
+        journal_wakeup.wait(JOURNAL_FLUSH_INTERVAL_SECONDS)
+        journal_wakeup.clear()
+        try:
+            while flush_journal_batch():
+                pass
+        except Exception as e:
+            journal_metrics["last_error"] = str(e)
+            logger.error(f"Journal flusher error: {e}")
+
+def ensure_journal_flusher():
+    """Start the flusher in this process (threads don't survive a gunicorn fork)"""
+    global journal_flusher
+    if journal_flusher and journal_flusher.is_alive():
+        return
+    journal_flusher = threading.Thread(target=journal_flush_loop, name="journal-flusher", daemon=True)
+    journal_flusher.start()
+
+def journal_status():
+    pending, oldest, retrying = local_db().execute(
+        "SELECT COUNT(*), MIN(created_at), SUM(attempts > 0) FROM ingest_journal"
+    ).fetchone()
+    dead = local_db().execute("SELECT COUNT(*) FROM journal_dead").fetchone()[0]
+    held = local_db().execute(
+        "SELECT COUNT(*) FROM ingest_journal j WHERE EXISTS (SELECT 1 FROM journal_dead d WHERE d.event_id = j.event_id)"
+    ).fetchone()[0]
+    return {
+        "enabled": INGEST_JOURNAL,
+        "pending_events": pending,
+        "retrying_events": retrying or 0,
+        "dead_events": dead,
+        "held_events": held,
+        "lag_seconds": round(time.time() - oldest, 1) if oldest else 0,
+        **journal_metrics
+    }
+
+@app.before_request
+def start_journal_flusher():
+    if INGEST_JOURNAL:
+        ensure_journal_flusher()
+
+# ==================== MATERIALIZED TIMELINES ====================
+
+# Each patient's sorted timeline plus its insights lives in patient_timelines
+# as one JSON document. Writes apply their events to it in place; deletions
+# clear it (view = NULL) and the next read rebuilds it from Qdrant. version
+# increases on every change so a rebuild that raced a write is not stored.
+# built_at is when the view was last rebuilt from Qdrant; patches keep it, so
+# views expire after TIMELINE_VIEW_MAX_AGE_SECONDS even on a busy patient.
+
+def timeline_view(timeline):
+    if not timeline:
+        return None
+    if len(timeline) == 1:
+        insights = single_event_response(timeline)["timeline_insights"]
+    else:
+        insights = compute_timeline_insights(timeline)
+    return {
+        "timeline": timeline,
+        "timeline_insights": insights,
+        "data_quality": compute_data_quality(timeline)
+    }
+
+def read_timeline_view(patient_id, max_age=None):
+    """
+    (view or None, version or None) from the local store. A view built from
+    Qdrant more than max_age seconds ago (default TIMELINE_VIEW_MAX_AGE_SECONDS)
+    reads as a miss; max_age=0 returns it regardless of age.
+    """
+    row = local_db().execute(
+        "SELECT view, version, built_at FROM patient_timelines WHERE patient_id = ?", (patient_id,)
+    ).fetchone()
+    if row is None:
+        return None, None
+    max_age = TIMELINE_VIEW_MAX_AGE_SECONDS if max_age is None else max_age
+    if max_age and (row[2] is None or time.time() - row[2] > max_age):
+        return None, row[1]
+    return (json.loads(row[0]) if row[0] else None), row[1]
+
+def materialize_timeline(patient_id, points, version):
+    """Build a view from stored points and keep it unless the patient was written meanwhile"""
+    view = timeline_view(build_patient_timeline(points))
+    encoded = json.dumps(view) if view else None
+    if version is None and view is None:
+        return None  # unknown patient; don't keep a row for it
+    if version is None:
+        local_db().execute(
+            "INSERT OR IGNORE INTO patient_timelines (patient_id, view, version, updated_at, built_at) "
+            "VALUES (?, ?, 0, ?, ?)",
+            (patient_id, encoded, time.time(), time.time())
+        )
+    else:
+        local_db().execute(
+            "UPDATE patient_timelines SET view = ?, updated_at = ?, built_at = ? WHERE patient_id = ? AND version = ?",
+            (encoded, time.time(), time.time(), patient_id, version)
+        )
+    return view
+
+def overlay_pending(patient_id, view):
+    """Merge journaled events that haven't reached Qdrant yet into a view"""
+    pending = pending_journal_points(patient_id) if INGEST_JOURNAL else []
+    if not pending:
+        return view
+    pending_timeline = build_patient_timeline(pending)
+    pending_ids = {entry["event_id"] for entry in pending_timeline}
+    timeline = [e for e in (view["timeline"] if view else []) if e["event_id"] not in pending_ids]
+    timeline.extend(pending_timeline)
+    return timeline_view(sorted(timeline, key=lambda e: datetime.fromisoformat(e["timestamp"])))
+
+def load_patient_timeline(patient_id):
+    """Timeline, insights and data quality via one key lookup, rebuilding from Qdrant on a miss"""
+    view, version = read_timeline_view(patient_id)
+    if view is None:
+        view = materialize_timeline(patient_id, fetch_timeline_events(patient_id), version)
+    return overlay_pending(patient_id, view)
+
+def apply_timeline_events(points):
+    """Insert or replace freshly upserted parent events in their patients' views"""
+    by_patient = {}
+    for p in points:
+        if p.payload.get("record_type") != "chunk":
+            by_patient.setdefault(p.payload["patient_id"], []).append(timeline_entry(p))
+    
+    conn = local_db()
+    for patient_id, entries in by_patient.items():
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT view FROM patient_timelines WHERE patient_id = ?", (patient_id,)).fetchone()
+            view = None
+            if row and row[0]:
+                entry_ids = {e["event_id"] for e in entries}
+                timeline = [e for e in json.loads(row[0])["timeline"] if e["event_id"] not in entry_ids]
+                timeline.extend(entries)
+                view = timeline_view(sorted(timeline, key=lambda e: datetime.fromisoformat(e["timestamp"])))
+            # Without a materialized view there is nothing to patch; bumping the
+            # version still stops an in-flight rebuild from storing a stale one.
+            conn.execute(
+                "INSERT INTO patient_timelines (patient_id, view, version, updated_at) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (patient_id) DO UPDATE SET view = excluded.view, version = version + 1, "
+                "updated_at = excluded.updated_at",
+                (patient_id, json.dumps(view) if view else None, time.time())
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+def invalidate_timelines(patient_ids):
+    """Drop materialized views so the next read rebuilds them from Qdrant"""
+    local_db().executemany(
+        "UPDATE patient_timelines SET view = NULL, version = version + 1, updated_at = ? WHERE patient_id = ?",
+        [(time.time(), patient_id) for patient_id in set(patient_ids)]
+    )
+
+def patient_events_changed(patient_ids):
+    """For bulk writes and deletions: refresh cohort metrics and rebuild timelines lazily"""
+    patient_ids = set(patient_ids)
+    mark_cohort_dirty(patient_ids)
+    invalidate_timelines(patient_ids)
+
+# ==================== COHORT SNAPSHOTS ====================
+
+def mark_cohort_dirty(patient_ids):
+    """Queue patients whose events changed for the next incremental cohort refresh"""
+    now = time.time()
+    local_db().executemany(
+        "INSERT OR REPLACE INTO cohort_dirty_patients (patient_id, marked_at) VALUES (?, ?)",
+        [(patient_id, now) for patient_id in set(patient_ids)]
+    )
+
+def cohort_partitions(patient_ids=None):
+    """
+    Split patients (every stored patient, or just these) into partitions by
+    hash. Each partition is a list of scroll arguments that its worker runs
+    itself, so the parent never holds the events.
+    """
+    if patient_ids is None:
+        pairs = ((route, patient_id) for route in event_routes() for patient_id in stored_patients(route))
+    else:
+        pairs = ((route_for_patient(patient_id), patient_id) for patient_id in patient_ids)
+    
+    # A patient's events all land in one partition, even across collections
+    partitions = [{} for _ in range(max(COHORT_WORKERS, 1) * 4)]
+    patients = 0
+    for route, patient_id in pairs:
+        part = partitions[zlib.crc32(patient_id.encode()) % len(partitions)]
+        part.setdefault((route.collection, route.shard_key), (route, []))[1].append(patient_id)
+        patients += 1
+    
+    scrolls = [
+        [
+            {
+                **route.kwargs(),
+                "scroll_filter": Filter(
+                    must=[FieldCondition(key="patient_id", match=MatchAny(any=ids[start:start + COHORT_PATIENTS_PER_SCROLL]))],
+                    must_not=[CHUNK_CONDITION]
+                )
+            }
+            for route, ids in part.values()
+            for start in range(0, len(ids), COHORT_PATIENTS_PER_SCROLL)
+        ]
+        for part in partitions if part
+    ]
+    return scrolls, patients
+
+def compute_cohort_partitions(partitions, patients):
+    if COHORT_WORKERS <= 1 or patients < COHORT_PARALLEL_MIN_PATIENTS:
+        return [partition_metrics(scrolls, qdrant_client) for scrolls in partitions]
+    # spawn: the refresher runs in a thread, and forking a threaded process
+    # can copy held locks into the child. Workers only import cohort.py.
+    with ProcessPoolExecutor(max_workers=COHORT_WORKERS, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(partition_metrics, partitions))
+
+def store_cohort_snapshot(results, patient_ids=None):
+    """Replace snapshot rows of the refreshed patients, or all rows when patient_ids is None"""
+    refreshed_at = datetime.now(timezone.utc).isoformat()
+    conn = local_db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if patient_ids is None:
+            conn.execute("DELETE FROM cohort_patients")
+            conn.execute("DELETE FROM cohort_event_mix")
+        else:
+            conn.executemany("DELETE FROM cohort_patients WHERE patient_id = ?", [(p,) for p in patient_ids])
+            conn.executemany("DELETE FROM cohort_event_mix WHERE patient_id = ?", [(p,) for p in patient_ids])
+        for patient_rows, mix_rows in results:
+            conn.executemany(
+                "INSERT INTO cohort_patients (patient_id, events, first_event_at, last_event_at, total_days, "
+                "activity_rate, activity_level, longest_gap_days, median_gap_days, refreshed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(str(row[0]), *row[1:], refreshed_at) for row in patient_rows]
+            )
+            conn.executemany(
+                "INSERT INTO cohort_event_mix (patient_id, hospital_name, doctor_name, event_type, events) "
+                "VALUES (?, ?, ?, ?, ?)",
+                mix_rows
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def start_cohort_refresh(mode, min_interval):
+    """Log a refresh start unless one started within min_interval seconds; returns its id"""
+    now = time.time()
+    conn = local_db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        last = conn.execute("SELECT MAX(started_at) FROM cohort_refreshes").fetchone()[0]
+        if last and now - last < min_interval:
+            conn.execute("ROLLBACK")
+            return None
+        refresh_id = conn.execute(
+            "INSERT INTO cohort_refreshes (mode, started_at) VALUES (?, ?)", (mode, now)
+        ).lastrowid
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return refresh_id
+
+def refresh_cohort(full=False, min_interval=0):
+    """
+    Recompute cohort snapshots for patients marked dirty since the last
+    refresh, or for every patient when full. Returns stats, or None if
+    another process refreshed within min_interval.
+    """
+    conn = local_db()
+    dirty = None
+    # Without a finished full refresh there is no snapshot for the dirty
+    # patients to update, so the first run is always full. Writes on other
+    # hosts never mark patients dirty here, so a full run is also due once
+    # the last one is older than COHORT_FULL_REFRESH_INTERVAL_SECONDS.
+    last_full = conn.execute(
+        "SELECT MAX(finished_at) FROM cohort_refreshes WHERE mode = 'full'"
+    ).fetchone()[0]
+    full_due = last_full is None or (
+        COHORT_FULL_REFRESH_INTERVAL_SECONDS and time.time() - last_full > COHORT_FULL_REFRESH_INTERVAL_SECONDS
+    )
+    if not full and not full_due:
+        dirty = [row[0] for row in conn.execute("SELECT patient_id FROM cohort_dirty_patients")]
+        if len(dirty) > COHORT_FULL_REFRESH_PATIENTS:
+            dirty = None
+    mode = "full" if dirty is None else "incremental"
+    
+    refresh_id = start_cohort_refresh(mode, min_interval)
+    if refresh_id is None:
+        return None
+    started = conn.execute("SELECT started_at FROM cohort_refreshes WHERE id = ?", (refresh_id,)).fetchone()[0]
+    
+    results = []
+    if dirty is None or dirty:
+        results = compute_cohort_partitions(*cohort_partitions(dirty))
+        store_cohort_snapshot(results, dirty)
+    # Patients written while this refresh was scanning stay dirty for the next one
+    if dirty is None:
+        conn.execute("DELETE FROM cohort_dirty_patients WHERE marked_at < ?", (started,))
+    else:
+        conn.executemany(
+            "DELETE FROM cohort_dirty_patients WHERE patient_id = ? AND marked_at < ?",
+            [(patient_id, started) for patient_id in dirty]
+        )
+    
+    stats = {
+        "mode": mode,
+        "patients": sum(len(patient_rows) for patient_rows, _ in results),
+        "events": sum(row[1] for patient_rows, _ in results for row in patient_rows),
+        "seconds": round(time.time() - started, 2)
+    }
+    conn.execute(
+        "UPDATE cohort_refreshes SET finished_at = ?, patients = ?, events = ? WHERE id = ?",
+        (time.time(), stats["patients"], stats["events"], refresh_id)
+    )
+    return stats
+
+def cohort_refresh_loop():
+    logger.info(f"👥 Cohort refresher started (pid {os.getpid()}, every {COHORT_REFRESH_INTERVAL_SECONDS}s)")
+    while not maintenance_stop.wait(COHORT_REFRESH_INTERVAL_SECONDS):
+        try:
+            stats = refresh_cohort(min_interval=COHORT_REFRESH_INTERVAL_SECONDS)
+            if stats and stats["patients"]:
+                logger.info(f"👥 Cohort snapshot refreshed: {stats['patients']} patients in {stats['seconds']}s")
+        except Exception as e:
+            logger.error(f"Cohort refresh error: {e}")
+
+def ensure_cohort_refresher():
+    global cohort_refresher
+    if COHORT_REFRESH_INTERVAL_SECONDS <= 0 or (cohort_refresher and cohort_refresher.is_alive()):
+        return
+    cohort_refresher = threading.Thread(target=cohort_refresh_loop, name="cohort-refresher", daemon=True)
+    cohort_refresher.start()
+
+@app.before_request
+def start_cohort_refresher():
+    ensure_cohort_refresher()
+
+def cohort_snapshot_status():
+    conn = local_db()
+    last = conn.execute(
+        "SELECT mode, started_at, finished_at, patients, events FROM cohort_refreshes "
+        "WHERE finished_at IS NOT NULL ORDER BY id DESC LIMIT 1"
+    ).fetchone()
+    return {
+        "last_refresh": {
+            "mode": last[0],
+            "finished_at": datetime.fromtimestamp(last[2], timezone.utc).isoformat(),
+            "age_seconds": round(time.time() - last[2], 1),
+            "patients": last[3],
+            "events": last[4]
+        } if last else None,
+        "dirty_patients": conn.execute("SELECT COUNT(*) FROM cohort_dirty_patients").fetchone()[0]
+    }
+
+def cohort_summary(hospital_name=None, doctor_name=None):
+    """Activity levels, gap-day percentiles and event-type mix from the snapshot tables"""
+    conditions, params = [], []
+    if hospital_name:
+        conditions.append("hospital_name = ?")
+        params.append(hospital_name)
+    if doctor_name:
+        conditions.append("doctor_name = ?")
+        params.append(doctor_name)
+    mix_where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # A patient belongs to a hospital or doctor cohort if any of their events does
+    patient_where = f"WHERE patient_id IN (SELECT patient_id FROM cohort_event_mix {mix_where})" if conditions else ""
+    
+    conn = local_db()
+    levels = dict(conn.execute(
+        f"SELECT activity_level, COUNT(*) FROM cohort_patients {patient_where} GROUP BY activity_level", params
+    ).fetchall())
+    gaps = conn.execute(
+        f"SELECT longest_gap_days, median_gap_days FROM cohort_patients {patient_where} "
+        f"{'AND' if patient_where else 'WHERE'} events > 1",
+        params
+    ).fetchall()
+    mix = conn.execute(
+        f"SELECT event_type, SUM(events) FROM cohort_event_mix {mix_where} GROUP BY event_type ORDER BY 2 DESC", params
+    ).fetchall()
+    
+    patients = sum(levels.values())
+    events = sum(count for _, count in mix)
+    return {
+        "patients": patients,
+        "events": events,
+        "activity_levels": {
+            level: {"patients": levels[level], "percent": round(levels[level] / patients * 100, 1)}
+            for level in ("High", "Moderate", "Low", "N/A") if level in levels
+        },
+        "longest_gap_days": percentiles([row[0] for row in gaps]),
+        "median_gap_days": percentiles([row[1] for row in gaps]),
+        "event_type_mix": {
+            event_type: {"events": count, "percent": round(count / events * 100, 1)}
+            for event_type, count in mix
+        }
+    }
+
+# ==================== STORAGE COMPACTION ====================
+
+DOCUMENT_CONDITION = FieldCondition(key="modality", match=MatchValue(value="document"))
+
+def journal_file_paths():
+    """Uploads referenced by journal entries that haven't reached Qdrant yet"""
+    rows = local_db().execute(
+        "SELECT extra_payload FROM ingest_journal WHERE modality = 'document' AND extra_payload IS NOT NULL"
+    ).fetchall()
+    return {json.loads(row[0]).get("file_path") for row in rows} - {None}
+
+def stored_file_references():
+    """file_path -> [(route, point)] for every document event, via paginated scrolls"""
+    references = {}
+    for route in event_routes():
+        for points in iter_event_pages(
+            Filter(must=[DOCUMENT_CONDITION], must_not=[CHUNK_CONDITION]),
+            payload_fields=["file_path", "storage_tier", "file_missing", "timestamp", "patient_id"],
+            routes=[route]
+        ):
+            for p in points:
+                if p.payload.get("file_path"):
+                    references.setdefault(p.payload["file_path"], []).append((route, p))
+    return references
+
+def event_age_seconds(payload, now):
+    return now - datetime.fromisoformat(payload["timestamp"]).timestamp()
+
+def archive_upload(filename):
+    """Gzip an upload into cold storage and remove the hot copy; returns the bytes saved"""
+    hot_path = os.path.join(UPLOADS_DIR, filename)
+    cold_path = os.path.join(COLD_STORAGE_DIR, f"{filename}.gz")
+    os.makedirs(COLD_STORAGE_DIR, exist_ok=True)
+    
+    # Written under a temporary name so a crash never leaves a truncated cold copy
+    with open(hot_path, "rb") as src, open(f"{cold_path}.tmp", "wb") as raw:
+        with gzip.GzipFile(filename=filename, mode="wb", fileobj=raw) as dst:
+            shutil.copyfileobj(src, dst)
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(f"{cold_path}.tmp", cold_path)
+    return os.path.getsize(hot_path) - os.path.getsize(cold_path)
+
+def expire_events(report, dry_run):
+    """Delete events older than STORAGE_RETENTION_DAYS, chunks included"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=STORAGE_RETENTION_DAYS)
+    expired = Filter(must=[FieldCondition(key="timestamp", range=DatetimeRange(lt=cutoff))])
+    for route in event_routes():
+        count = qdrant_client.count(**route.kwargs(), count_filter=expired, exact=True).count
+        if not count:
+            continue
+        report["expired_points"] += count
+        if dry_run:
+            continue
+        patients = set()
+        for points in iter_event_pages(expired, payload_fields=["patient_id"], routes=[route]):
+            patients.update(p.payload["patient_id"] for p in points)
+        qdrant_client.delete(**route.kwargs(), points_selector=FilterSelector(filter=expired))
+        patient_events_changed(patients)
+
+def remove_orphan_files(references, pending, report, now, dry_run):
+    """
+    Move hot or cold files no event or journal entry refers to into quarantine.
+    Skipped when nothing is referenced or too many files look orphaned.
+    """
+    total_files = 0
+    orphans = []
+    for directory, suffix in ((UPLOADS_DIR, None), (COLD_STORAGE_DIR, ".gz")):
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.scandir(directory):
+            if not entry.is_file():
+                continue
+            total_files += 1
+            # Leftover .gz.tmp files from an interrupted archive never match a reference
+            name = entry.name[:-len(suffix)] if suffix and entry.name.endswith(suffix) else entry.name
+            stat = entry.stat()
+            if name in references or name in pending or now - stat.st_mtime < STORAGE_GRACE_HOURS * 3600:
+                continue
+            orphans.append((entry, stat.st_size, directory == COLD_STORAGE_DIR))
+    
+    if not orphans:
+        return
+    if not references:
+        report["orphan_cleanup_skipped"] = "no document events found in Qdrant"
+        logger.warning(f"⚠️  Skipping orphan cleanup: {report['orphan_cleanup_skipped']}")
+        return
+    if len(orphans) > STORAGE_ORPHAN_FILE_MAX_FRACTION * total_files:
+        report["orphan_cleanup_skipped"] = (
+            f"{len(orphans)} of {total_files} upload files unreferenced "
+            f"(limit {STORAGE_ORPHAN_FILE_MAX_FRACTION:.0%})"
+        )
+        logger.warning(f"⚠️  Skipping orphan cleanup: {report['orphan_cleanup_skipped']}")
+        return
+    
+    for entry, size, cold in orphans:
+        report["orphan_files"] += 1
+        if dry_run:
+            continue
+        target_dir = os.path.join(STORAGE_QUARANTINE_DIR, "cold") if cold else STORAGE_QUARANTINE_DIR
+        os.makedirs(target_dir, exist_ok=True)
+        target = os.path.join(target_dir, entry.name)
+        os.replace(entry.path, target)
+        # The quarantine clock starts now, not at upload time
+        os.utime(target)
+        logger.info(f"🗃️  Quarantined orphan upload {entry.name}")
+
+def purge_quarantine(report, now, dry_run):
+    """Delete quarantined files older than STORAGE_QUARANTINE_DAYS"""
+    if not STORAGE_QUARANTINE_DAYS:
+        return
+    for directory in (STORAGE_QUARANTINE_DIR, os.path.join(STORAGE_QUARANTINE_DIR, "cold")):
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.scandir(directory):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if now - stat.st_mtime < STORAGE_QUARANTINE_DAYS * 86400:
+                continue
+            report["purged_files"] += 1
+            report["reclaimed_bytes"] += stat.st_size
+            if not dry_run:
+                os.remove(entry.path)
+
+def uploads_present():
+    """True if uploads/ (hot or cold) holds at least one file"""
+    for directory in (UPLOADS_DIR, COLD_STORAGE_DIR):
+        if os.path.isdir(directory) and any(entry.is_file() for entry in os.scandir(directory)):
+            return True
+    return False
+
+def reconcile_file_references(references, pending, report, now, dry_run, delete_orphans=False):
+    """
+    Flag (or with delete_orphans, delete) events whose file is gone, archive
+    old uploads and fix storage_tier payloads. Skipped entirely when uploads/
+    looks unmounted or too many files are missing.
+    """
+    if references and not uploads_present():
+        report["reconcile_skipped"] = f"{UPLOADS_DIR} is missing or empty"
+        logger.warning(f"⚠️  Skipping file reconcile: {report['reconcile_skipped']}")
+        return
+    
+    locations = {filename: upload_location(filename) for filename in references}
+    missing = {}
+    missing_refs = 0
+    for filename, refs in references.items():
+        if locations[filename][0] is not None or filename in pending:
+            continue
+        for route, p in refs:
+            if event_age_seconds(p.payload, now) >= STORAGE_GRACE_HOURS * 3600:
+                entry = missing.setdefault((route.collection, route.shard_key), (route, [], set()))
+                entry[1].append(str(p.id))
+                entry[2].add(p.payload["patient_id"])
+                missing_refs += 1
+    
+    total_refs = sum(len(refs) for refs in references.values())
+    if missing_refs > STORAGE_MISSING_FILE_MAX_FRACTION * total_refs:
+        report["reconcile_skipped"] = (
+            f"{missing_refs} of {total_refs} document files missing "
+            f"(limit {STORAGE_MISSING_FILE_MAX_FRACTION:.0%})"
+        )
+        logger.warning(f"⚠️  Skipping file reconcile: {report['reconcile_skipped']}")
+        return
+    
+    for filename, refs in references.items():
+        path, tier = locations[filename]
+        if path is None:
+            continue
+        
+        if (
+            tier == "hot"
+            and STORAGE_COLD_AFTER_DAYS
+            and all(event_age_seconds(p.payload, now) >= STORAGE_COLD_AFTER_DAYS * 86400 for _, p in refs)
+        ):
+            report["archived_files"] += 1
+            if dry_run:
+                continue
+            report["reclaimed_bytes"] += archive_upload(filename)
+            tier = "cold"
+        
+        stale = [
+            (route, p) for route, p in refs
+            if p.payload.get("storage_tier", "hot") != tier or p.payload.get("file_missing")
+        ]
+        if stale and not dry_run:
+            for route, p in stale:
+                qdrant_client.set_payload(
+                    **route.kwargs(),
+                    payload={"storage_tier": tier, "file_missing": False},
+                    points=[p.id]
+                )
+        # The payload points at the cold copy before the hot one disappears
+        if tier == "cold" and not dry_run and os.path.isfile(os.path.join(UPLOADS_DIR, filename)):
+            os.remove(os.path.join(UPLOADS_DIR, filename))
+    
+    for route, event_ids, patients in missing.values():
+        report["missing_file_events"] += len(event_ids)
+        if not delete_orphans:
+            # Kept for review; `compact-storage --delete-orphans` removes them
+            if not dry_run:
+                qdrant_client.set_payload(
+                    **route.kwargs(),
+                    payload={"file_missing": True, "file_missing_since": datetime.now(timezone.utc).isoformat()},
+                    points=event_ids
+                )
+            continue
+        if dry_run:
+            report["reclaimed_points"] += len(event_ids)
+            continue
+        report["reclaimed_points"] += delete_events(route, event_ids)
+        patient_events_changed(patients)
+
+def compact_storage(dry_run=False, delete_orphans=False):
+    """
+    Reconcile uploads/ against document payloads in every events collection,
+    apply retention, and return a report of what was (or would be) reclaimed.
+    """
+    started = time.monotonic()
+    now = time.time()
+    report = Counter()
+    
+    if STORAGE_RETENTION_DAYS:
+        expire_events(report, dry_run)
+        report["reclaimed_points"] += report["expired_points"]
+    
+    references = stored_file_references()
+    pending = journal_file_paths()
+    purge_quarantine(report, now, dry_run)
+    remove_orphan_files(references, pending, report, now, dry_run)
+    reconcile_file_references(references, pending, report, now, dry_run, delete_orphans)
+    
+    return {
+        "dry_run": dry_run,
+        "documents": sum(len(refs) for refs in references.values()),
+        "orphan_files": report["orphan_files"],
+        "orphan_cleanup_skipped": report.get("orphan_cleanup_skipped"),
+        "purged_files": report["purged_files"],
+        "missing_file_events": report["missing_file_events"],
+        "missing_file_action": "delete" if delete_orphans else "flag",
+        "reconcile_skipped": report.get("reconcile_skipped"),
+        "expired_points": report["expired_points"],
+        "archived_files": report["archived_files"],
+        "reclaimed_bytes": report["reclaimed_bytes"],
+        "reclaimed_points": report["reclaimed_points"],
+        "seconds": round(time.monotonic() - started, 2)
+    }
+
+def run_storage_compaction(min_interval=0, delete_orphans=False):
+    """compact_storage() at most once per min_interval across processes; logs the report"""
+    now = time.time()
+    conn = local_db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        last = conn.execute("SELECT MAX(started_at) FROM storage_compactions").fetchone()[0]
+        if last and now - last < min_interval:
+            conn.execute("ROLLBACK")
+            return None
+        run_id = conn.execute("INSERT INTO storage_compactions (started_at) VALUES (?)", (now,)).lastrowid
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    
+    report = compact_storage(delete_orphans=delete_orphans)
+    conn.execute(
+        "UPDATE storage_compactions SET finished_at = ?, report = ? WHERE id = ?",
+        (time.time(), json.dumps(report), run_id)
+    )
+    return report
+
+def storage_compaction_loop():
+    logger.info(f"🧹 Storage compactor started (pid {os.getpid()}, every {STORAGE_COMPACTION_INTERVAL_SECONDS}s)")
+    while not maintenance_stop.wait(STORAGE_COMPACTION_INTERVAL_SECONDS):
+        try:
+            report = run_storage_compaction(min_interval=STORAGE_COMPACTION_INTERVAL_SECONDS)
+            if report:
+                logger.info(f"🧹 Storage compacted: {report['reclaimed_bytes']} bytes, "
+                            f"{report['reclaimed_points']} points reclaimed")
+        except Exception as e:
+            logger.error(f"Storage compaction error: {e}")
+
+def ensure_storage_compactor():
+    global storage_compactor
+    if STORAGE_COMPACTION_INTERVAL_SECONDS <= 0 or (storage_compactor and storage_compactor.is_alive()):
+        return
+    storage_compactor = threading.Thread(target=storage_compaction_loop, name="storage-compactor", daemon=True)
+    storage_compactor.start()
+
+@app.before_request
+def start_storage_compactor():
+    ensure_storage_compactor()
+
+def storage_status():
+    row = local_db().execute(
+        "SELECT finished_at, report FROM storage_compactions WHERE finished_at IS NOT NULL ORDER BY id DESC LIMIT 1"
+    ).fetchone()
+    return {
+        "cold_after_days": STORAGE_COLD_AFTER_DAYS,
+        "retention_days": STORAGE_RETENTION_DAYS,
+        "compaction_interval_seconds": STORAGE_COMPACTION_INTERVAL_SECONDS,
+        "last_compaction": {
+            "finished_at": datetime.fromtimestamp(row[0], timezone.utc).isoformat(),
+            **json.loads(row[1])
+        } if row else None
+    }
+
+# ==================== HELPER FUNCTIONS ====================
+
+def require_admin_token():
+    """Returns an error response unless the request carries ADMIN_API_TOKEN"""
+    if not ADMIN_API_TOKEN:
+        return jsonify({"error": "Admin endpoints disabled (ADMIN_API_TOKEN not set)"}), 403
+    supplied = request.headers.get("Authorization", "").encode()
+    if not hmac.compare_digest(supplied, f"Bearer {ADMIN_API_TOKEN}".encode()):
+        return jsonify({"error": "Invalid admin token"}), 401
+    return None
+
+def create_medical_event(content, patient_id, event_type, timestamp=None, doctor_name="", hospital_name=""):
+    log_time_utc = (
+        datetime.fromisoformat(timestamp).astimezone(timezone.utc)
+        if timestamp
+        else datetime.now(timezone.utc)
+    )
+    return MedicalEvent(
+        event_id=str(uuid.uuid4()),
+        patient_id=patient_id,
+        timestamp=log_time_utc.isoformat(),
+        event_type=event_type,
+        modality="text",
+        content=content,
+        doctor_name=doctor_name,
+        hospital_name=hospital_name
+    )
+
+def quantization_config():
+    if QDRANT_QUANTIZATION == "int8":
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(
+            type=ScalarType.INT8,
+            quantile=0.99,
+            always_ram=QDRANT_QUANTIZATION_ALWAYS_RAM
+        ))
+    if QDRANT_QUANTIZATION == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=QDRANT_QUANTIZATION_ALWAYS_RAM))
+    return None
+
+def hnsw_config():
+    return HnswConfigDiff(m=HNSW_M, ef_construct=HNSW_EF_CONSTRUCT)
+
+def search_params(hnsw_ef=HNSW_EF, rescore=QDRANT_RESCORE, exact=False):
+    """Search-time HNSW ef and quantization rescoring for the configured collection"""
+    quantization = None
+    if QDRANT_QUANTIZATION in ("int8", "binary"):
+        quantization = QuantizationSearchParams(
+            rescore=rescore,
+            oversampling=QDRANT_OVERSAMPLING if rescore else None
+        )
+    return SearchParams(hnsw_ef=hnsw_ef, exact=exact, quantization=quantization)
+
+# Child points written by chunking carry record_type="chunk"; every read that
+# wants one row per event excludes them with this condition.
+CHUNK_CONDITION = FieldCondition(key="record_type", match=MatchValue(value="chunk"))
+
+def chunk_text(text, max_tokens=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    """Split text into overlapping windows of whitespace-delimited tokens"""
+    tokens = text.split()
+    if len(tokens) <= max_tokens:
+        return [text]
+    
+    step = max(max_tokens - overlap, 1)
+    chunks = []
+    for start in range(0, len(tokens), step):
+        chunks.append(" ".join(tokens[start:start + max_tokens]))
+        if start + max_tokens >= len(tokens):
+            break
+    return chunks
+
+def chunk_point_id(event_id, index):
+    return str(uuid.uuid5(uuid.UUID(event_id), f"chunk-{index}"))
+
+def event_payload(event, modality, extra_payload=None):
+    payload = {
+        "patient_id": event.patient_id,
+        "timestamp": event.timestamp,
+        "event_type": event.event_type,
+        "modality": modality,
+        "content": event.content,
+        "doctor_name": event.doctor_name,
+        "hospital_name": event.hospital_name
+    }
+    if extra_payload:
+        payload.update(extra_payload)
+    return payload
+
+def build_event_points(event_id, payload, chunks, chunk_vectors):
+    """Build the parent point for an event plus one child point per chunk"""
+    vectors = np.asarray(chunk_vectors, dtype=np.float32)
+    if len(chunks) == 1:
+        return [PointStruct(id=event_id, vector=vectors[0].tolist(), payload=payload)]
+    
+    # Parent keeps the full content for timeline reads; its vector is the
+    # normalized mean of the chunks so it still represents the whole document.
+    parent_vector = vectors.mean(axis=0)
+    parent_vector /= np.linalg.norm(parent_vector) or 1.0
+    points = [PointStruct(
+        id=event_id,
+        vector=parent_vector.tolist(),
+        payload={**payload, "chunk_count": len(chunks)}
+    )]
+    
+    for index, (chunk, vector) in enumerate(zip(chunks, vectors)):
+        points.append(PointStruct(
+            id=chunk_point_id(event_id, index),
+            vector=vector.tolist(),
+            payload={
+                "record_type": "chunk",
+                "parent_event_id": event_id,
+                "chunk_index": index,
+                "patient_id": payload["patient_id"],
+                "timestamp": payload["timestamp"],
+                "event_type": payload["event_type"],
+                "content": chunk,
+                "doctor_name": payload.get("doctor_name", "Unknown"),
+                "hospital_name": payload.get("hospital_name", "Unknown")
+            }
+        ))
+    return points
+
+def delete_event_chunks(event_id, route):
+    qdrant_client.delete(
+        **route.kwargs(),
+        points_selector=FilterSelector(filter=Filter(must=[
+            FieldCondition(key="parent_event_id", match=MatchValue(value=event_id))
+        ]))
+    )
+
+def delete_events(route, event_ids):
+    """Delete events and their chunk points; returns the number of points removed"""
+    chunks = Filter(must=[FieldCondition(key="parent_event_id", match=MatchAny(any=list(event_ids)))])
+    removed = len(event_ids) + qdrant_client.count(**route.kwargs(), count_filter=chunks, exact=True).count
+    qdrant_client.delete(**route.kwargs(), points_selector=list(event_ids))
+    qdrant_client.delete(**route.kwargs(), points_selector=FilterSelector(filter=chunks))
+    return removed
+
+def upload_location(filename):
+    """(path, tier) of an upload in hot or cold storage, or (None, None)"""
+    hot_path = os.path.join(UPLOADS_DIR, filename)
+    if os.path.isfile(hot_path):
+        return hot_path, "hot"
+    cold_path = os.path.join(COLD_STORAGE_DIR, f"{filename}.gz")
+    if os.path.isfile(cold_path):
+        return cold_path, "cold"
+    return None, None
+
+def iter_upload_chunks(path, tier, chunk_size=64 * 1024):
+    """Read an upload, decompressing it if it lives in cold storage"""
+    with (gzip.open(path, "rb") if tier == "cold" else open(path, "rb")) as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+def upload_mimetype(original_filename):
+    return mimetypes.guess_type(original_filename)[0] or "application/octet-stream"
+
+def attachment_disposition(original_filename):
+    """Content-Disposition for a download, with an ASCII fallback name"""
+    fallback = re.sub(r'[^\x20-\x7e]|["\\]', "_", original_filename)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(original_filename)}"
+
+def remove_upload(filename):
+    """Delete an upload from hot and cold storage; returns the bytes freed"""
+    freed = 0
+    for path in (os.path.join(UPLOADS_DIR, filename), os.path.join(COLD_STORAGE_DIR, f"{filename}.gz")):
+        try:
+            freed += os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return freed
+
+def prepare_event_batch(items):
+    """
+    Route and chunk (event, modality, extra_payload, tenant_id) items and embed
+    every chunk in one call; returns a (route, points) pair per item.
+    """
+    prepared = []
+    texts = []
+    for event, modality, extra_payload, tenant_id in items:
+        route = assign_route(event.patient_id, event.hospital_name, tenant_id)
+        chunks = chunk_text(event.content)
+        prepared.append((event, route, event_payload(event, modality, extra_payload), chunks))
+        texts.extend(chunks)
+    
+    vectors = iter(embedding_model.embed(texts))
+    return [
+        (route, build_event_points(event.event_id, payload, chunks, [next(vectors) for _ in chunks]))
+        for event, route, payload, chunks in prepared
+    ]
+
+def prepare_event_points(event, modality, extra_payload=None, tenant_id=None):
+    """Route, chunk and embed an event; returns (route, points)"""
+    return prepare_event_batch([(event, modality, extra_payload, tenant_id)])[0]
+
+def index_medical_event(event, modality, extra_payload=None, replace=False, tenant_id=None):
+    """Chunk, embed and upsert an event and its child points; returns [] if merged as a duplicate"""
+    prepared = dedup_event_points([prepare_event_points(event, modality, extra_payload, tenant_id)], [replace])[0]
+    if prepared is None:
+        return []
+    route, points = prepared
+    
+    if replace:
+        delete_event_chunks(event.event_id, route)
+    
+    qdrant_client.upsert(**route.kwargs(), points=points)
+    apply_timeline_events(points)
+    mark_cohort_dirty([event.patient_id])
+    return points
+
+def upsert_routed(points, wait=True):
+    """Upsert points grouped by the tenant route of their patient"""
+    groups = {}
+    for point in points:
+        route = route_for_patient(point.payload["patient_id"])
+        groups.setdefault((route.collection, route.shard_key), (route, []))[1].append(point)
+    for route, group in groups.values():
+        qdrant_client.upsert(**route.kwargs(), points=group, wait=wait)
+
+def within_dedup_window(timestamp_a, timestamp_b, window_days=DEDUP_WINDOW_DAYS):
+    delta = datetime.fromisoformat(timestamp_a) - datetime.fromisoformat(timestamp_b)
+    return abs(delta) <= timedelta(days=window_days)
+
+def duplicate_filter(payload, exclude_ids=()):
+    """Parent events of the same patient and type (and file hash) within DEDUP_WINDOW_DAYS"""
+    moment = datetime.fromisoformat(payload["timestamp"])
+    window = timedelta(days=DEDUP_WINDOW_DAYS)
+    must = [
+        FieldCondition(key="patient_id", match=MatchValue(value=payload["patient_id"])),
+        FieldCondition(key="event_type", match=MatchValue(value=payload["event_type"])),
+        FieldCondition(key="timestamp", range=DatetimeRange(gte=moment - window, lte=moment + window))
+    ]
+    if payload.get("file_sha256"):
+        must.append(FieldCondition(key="file_sha256", match=MatchValue(value=payload["file_sha256"])))
+    must_not = [CHUNK_CONDITION]
+    if exclude_ids:
+        must_not.append(HasIdCondition(has_id=list(exclude_ids)))
+    return Filter(must=must, must_not=must_not)
+
+def same_content(a, b):
+    """Whether two event texts match once case and whitespace are ignored"""
+    return " ".join((a or "").split()).casefold() == " ".join((b or "").split()).casefold()
+
+def document_notes(content):
+    """Manual notes of a document event, without its header or extracted text"""
+    header = (content or "").split("\n\nExtracted text:")[0]
+    return header.split("\n\nNotes: ", 1)[1] if "\n\nNotes: " in header else ""
+
+def duplicate_text(payload):
+    """The text two copies must share to be merged: notes for documents, content otherwise"""
+    if payload.get("modality") == "document":
+        return document_notes(payload.get("content"))
+    return payload.get("content")
+
+def find_stored_duplicate(route, point):
+    """Most similar stored event above DEDUP_THRESHOLD as (event_id, score, content), or None"""
+    hits = qdrant_client.query_points(
+        **route.kwargs(),
+        query=point.vector,
+        query_filter=duplicate_filter(point.payload, [point.id]),
+        limit=1,
+        score_threshold=DEDUP_THRESHOLD,
+        search_params=search_params(),
+        with_payload=["content"]
+    ).points
+    return (str(hits[0].id), hits[0].score, hits[0].payload.get("content")) if hits else None
+
+def find_batch_duplicate(kept, route, point):
+    """Same check against events earlier in the batch, which aren't in Qdrant yet"""
+    best = None
+    vector = np.asarray(point.vector, dtype=np.float32)
+    for other_route, other_points in kept:
+        other = other_points[0].payload
+        if (
+            other_route != route
+            or other["patient_id"] != point.payload["patient_id"]
+            or other["event_type"] != point.payload["event_type"]
+            or other.get("file_sha256") != point.payload.get("file_sha256")
+            or "duplicate_of" in other
+            or not within_dedup_window(other["timestamp"], point.payload["timestamp"])
+        ):
+            continue
+        # Event vectors are unit length, so the dot product is the cosine
+        score = float(np.dot(vector, np.asarray(other_points[0].vector, dtype=np.float32)))
+        if score >= DEDUP_THRESHOLD and (best is None or score > best[1]):
+            best = (str(other_points[0].id), score, other["content"])
+    return best
+
+def merged_duplicate_fields(payload, duplicate_ids):
+    """Payload fields recording copies merged into a surviving event"""
+    return {
+        "duplicate_count": payload.get("duplicate_count", 0) + len(duplicate_ids),
+        "duplicate_event_ids": payload.get("duplicate_event_ids", []) + list(duplicate_ids),
+        "last_duplicate_at": datetime.now(timezone.utc).isoformat()
+    }
+
+def merge_into_stored_event(route, survivor_id, duplicate_ids):
+    survivor = qdrant_client.retrieve(
+        **route.kwargs(),
+        ids=[survivor_id],
+        with_payload=["duplicate_count", "duplicate_event_ids"]
+    )
+    if not survivor:
+        return  # deleted, or still waiting in the ingest journal
+    qdrant_client.set_payload(
+        **route.kwargs(),
+        payload=merged_duplicate_fields(survivor[0].payload, duplicate_ids),
+        points=[survivor_id]
+    )
+
+def dedup_event_points(prepared, replace_flags=None):
+    """
+    Merge or flag near-duplicates among (route, points) pairs before upsert.
+    Only copies with the same text are merged; a similar event that differs
+    (e.g. another lab value) is always stored and flagged instead.
+    Returns the pairs in order, with None for events merged into another.
+    Replacements of existing events and documents (matched by file hash at
+    upload instead) are passed through.
+    """
+    if not DEDUP_ENABLED:
+        return prepared
+    
+    replace_flags = replace_flags or [False] * len(prepared)
+    results, kept, merges = [], [], {}
+    for (route, points), replace in zip(prepared, replace_flags):
+        parent = points[0]
+        if replace or parent.payload["modality"] == "document":
+            results.append((route, points))
+            continue
+        
+        match = find_batch_duplicate(kept, route, parent) or find_stored_duplicate(route, parent)
+        if match is None:
+            kept.append((route, points))
+            results.append((route, points))
+            continue
+        
+        survivor_id, score, survivor_content = match
+        action = "merge" if DEDUP_ACTION == "merge" and same_content(survivor_content, parent.payload["content"]) else "flag"
+        if action == "flag":
+            parent.payload.update(duplicate_of=survivor_id, duplicate_score=round(score, 4))
+            kept.append((route, points))
+            results.append((route, points))
+        else:
+            merges.setdefault(survivor_id, (route, []))[1].append(str(parent.id))
+            results.append(None)
+        logger.info(f"🧬 {str(parent.id)[:8]}... duplicates {survivor_id[:8]}... ({score:.3f}), {action}")
+    
+    batch_parents = {str(points[0].id): points[0] for _, points in kept}
+    for survivor_id, (route, duplicate_ids) in merges.items():
+        if survivor_id in batch_parents:
+            payload = batch_parents[survivor_id].payload
+            payload.update(merged_duplicate_fields(payload, duplicate_ids))
+        else:
+            merge_into_stored_event(route, survivor_id, duplicate_ids)
+    return results
+
+def find_duplicate_upload(patient_id, file_sha256):
+    """A stored or journaled document of this patient with identical bytes, as (route, point)"""
+    for point in pending_journal_points(patient_id) if INGEST_JOURNAL else []:
+        if point.payload.get("file_sha256") == file_sha256:
+            return None, point
+    
+    payload = {
+        "patient_id": patient_id,
+        "event_type": "document",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "file_sha256": file_sha256
+    }
+    for route in lookup_routes(patient_id):
+        points, _ = qdrant_client.scroll(
+            **route.kwargs(),
+            scroll_filter=duplicate_filter(payload),
+            limit=1,
+            with_payload=True
+        )
+        if points:
+            return route, points[0]
+    return None
+
+def store_uploaded_document(file_content, original_filename, patient_id, doctor_name, hospital_name, notes="", tenant_id=None):
+    """Save an upload, index it and queue background text extraction"""
+    logger.info(f"📄 Processing document for patient: {patient_id}")
+    
+    file_extension = os.path.splitext(original_filename)[1]
+    file_sha256 = hashlib.sha256(file_content).hexdigest()
+    
+    duplicate = find_duplicate_upload(patient_id, file_sha256) if DEDUP_ENABLED else None
+    # Same bytes with different notes is kept as a flagged copy, so no notes are lost
+    if duplicate and DEDUP_ACTION == "merge" and same_content(document_notes(duplicate[1].payload.get("content")), notes):
+        route, survivor = duplicate
+        merged_event_id = str(uuid.uuid4())
+        if route:
+            merge_into_stored_event(route, str(survivor.id), [merged_event_id])
+        logger.info(f"🧬 Identical document already stored for {patient_id}: {str(survivor.id)[:8]}...")
+        return {
+            "status": "duplicate",
+            "event_id": str(survivor.id),
+            "duplicate_of": str(survivor.id),
+            "merged_event_id": merged_event_id,
+            "filename": survivor.payload.get("filename"),
+            "file_path": survivor.payload.get("file_path"),
+            "document_type": "document",
+            "extraction_status": survivor.payload.get("extraction_status"),
+            "status_url": f"/document-status/{survivor.id}?patient_id={quote(patient_id)}",
+            "note": "This file was already uploaded for this patient, so the existing copy was kept."
+        }
+    
+    # Create uploads directory if it doesn't exist
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    
+    # Generate unique filename
+    unique_filename = f"{uuid.uuid4()}{file_extension}"
+    file_path = os.path.join(UPLOADS_DIR, unique_filename)
+    
+    # Save file to disk
+    with open(file_path, 'wb') as f:
+        f.write(file_content)
+    
+    logger.info(f"📁 File saved to: {file_path}")
+    
+    # Get manual notes if provided
+    extracted_text = f"Document: {original_filename}"
+    if notes:
+        extracted_text += f"\n\nNotes: {notes}"
+    
+    # Create event with extracted text
+    doc_date = datetime.now(timezone.utc).isoformat()
+    event = create_medical_event(
+        extracted_text, 
+        patient_id, 
+        "document", 
+        doc_date,
+        doctor_name=doctor_name,
+        hospital_name=hospital_name
+    )
+    
+    document_payload = {
+        "filename": original_filename,
+        "file_path": unique_filename,  # Store relative path
+        "file_extension": file_extension,
+        "file_sha256": file_sha256,
+        "storage_tier": "hot",
+        "extraction_status": "pending"
+    }
+    if duplicate:
+        document_payload["duplicate_of"] = str(duplicate[1].id)
+    record_event(event, "document", document_payload, tenant_id=tenant_id)
+    
+    logger.info(f"✅ Document stored: {event.event_id[:8]}...")
+    
+    submit_extraction(event, document_payload, file_path)
+    
+    return {
+        "status": "success",
+        "event_id": event.event_id,
+        "extracted_text": extracted_text,
+        "filename": original_filename,
+        "file_path": unique_filename,
+        "document_type": "document",
+        "extraction_status": "pending",
+        "status_url": f"/document-status/{event.event_id}?patient_id={quote(patient_id)}",
+        "note": "Document stored. Text extraction is running in the background; you can download it anytime from your timeline."
+    }
+
+def extract_in_process(file_path, file_extension):
+    """
+    Extract one file in its own child process. A file that runs past
+    EXTRACTION_TIMEOUT_SECONDS only kills its own process; other uploads
+    keep extracting. The dispatcher's threads cap how many run at once.
+    """
+    # spawn, not fork: this runs on a dispatcher thread, and the child only
+    # needs extraction.py (no Qdrant client or embedding model).
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+        target=extraction_process_main,
+        args=(sender, file_path, file_extension, OCR_HOOK),
+        daemon=True
+    )
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(EXTRACTION_TIMEOUT_SECONDS):
+            return {"status": "timeout", "method": None, "text": "",
+                    "error": f"Extraction exceeded {EXTRACTION_TIMEOUT_SECONDS}s"}
+        return receiver.recv()
+    except EOFError:
+        process.join(5)
+        return {"status": "failed", "method": None, "text": "",
+                "error": f"Extraction process exited with code {process.exitcode}"}
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join(5)
+        receiver.close()
+
+def submit_extraction(event, document_payload, file_path):
+    job = {
+        "status": "pending",
+        "method": None,
+        "error": None,
+        "queued_at": datetime.now(timezone.utc).isoformat()
+    }
+    # Finished jobs are also recorded on the point payload, so only a bounded
+    # window of recent ones is kept in memory.
+    with extraction_jobs_lock:
+        while len(extraction_jobs) >= EXTRACTION_JOB_HISTORY:
+            extraction_jobs.pop(next(iter(extraction_jobs)))
+        extraction_jobs[event.event_id] = job
+    extraction_dispatcher.submit(run_extraction, event, document_payload, file_path, job)
+
+def run_extraction(event, document_payload, file_path, job):
+    """Extract text in a worker process, then write it back and re-embed"""
+    job["status"] = "running"
+    job["started_at"] = datetime.now(timezone.utc).isoformat()
+    
+    try:
+        result = extract_in_process(file_path, document_payload["file_extension"])
+    except Exception as e:
+        result = {"status": "failed", "method": None, "text": "", "error": str(e)}
+    
+    try:
+        extraction_payload = {
+            **document_payload,
+            "extraction_status": result["status"],
+            "extraction_method": result["method"],
+            "extraction_error": result["error"]
+        }
+        if result["text"]:
+            event.content = f"{event.content}\n\nExtracted text:\n{result['text']}"
+            record_event(event, "document", extraction_payload, replace=True)
+        elif INGEST_JOURNAL:
+            # The point may still be waiting in the journal, so the status
+            # update goes through it as well to keep writes in order.
+            record_event(event, "document", extraction_payload)
+        else:
+            qdrant_client.set_payload(
+                **route_for_patient(event.patient_id).kwargs(),
+                payload={k: v for k, v in extraction_payload.items() if k.startswith("extraction_")},
+                points=[event.event_id]
+            )
+    except Exception as e:
+        logger.error(f"Extraction write-back failed for {event.event_id[:8]}...: {e}")
+        result = {**result, "status": "failed", "error": str(e)}
+    
+    job.update({
+        "status": result["status"],
+        "method": result["method"],
+        "error": result["error"],
+        "characters": len(result["text"]),
+        "finished_at": datetime.now(timezone.utc).isoformat()
+    })
+    logger.info(f"🔎 Extraction {result['status']} for {event.event_id[:8]}... ({job['characters']} chars)")
+
+def stale_pending_documents(min_age_seconds):
+    """Document events still marked pending after min_age_seconds whose journal writes have all landed"""
+    journaled = {row[0] for row in local_db().execute("SELECT DISTINCT event_id FROM ingest_journal")}
+    now = time.time()
+    pending = Filter(
+        must=[DOCUMENT_CONDITION, FieldCondition(key="extraction_status", match=MatchValue(value="pending"))],
+        must_not=[CHUNK_CONDITION]
+    )
+    for points in iter_event_pages(pending):
+        for p in points:
+            if str(p.id) not in journaled and event_age_seconds(p.payload, now) >= min_age_seconds:
+                yield p
+
+def requeue_extraction(point):
+    """Resubmit a pending document's extraction; False if its hot file is gone"""
+    payload = point.payload
+    file_path = os.path.join(UPLOADS_DIR, payload["file_path"])
+    if not os.path.isfile(file_path):
+        return False
+    event = MedicalEvent(
+        event_id=str(point.id),
+        **{field: payload.get(field, "") for field in
+           ("patient_id", "timestamp", "event_type", "modality", "content", "doctor_name", "hospital_name")}
+    )
+    document_payload = {
+        key: payload[key] for key in
+        ("filename", "file_path", "file_extension", "file_sha256", "storage_tier", "duplicate_of")
+        if key in payload
+    }
+    submit_extraction(event, {**document_payload, "extraction_status": "pending"}, file_path)
+    return True
+
+def export_filter(patient_id=None, hospital_name=None, event_type=None, include_chunks=False):
+    conditions = [
+        FieldCondition(key=key, match=MatchValue(value=value))
+        for key, value in [("patient_id", patient_id), ("hospital_name", hospital_name), ("event_type", event_type)]
+        if value
+    ]
+    return Filter(must=conditions, must_not=[] if include_chunks else [CHUNK_CONDITION])
+
+def iter_event_pages(scroll_filter=None, with_vectors=False, page_size=EXPORT_PAGE_SIZE, payload_fields=True, routes=None):
+    """Yield the matching points page by page using scroll offsets"""
+    for route in routes or event_routes():
+        offset = None
+        while True:
+            points, offset = qdrant_client.scroll(
+                **route.kwargs(),
+                scroll_filter=scroll_filter,
+                limit=page_size,
+                offset=offset,
+                with_payload=payload_fields,
+                with_vectors=with_vectors
+            )
+            if points:
+                yield points
+            if offset is None:
+                break
+
+def page_to_columns(points, with_vectors=False):
+    """One scroll page as column arrays; vectors packed as base64 float32"""
+    block = {
+        "count": len(points),
+        "columns": {
+            "id": [str(p.id) for p in points],
+            **{column: [p.payload.get(column) for p in points] for column in EXPORT_COLUMNS}
+        }
+    }
+    if with_vectors:
+        matrix = np.asarray([p.vector for p in points], dtype="<f4")
+        block["vectors"] = {
+            "dtype": "float32",
+            "dim": int(matrix.shape[1]),
+            "data": base64.b64encode(matrix.tobytes()).decode("ascii")
+        }
+    return block
+
+def serialize_export_page(points, file_format, with_vectors=False):
+    if file_format == "columnar":
+        return json.dumps(page_to_columns(points, with_vectors)) + "\n"
+    
+    lines = []
+    for p in points:
+        record = {"id": str(p.id), **p.payload}
+        if with_vectors:
+            record["vector"] = p.vector
+        lines.append(json.dumps(record))
+    return "\n".join(lines) + "\n"
+
+def iter_export_lines(file_format, scroll_filter, with_vectors=False, routes=None):
+    """Serialize the export one page at a time so memory stays flat"""
+    for points in iter_event_pages(scroll_filter, with_vectors, routes=routes):
+        yield serialize_export_page(points, file_format, with_vectors)
+
+def search_query_args(patient_id, query_vector, limit):
+    """query_points arguments for a patient-scoped semantic search"""
+    # Chunked events are matched through their child points, so skip the
+    # parent (whose vector is only the averaged document); the caller keeps
+    # the best-scoring chunk per event.
+    return {
+        **route_for_patient(patient_id).kwargs(),
+        "query": query_vector,
+        "query_filter": Filter(
+            must=[FieldCondition(key="patient_id", match=MatchValue(value=patient_id))],
+            should=[
+                IsEmptyCondition(is_empty=PayloadField(key="chunk_count")),
+                FieldCondition(key="record_type", match=MatchValue(value="chunk"))
+            ]
+        ),
+        "limit": limit * SEARCH_CANDIDATE_FACTOR,
+        "search_params": search_params(),
+        "with_payload": True
+    }
+
+def collapse_search_hits(hits, limit):
+    results = []
+    seen = set()
+    for hit in hits:
+        event_id = hit.payload.get("parent_event_id", str(hit.id))
+        if event_id in seen:
+            continue
+        seen.add(event_id)
+        results.append({
+            "event_id": event_id,
+            "score": round(hit.score, 4),
+            "timestamp": hit.payload.get("timestamp"),
+            "event_type": hit.payload.get("event_type"),
+            "matched_text": hit.payload.get("content", ""),
+            "chunk_index": hit.payload.get("chunk_index"),
+            "doctor_name": hit.payload.get("doctor_name", "Unknown"),
+            "hospital_name": hit.payload.get("hospital_name", "Unknown")
+        })
+        if len(results) >= limit:
+            break
+    return results
+
+def timeline_scroll_args(patient_id):
+    return {
+        **route_for_patient(patient_id).kwargs(),
+        "scroll_filter": Filter(
+            must=[FieldCondition(key="patient_id", match=MatchValue(value=patient_id))],
+            must_not=[CHUNK_CONDITION]
+        ),
+        "limit": 100,
+        "with_payload": True
+    }
+
+def sort_by_timestamp(points):
+    return sorted(points, key=lambda p: datetime.fromisoformat(p.payload["timestamp"]))
+
+def fetch_timeline_events(patient_id):
+    """Every stored parent event of a patient, following scroll offsets"""
+    points, offset = [], None
+    while True:
+        page, offset = qdrant_client.scroll(**timeline_scroll_args(patient_id), offset=offset)
+        points.extend(page)
+        if offset is None:
+            return points
+
+def timeline_entry(p):
+    utc_time = datetime.fromisoformat(p.payload["timestamp"])
+    local_time = utc_time.astimezone(LOCAL_TZ)
+
+    return {
+        "event_id": str(p.id),
+        "timestamp": utc_time.isoformat(),               
+        "local_time": local_time.isoformat(),            
+        "event_type": p.payload["event_type"],
+        "content": p.payload["content"],
+        "doctor_name": p.payload.get("doctor_name", "Unknown"),
+        "hospital_name": p.payload.get("hospital_name", "Unknown"),
+        "filename": p.payload.get("filename"),
+        "file_path": p.payload.get("file_path"),
+        "file_extension": p.payload.get("file_extension"),
+        "timestamp_type": "log_time",
+        "pending": p.payload.get("journal_status") == "pending"
+    }
+
+def build_patient_timeline(points):
+    return [timeline_entry(p) for p in sort_by_timestamp(points)]
+
+def single_event_response(timeline):
+    return {
+        "timeline": timeline,
+        "timeline_insights": {
+            "activity_rate": 0,
+            "activity_level": "N/A",
+            "activity_description": "Only one event recorded",
+            "longest_gap_days": 0,
+            "continuity": "N/A",
+            "continuity_description": "Need more events for analysis",
+            "completeness": 100 if timeline[0]["doctor_name"] != "Unknown" else 0,
+            "event_breakdown": {timeline[0]["event_type"]: 100},
+            "unique_hospitals": 1 if timeline[0]["hospital_name"] != "Unknown" else 0,
+            "unique_doctors": 1 if timeline[0]["doctor_name"] != "Unknown" else 0,
+            "total_days": 1,
+            "total_events": 1
+        },
+        "overall_summary": "Only one event recorded. Add more medical events to see detailed timeline analysis.",
+        "data_quality": compute_data_quality(timeline)
+    }
+
+def compute_data_quality(timeline):
+    count = len(timeline)
+    if count == 0:
+        return {"label": "No Data", "description": "No medical records available"}
+    
+    times = [datetime.fromisoformat(e["timestamp"]) for e in timeline]
+    span = (max(times) - min(times)).days + 1
+    avg_len = sum(len(e["content"]) for e in timeline) / count
+    
+    if count >= 6 and span >= 7 and avg_len >= 40:
+        return {"label": "Rich", "description": "Sufficient records for comprehensive analysis"}
+    if count >= 3 and span >= 2:
+        return {"label": "Moderate", "description": "Some continuity present, insights may be limited"}
+    return {"label": "Sparse", "description": "Limited data, interpretation constrained"}
+
+def build_timeline_pdf(patient_id, timeline):
+    """Render the timeline report; returns a BytesIO positioned at the start"""
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    story = []
+    styles = getSampleStyleSheet()
+    
+    title_style = ParagraphStyle(
+        'Title',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#1e40af'),
+        spaceAfter=20
+    )
+    
+    # Get hospital name if available
+    hospital_name = timeline[0].get('hospital_name', 'General Hospital') if timeline else 'General Hospital'
+    
+    story.append(Paragraph("Medical Timeline Report", title_style))
+    story.append(Paragraph(f"Hospital: {hospital_name}", styles['Normal']))
+    story.append(Paragraph(f"Patient ID: {patient_id}", styles['Normal']))
+    story.append(Paragraph(f"Generated: {datetime.now().strftime('%B %d, %Y at %I:%M %p')}", styles['Normal']))
+    story.append(Spacer(1, 0.4*inch))
+    
+    table_data = [['Date', 'Type', 'Details']]
+    for e in timeline:
+        utc_time = datetime.fromisoformat(e['timestamp'])
+        local_time = utc_time.astimezone(LOCAL_TZ)
+
+        date = local_time.strftime('%b %d, %Y %I:%M %p')
+        table_data.append([
+            Paragraph(date, styles['Normal']),
+            Paragraph(e['event_type'], styles['Normal']),
+            Paragraph(e['content'][:200] + ('...' if len(e['content']) > 200 else ''), styles['Normal'])
+        ])
+    
+    table = Table(table_data, colWidths=[1.5*inch, 1.5*inch, 4*inch])
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#1e40af')),
+        ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
+        ('ALIGN', (0,0), (-1,-1), 'LEFT'),
+        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0,0), (-1,0), 11),
+        ('BOTTOMPADDING', (0,0), (-1,0), 12),
+        ('GRID', (0,0), (-1,-1), 1, colors.black),
+        ('VALIGN', (0,0), (-1,-1), 'TOP')
+    ]))
+    
+    story.append(table)
+    doc.build(story)
+    buffer.seek(0)
+    return buffer
+
+def pdf_download_name(patient_id):
+    return f'medical_timeline_{patient_id}_{datetime.now().strftime("%Y%m%d")}.pdf'
+
+def human_time(iso_ts):
+    if not iso_ts:
+        return "unknown time"
+    dt = datetime.fromisoformat(iso_ts)
+    local_dt = dt.astimezone(LOCAL_TZ)
+    return local_dt.strftime("%b %d, %Y at %I:%M %p")
+
+def prompt_details(content):
+    if len(content) <= SUMMARY_MAX_EVENT_CHARS:
+        return content
+    return content[:SUMMARY_MAX_EVENT_CHARS].rstrip() + " [...]"
+
+def build_overview_prompt(timeline):
+    recent, earlier = timeline[-SUMMARY_MAX_EVENTS:], timeline[:-SUMMARY_MAX_EVENTS]
+    entries = "\n".join([
+        (
+            f"- Event was logged on {human_time(e.get('timestamp'))}."
+            f"\n  Type: {e['event_type']}"
+            f"\n  Details: {prompt_details(e['content'])}"
+        )
+        for e in recent
+    ])
+    if earlier:
+        counts = Counter(e["event_type"] for e in earlier)
+        entries = (
+            f"- {len(earlier)} earlier events, logged between {human_time(earlier[0].get('timestamp'))} "
+            f"and {human_time(earlier[-1].get('timestamp'))}, are not listed individually: "
+            + ", ".join(f"{count} {event_type}" for event_type, count in counts.most_common())
+            + ".\n" + entries
+        )
+
+    return f"""
+You are a medical timeline summarization assistant.
+
+IMPORTANT CONTEXT:
+- All times refer to documentation (log) time unless explicitly stated as "occurred on".
+- Logged times may differ from actual medical event dates.
+- Do NOT output raw timestamps or ISO date strings.
+
+STRICT RULES:
+- Do NOT infer exact onset times
+- Do NOT assume events occurred at log time
+- Use clear, human-readable time references only
+
+Timeline:
+{entries}
+
+Write a clear, professional medical summary suitable for clinicians.
+"""
+
+
+def ai_completion_args(prompt):
+    return {
+        "model": "llama-3.3-70b-versatile",
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": 2048,
+        "temperature": 0.7
+    }
+
+def ai_response_text(response):
+    if response.choices and response.choices[0].message.content:
+        return response.choices[0].message.content
+    else:
+        return "AI returned empty response. Timeline data is still accessible."
+
+def ai_error_message(e):
+    error_msg = str(e).lower()
+    
+    if "rate limit" in error_msg or "quota" in error_msg:
+        logger.error(f"Groq rate limit: {e}")
+        return "⚠️ AI rate limit reached. Timeline data is available below."
+    elif "auth" in error_msg or "invalid" in error_msg:
+        logger.error(f"Groq auth failed: {e}")
+        return "⚠️ AI authentication failed. Check GROQ_API_KEY."
+    else:
+        logger.error(f"Groq error: {e}")
+        return "⚠️ AI analysis temporarily unavailable. Timeline data is still visible below."
+
+def ai_explain(prompt):
+    """AI explanation using Groq"""
+    try:
+        if not groq_client:
+            logger.warning("Groq client not initialized")
+            return "AI analysis unavailable. Groq API not configured."
+        
+        response = groq_client.chat.completions.create(**ai_completion_args(prompt))
+        return ai_response_text(response)
+            
+    except Exception as e:
+        return ai_error_message(e)
+
+# ==================== ERROR HANDLERS ====================
+
+@app.errorhandler(404)
+def not_found(error):
+    return jsonify({"error": "Endpoint not found"}), 404
+
+@app.errorhandler(500)
+def internal_error(error):
+    logger.error(f"Internal server error: {error}")
+    return jsonify({"error": "Internal server error"}), 500
+
+# ==================== INGEST JOURNAL CLI ====================
+
+@app.cli.command("journal-requeue")
+@click.option("--event-id", "event_ids", multiple=True, help="Requeue only this event (repeatable)")
+def journal_requeue(event_ids):
+    """Move parked journal entries back into the ingest journal for another try"""
+    where = f"WHERE event_id IN ({','.join('?' * len(event_ids))})" if event_ids else ""
+    conn = local_db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            "INSERT INTO ingest_journal (seq, event_id, patient_id, tenant_id, modality, replace_chunks, "
+            "event_json, extra_payload, created_at, last_error) "
+            "SELECT seq, event_id, patient_id, tenant_id, modality, replace_chunks, event_json, extra_payload, "
+            f"created_at, last_error FROM journal_dead {where}",
+            event_ids
+        )
+        requeued = conn.execute(f"DELETE FROM journal_dead {where}", event_ids).rowcount
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    logger.info(f"✅ Requeued {requeued} parked journal entries")
+
+# ==================== DOCUMENT EXTRACTION CLI ====================
+
+@app.cli.command("extraction-requeue")
+@click.option("--older-than-minutes", default=30, show_default=True,
+              help="Only documents uploaded at least this long ago")
+@click.option("--dry-run", is_flag=True, help="List stuck documents without extracting them")
+def extraction_requeue(older_than_minutes, dry_run):
+    """Re-run text extraction for documents left pending by a restart or worker recycle"""
+    totals = Counter()
+    for point in stale_pending_documents(older_than_minutes * 60):
+        totals["pending"] += 1
+        if dry_run:
+            logger.info(f"   {point.id} ({point.payload.get('filename')}, uploaded {point.payload['timestamp']})")
+        elif requeue_extraction(point):
+            totals["requeued"] += 1
+        else:
+            totals["missing_file"] += 1
+            logger.warning(f"   ⚠️  {point.id}: {point.payload['file_path']} is not in hot storage, skipped")
+    
+    if dry_run:
+        logger.info(f"🔍 {totals['pending']} documents stuck in pending extraction")
+        return
+    # Wait for the extractions (and their write-backs) before the command exits
+    extraction_dispatcher.shutdown(wait=True)
+    # Anything still unflushed stays journaled and is replayed by the server
+    while INGEST_JOURNAL and flush_journal_batch():
+        pass
+    logger.info(f"✅ Re-extracted {totals['requeued']} of {totals['pending']} pending documents "
+                f"({totals['missing_file']} without a hot file)")
+
+# ==================== BULK IMPORT CLI ====================
+
+def iter_import_records(path, file_format):
+    """Stream (record_number, dict) pairs without loading the file"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if file_format == "csv":
+            for record_number, row in enumerate(csv.DictReader(f)):
+                yield record_number, row
+        else:
+            for record_number, line in enumerate(f):
+                line = line.strip()
+                if not line:
+                    yield record_number, None
+                    continue
+                try:
+                    yield record_number, json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"   ⚠️  Record {record_number}: invalid JSON")
+                    yield record_number, None
+
+def deterministic_event_id(source_name, record_number, record):
+    """Same record -> same point id, so re-running an import is idempotent"""
+    # Not derived from the event timestamp: records without one get the
+    # import time, which would give a new id on every run.
+    record_hash = hashlib.sha256(json.dumps(record, sort_keys=True, default=str).encode()).hexdigest()
+    return str(uuid.uuid5(IMPORT_NAMESPACE, f"{source_name}|{record_number}|{record_hash}"))
+
+def prepare_import_record(record, source_name, record_number):
+    """Validate a record like /ingest does; returns (event_id, payload, chunks, route)"""
+    if not record or not all(record.get(field) for field in ["content", "patient_id", "event_type"]):
+        return None
+    
+    try:
+        event = create_medical_event(
+            record["content"],
+            record["patient_id"],
+            record["event_type"],
+            record.get("timestamp") or None,
+            record.get("doctor_name") or "Unknown",
+            record.get("hospital_name") or "Unknown"
+        )
+    except (TypeError, ValueError):
+        logger.warning(f"   ⚠️  Record {record_number}: invalid timestamp {record.get('timestamp')!r}")
+        return None
+    event.event_id = deterministic_event_id(source_name, record_number, record)
+    route = assign_route(event.patient_id, event.hospital_name, record.get("tenant_id"))
+    payload = event_payload(event, record.get("modality") or "text", {"import_source": source_name})
+    return event.event_id, payload, chunk_text(event.content), route
+
+def load_import_checkpoint(checkpoint_path, source_path):
+    if not os.path.exists(checkpoint_path):
+        return {"source": source_path, "records_done": 0, "events_imported": 0, "invalid_records": 0}
+    
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("source") != source_path:
+        raise click.ClickException(
+            f"Checkpoint {checkpoint_path} belongs to {checkpoint.get('source')}; use --restart to discard it"
+        )
+    return checkpoint
+
+def save_import_checkpoint(checkpoint_path, checkpoint):
+    checkpoint["updated_at"] = datetime.now(timezone.utc).isoformat()
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, checkpoint_path)
+
+def upsert_with_retry(points):
+    for attempt in range(1, IMPORT_UPSERT_RETRIES + 1):
+        try:
+            upsert_routed(points, wait=True)
+            return
+        except Exception as e:
+            if attempt == IMPORT_UPSERT_RETRIES:
+                raise
+            logger.warning(f"   ⚠️  Upsert failed (attempt {attempt}): {e}")
+            time.sleep(2 ** attempt)
+
+def import_event_batch(batch):
+    """Dedup (when enabled) and upsert a batch of (route, points) pairs"""
+    upsert_with_retry([point for pair in dedup_event_points(batch) if pair for point in pair[1]])
+    patient_events_changed(points[0].payload["patient_id"] for _, points in batch)
+
+@app.cli.command("import-history")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "file_format", type=click.Choice(["ndjson", "csv"]), default=None,
+              help="Input format (default: from file extension)")
+@click.option("--batch-size", default=500, show_default=True, help="Events per upsert request")
+@click.option("--workers", default=0, show_default=True, help="Embedding processes (0 = all cores, 1 = in-process)")
+@click.option("--max-inflight", default=4, show_default=True, help="Concurrent upsert requests")
+@click.option("--checkpoint", "checkpoint_path", default=None, help="Checkpoint file (default: <path>.checkpoint.json)")
+@click.option("--checkpoint-every", default=10, show_default=True, help="Write checkpoint every N committed batches")
+@click.option("--restart", is_flag=True, help="Ignore an existing checkpoint and start from the top")
+def import_history(path, file_format, batch_size, workers, max_inflight, checkpoint_path, checkpoint_every, restart):
+    """Bulk import medical events from an NDJSON or CSV file"""
+    source_path = os.path.abspath(path)
+    file_format = file_format or ("csv" if path.lower().endswith(".csv") else "ndjson")
+    checkpoint_path = checkpoint_path or f"{path}.checkpoint.json"
+    
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = load_import_checkpoint(checkpoint_path, source_path)
+    if checkpoint.get("completed"):
+        logger.info(f"✅ {path} already imported ({checkpoint['events_imported']} events); use --restart to re-run")
+        return
+    
+    start_record = checkpoint["records_done"]
+    if start_record:
+        logger.info(f"↩️  Resuming {path} at record {start_record}")
+    
+    source_name = os.path.basename(path)
+    # Records whose chunks have been fed to the embedder but whose vectors
+    # haven't come back yet, in submission order.
+    awaiting_vectors = deque()
+    # Invalid record numbers read so far. The embedder reads ahead of the
+    # committed batches, so they are only counted once a commit passes them;
+    # otherwise a resume would count them again.
+    invalid_records = deque()
+    
+    def chunk_stream():
+        for record_number, record in iter_import_records(path, file_format):
+            if record_number < start_record:
+                continue
+            prepared = prepare_import_record(record, source_name, record_number)
+            if prepared is None:
+                invalid_records.append(record_number)
+                continue
+            awaiting_vectors.append((record_number, *prepared))
+            yield from prepared[2]
+    
+    # One embed() call over the whole stream keeps a single worker pool alive
+    # for the entire import; results come back in input order.
+    vectors = iter(embedding_model.embed(
+        chunk_stream(),
+        batch_size=IMPORT_EMBED_BATCH,
+        parallel=None if workers == 1 else workers
+    ))
+    
+    upsert_pool = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="import-upsert")
+    inflight = deque()
+    batches_since_checkpoint = 0
+    started = time.monotonic()
+    
+    def commit_oldest():
+        nonlocal batches_since_checkpoint
+        future, last_record, event_count = inflight.popleft()
+        future.result()
+        checkpoint["records_done"] = last_record + 1
+        checkpoint["events_imported"] += event_count
+        while invalid_records and invalid_records[0] <= last_record:
+            invalid_records.popleft()
+            checkpoint["invalid_records"] += 1
+        batches_since_checkpoint += 1
+        if batches_since_checkpoint >= checkpoint_every:
+            save_import_checkpoint(checkpoint_path, checkpoint)
+            batches_since_checkpoint = 0
+            rate = checkpoint["events_imported"] / max(time.monotonic() - started, 1e-6)
+            logger.info(f"   📥 {checkpoint['events_imported']} events imported ({rate:.0f}/s)")
+    
+    def submit_batch(batch, last_record):
+        if len(inflight) >= max_inflight:
+            commit_oldest()
+        inflight.append((upsert_pool.submit(import_event_batch, batch), last_record, len(batch)))
+    
+    try:
+        batch, last_record = [], start_record - 1
+        for first_vector in vectors:
+            last_record, event_id, payload, chunks, route = awaiting_vectors.popleft()
+            chunk_vectors = [first_vector] + [next(vectors) for _ in range(len(chunks) - 1)]
+            batch.append((route, build_event_points(event_id, payload, chunks, chunk_vectors)))
+            
+            if len(batch) >= batch_size:
+                submit_batch(batch, last_record)
+                batch = []
+        
+        if batch:
+            submit_batch(batch, last_record)
+        while inflight:
+            commit_oldest()
+    finally:
+        # Only batches confirmed by Qdrant are in the checkpoint, so a crash
+        # here resumes from the last committed record.
+        upsert_pool.shutdown(wait=True)
+        save_import_checkpoint(checkpoint_path, checkpoint)
+    
+    # Invalid records after the last valid one; the whole file has been read
+    checkpoint["invalid_records"] += len(invalid_records)
+    checkpoint["completed"] = True
+    save_import_checkpoint(checkpoint_path, checkpoint)
+    
+    elapsed = time.monotonic() - started
+    logger.info(f"✅ Imported {checkpoint['events_imported']} events from {path} in {elapsed:.1f}s "
+                f"({checkpoint['invalid_records']} invalid records skipped)")
+
+# ==================== BULK EXPORT CLI ====================
+
+def write_parquet_export(output_path, scroll_filter, with_vectors, routes=None):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise click.ClickException("Parquet export requires pyarrow (pip install pyarrow)")
+    
+    fields = [pa.field("id", pa.string())] + [
+        pa.field(column, pa.int64() if column in ("chunk_index", "chunk_count") else pa.string())
+        for column in EXPORT_COLUMNS
+    ]
+    if with_vectors:
+        fields.append(pa.field("vector", pa.list_(pa.float32(), VECTOR_DIM)))
+    schema = pa.schema(fields)
+    
+    exported = 0
+    with pq.ParquetWriter(output_path, schema, compression="zstd") as writer:
+        # Each scroll page becomes one row group
+        for points in iter_event_pages(scroll_filter, with_vectors, routes=routes):
+            columns = page_to_columns(points)["columns"]
+            if with_vectors:
+                columns["vector"] = [p.vector for p in points]
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            exported += len(points)
+    return exported
+
+@app.cli.command("export-events")
+@click.argument("output", type=click.Path(dir_okay=False, allow_dash=True))
+@click.option("--format", "file_format", type=click.Choice(["ndjson", "columnar", "parquet"]), default="ndjson", show_default=True)
+@click.option("--patient-id", default=None)
+@click.option("--hospital-name", default=None)
+@click.option("--event-type", default=None)
+@click.option("--include-vectors", is_flag=True, help="Include embedding vectors")
+@click.option("--include-chunks", is_flag=True, help="Include chunk child points")
+def export_events_command(output, file_format, patient_id, hospital_name, event_type, include_vectors, include_chunks):
+    """Stream medical events to an NDJSON, columnar or Parquet file ('-' for stdout)"""
+    scroll_filter = export_filter(patient_id, hospital_name, event_type, include_chunks)
+    routes = lookup_routes(patient_id)
+    started = time.monotonic()
+    
+    if file_format == "parquet":
+        if output == "-":
+            raise click.ClickException("Parquet export needs a file path")
+        exported = write_parquet_export(output, scroll_filter, include_vectors, routes)
+    else:
+        exported = 0
+        with click.open_file(output, "w", encoding="utf-8") as f:
+            for points in iter_event_pages(scroll_filter, include_vectors, routes=routes):
+                f.write(serialize_export_page(points, file_format, include_vectors))
+                exported += len(points)
+    
+    logger.info(f"✅ Exported {exported} points to {output} in {time.monotonic() - started:.1f}s")
+
+# ==================== COLLECTION TUNING CLI ====================
+
+def describe_collection_config(collection_name):
+    config = qdrant_client.get_collection(collection_name).config
+    vectors = config.params.vectors
+    return {
+        "on_disk_vectors": getattr(vectors, "on_disk", None),
+        "on_disk_payload": config.params.on_disk_payload,
+        "hnsw_m": config.hnsw_config.m,
+        "hnsw_ef_construct": config.hnsw_config.ef_construct,
+        "quantization": type(config.quantization_config).__name__ if config.quantization_config else None
+    }
+
+@app.cli.command("migrate-collection")
+@click.option("--dry-run", is_flag=True, help="Show current and target settings without applying")
+def migrate_collection(dry_run):
+    """Apply the configured quantization, on-disk, HNSW and payload index settings to existing event collections"""
+    logger.info(f"🎯 Target: quantization={QDRANT_QUANTIZATION}, on_disk_vectors={QDRANT_ON_DISK_VECTORS}, "
+                f"on_disk_payload={QDRANT_ON_DISK_PAYLOAD}, hnsw m={HNSW_M} ef_construct={HNSW_EF_CONSTRUCT}")
+    
+    for route in event_routes():
+        if not qdrant_client.collection_exists(route.collection):
+            continue
+        logger.info(f"📦 Current '{route.collection}' config: {describe_collection_config(route.collection)}")
+        if dry_run:
+            continue
+        
+        added = ensure_payload_indexes(route.collection)
+        if added:
+            logger.info(f"✅ Payload indexes added: {', '.join(added)}")
+        # Qdrant rebuilds the index and quantized vectors in the background; the
+        # collection keeps serving reads and writes while the optimizer runs.
+        qdrant_client.update_collection(
+            collection_name=route.collection,
+            vectors_config={"": VectorParamsDiff(on_disk=QDRANT_ON_DISK_VECTORS)},
+            hnsw_config=hnsw_config(),
+            quantization_config=quantization_config() or Disabled.DISABLED,
+            collection_params=CollectionParamsDiff(on_disk_payload=QDRANT_ON_DISK_PAYLOAD)
+        )
+        logger.info(f"✅ Migration submitted; new config: {describe_collection_config(route.collection)}")
+    
+    if not dry_run:
+        logger.info("💡 Check optimizer progress with GET /api/status (collection status turns green when done)")
+
+@app.cli.command("benchmark-search")
+@click.option("--queries", default=200, show_default=True, help="Stored vectors to reuse as queries")
+@click.option("--top-k", default=10, show_default=True)
+@click.option("--ef", "ef_values", multiple=True, type=int, help="HNSW ef values to compare (repeatable)")
+@click.option("--collection", "collection_name", default=COLLECTION_NAME, show_default=True)
+def benchmark_search(queries, top_k, ef_values, collection_name):
+    """Compare recall@k and latency of search modes against exact search"""
+    route = TenantRoute(SHARED_TENANT, collection_name)
+    query_vectors = []
+    for points in iter_event_pages(Filter(must_not=[CHUNK_CONDITION]), with_vectors=True,
+                                   payload_fields=False, routes=[route]):
+        query_vectors.extend(p.vector for p in points)
+        if len(query_vectors) >= queries:
+            break
+    query_vectors = query_vectors[:queries]
+    if not query_vectors:
+        raise click.ClickException("Collection is empty; nothing to benchmark")
+    
+    def run(params):
+        latencies, results = [], []
+        for vector in query_vectors:
+            started = time.perf_counter()
+            hits = qdrant_client.query_points(
+                collection_name=collection_name,
+                query=vector,
+                limit=top_k,
+                search_params=params,
+                with_payload=False
+            ).points
+            latencies.append((time.perf_counter() - started) * 1000)
+            results.append({str(hit.id) for hit in hits})
+        return results, np.asarray(latencies)
+    
+    ground_truth, exact_latency = run(SearchParams(exact=True))
+    modes = [("exact", SearchParams(exact=True))]
+    for ef in ef_values or [HNSW_EF]:
+        label = f"ef={ef or 'default'}"
+        modes.append((f"hnsw {label}, full vectors", SearchParams(
+            hnsw_ef=ef, quantization=QuantizationSearchParams(ignore=True)
+        )))
+        if QDRANT_QUANTIZATION != "none":
+            modes.append((f"hnsw {label}, {QDRANT_QUANTIZATION} no rescore", search_params(ef, rescore=False)))
+            modes.append((f"hnsw {label}, {QDRANT_QUANTIZATION} rescore x{QDRANT_OVERSAMPLING}", search_params(ef, rescore=True)))
+    
+    click.echo(f"\n{len(query_vectors)} queries, top-{top_k}, collection '{collection_name}' "
+               f"(quantization={QDRANT_QUANTIZATION}, on_disk_vectors={QDRANT_ON_DISK_VECTORS})\n")
+    click.echo(f"{'mode':<45} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for label, params in modes:
+        if params.exact:
+            results, latency = ground_truth, exact_latency
+        else:
+            results, latency = run(params)
+        recall = np.mean([
+            len(found & truth) / max(len(truth), 1)
+            for found, truth in zip(results, ground_truth)
+        ])
+        click.echo(f"{label:<45} {recall:>9.3f} {np.percentile(latency, 50):>8.1f} {np.percentile(latency, 95):>8.1f}")
+
+# ==================== TENANT ADMIN CLI ====================
+
+def move_patients(patient_ids, target):
+    """
+    Move patients and their points to the target route. Pins are switched
+    first, then the copy waits until every process's cached route has
+    expired, so no write can still land on the old route after it is
+    copied and deleted. Returns the number of points moved.
+    """
+    sources = {}
+    for patient_id in dict.fromkeys(patient_ids):
+        source = route_for_patient(patient_id, cached=False)
+        if (source.collection, source.shard_key) != (target.collection, target.shard_key):
+            sources[patient_id] = source
+        pin_patient(patient_id, target.tenant_id)
+    if not sources:
+        return 0
+    
+    logger.info(f"⏳ {len(sources)} patients repointed; waiting {ROUTE_CACHE_SECONDS:.0f}s for cached routes to expire")
+    time.sleep(ROUTE_CACHE_SECONDS + 1)
+    
+    moved = 0
+    for index, (patient_id, source) in enumerate(sources.items(), start=1):
+        patient_filter = Filter(must=[FieldCondition(key="patient_id", match=MatchValue(value=patient_id))])
+        for points in iter_event_pages(patient_filter, with_vectors=True, routes=[source]):
+            qdrant_client.upsert(
+                **target.kwargs(),
+                points=[PointStruct(id=p.id, vector=p.vector, payload=p.payload) for p in points],
+                wait=True
+            )
+            moved += len(points)
+        qdrant_client.delete(**source.kwargs(), points_selector=FilterSelector(filter=patient_filter))
+        # Views built while the copy was running may be missing events
+        patient_events_changed([patient_id])
+        if index % 100 == 0:
+            logger.info(f"   🚚 {index} patients moved ({moved} points)")
+    return moved
+
+def shared_collection_patients():
+    """Per-patient point counts and first hospital for patients still in the shared collection"""
+    patients = {}
+    for points in iter_event_pages(
+        payload_fields=["patient_id", "hospital_name", "timestamp", "record_type"],
+        routes=[SHARED_ROUTE]
+    ):
+        for p in points:
+            entry = patients.setdefault(p.payload["patient_id"], {"points": 0, "first": None})
+            entry["points"] += 1
+            if p.payload.get("record_type") == "chunk":
+                continue
+            first = (p.payload.get("timestamp", ""), p.payload.get("hospital_name"))
+            if entry["first"] is None or first < entry["first"]:
+                entry["first"] = first
+    return patients
+
+@app.cli.command("tenant-list")
+def tenant_list():
+    """Show the tenant routing table with patient and point counts"""
+    tenants = [{"tenant_id": SHARED_TENANT, "mode": "shared", "collection": COLLECTION_NAME}] + sorted(
+        routed_tenants(), key=lambda tenant: tenant["tenant_id"]
+    )
+    click.echo(f"{'tenant':<30} {'mode':<11} {'collection':<36} {'patients':>9} {'points':>10}")
+    for tenant in tenants:
+        tenant_id, mode, collection = tenant["tenant_id"], tenant["mode"], tenant["collection"]
+        route = TenantRoute(tenant_id, collection, tenant.get("shard_key"))
+        patients = routed_patient_count(tenant_id)
+        try:
+            points = qdrant_client.count(**route.kwargs(), exact=False).count
+        except Exception:
+            points = "?"
+        click.echo(f"{tenant_id:<30} {mode:<11} {collection:<36} {patients:>9} {points:>10}")
+
+@app.cli.command("tenant-create")
+@click.argument("tenant_id")
+@click.option("--mode", type=click.Choice(["shard_key", "collection"]), default=None,
+              help="Routing mode (default: TENANCY_MODE)")
+def tenant_create(tenant_id, mode):
+    """Create a tenant's shard key or collection and add it to the routing table"""
+    mode = mode or TENANCY_MODE
+    if mode == "shared":
+        raise click.ClickException("TENANCY_MODE is 'shared'; pass --mode shard_key or --mode collection")
+    route = ensure_tenant(tenant_id_for(tenant_id=tenant_id), mode)
+    logger.info(f"✅ Tenant '{route.tenant_id}' -> {route.collection} {route.shard_key or ''}")
+
+@app.cli.command("tenant-migrate")
+@click.argument("tenant_id")
+@click.option("--hospital-name", "hospital_names", multiple=True,
+              help="Move shared-collection patients whose first event is at this hospital (repeatable)")
+@click.option("--patient-id", "patient_ids", multiple=True, help="Move this patient (repeatable)")
+@click.option("--mode", type=click.Choice(["shard_key", "collection"]), default=None)
+def tenant_migrate(tenant_id, hospital_names, patient_ids, mode):
+    """Move patients and all their events into a tenant's shard or collection"""
+    mode = mode or TENANCY_MODE
+    if mode == "shared":
+        raise click.ClickException("TENANCY_MODE is 'shared'; pass --mode shard_key or --mode collection")
+    target = ensure_tenant(tenant_id_for(tenant_id=tenant_id), mode)
+    
+    selected = list(patient_ids)
+    if hospital_names:
+        wanted = {tenant_id_for(name) for name in hospital_names}
+        for patient_id, entry in shared_collection_patients().items():
+            if entry["first"] and tenant_id_for(entry["first"][1]) in wanted:
+                selected.append(patient_id)
+    
+    moved = move_patients(selected, target)
+    logger.info(f"✅ Migrated {len(set(selected))} patients ({moved} points) to tenant '{target.tenant_id}'")
+
+@app.cli.command("tenant-rebalance")
+@click.option("--threshold", default=TENANT_REBALANCE_THRESHOLD, show_default=True,
+              help="Points a hospital needs in the shared collection to get its own shard/collection")
+@click.option("--mode", type=click.Choice(["shard_key", "collection"]), default=None)
+@click.option("--dry-run", is_flag=True)
+def tenant_rebalance(threshold, mode, dry_run):
+    """Promote large hospitals out of the shared collection into dedicated tenants"""
+    mode = mode or TENANCY_MODE
+    if mode == "shared":
+        raise click.ClickException("TENANCY_MODE is 'shared'; pass --mode shard_key or --mode collection")
+    
+    patients = shared_collection_patients()
+    tenants = {}
+    for patient_id, entry in patients.items():
+        tenant_id = tenant_id_for(entry["first"][1] if entry["first"] else None)
+        tenant = tenants.setdefault(tenant_id, {"points": 0, "patients": []})
+        tenant["points"] += entry["points"]
+        tenant["patients"].append(patient_id)
+    
+    for tenant_id, tenant in sorted(tenants.items(), key=lambda item: -item[1]["points"]):
+        promote = tenant["points"] >= threshold
+        click.echo(f"{tenant_id:<30} {len(tenant['patients']):>8} patients {tenant['points']:>10} points"
+                   + ("  -> promote" if promote else ""))
+        if promote and not dry_run:
+            target = ensure_tenant(tenant_id, mode)
+            moved = move_patients(tenant["patients"], target)
+            logger.info(f"✅ Tenant '{tenant_id}' promoted ({moved} points moved)")
+
+# ==================== DEDUP CLI ====================
+
+def stored_patients(route):
+    patients = set()
+    for points in iter_event_pages(Filter(must_not=[CHUNK_CONDITION]), payload_fields=["patient_id"], routes=[route]):
+        patients.update(p.payload["patient_id"] for p in points)
+    return sorted(patients)
+
+def stored_duplicate_groups(route, patient_id, threshold, window_days, skip_ids=()):
+    """
+    Group one patient's stored events greedily in time order: each event
+    joins the most similar earlier survivor of the same type (and file hash)
+    within the window. Documents stored without a file hash are left out,
+    as on ingest. Returns (points, {survivor index: [(index, score)]}).
+    """
+    points = []
+    for page in iter_event_pages(
+        Filter(
+            must=[FieldCondition(key="patient_id", match=MatchValue(value=patient_id))],
+            must_not=[CHUNK_CONDITION]
+        ),
+        with_vectors=True,
+        payload_fields=["timestamp", "event_type", "modality", "content", "file_sha256", "file_path",
+                        "duplicate_count", "duplicate_event_ids"],
+        routes=[route]
+    ):
+        points.extend(
+            p for p in page
+            if p.payload.get("modality") != "document" or p.payload.get("file_sha256")
+        )
+    points.sort(key=lambda p: p.payload.get("timestamp", ""))
+    if len(points) < 2:
+        return points, {}
+    
+    vectors = np.asarray([p.vector for p in points], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+    times = np.asarray([datetime.fromisoformat(p.payload["timestamp"]).timestamp() for p in points])
+    kinds = np.asarray([f"{p.payload.get('event_type')}|{p.payload.get('file_sha256', '')}" for p in points])
+    
+    survivors, groups = [0], {}
+    for index in range(1, len(points)):
+        candidates = np.asarray(survivors)
+        scores = vectors[candidates] @ vectors[index]
+        eligible = (
+            (kinds[candidates] == kinds[index])
+            & (np.abs(times[candidates] - times[index]) <= window_days * 86400)
+            & (scores >= threshold)
+        )
+        if str(points[index].id) in skip_ids or not eligible.any():
+            survivors.append(index)
+            continue
+        best = int(np.argmax(np.where(eligible, scores, -np.inf)))
+        groups.setdefault(int(candidates[best]), []).append((index, float(scores[best])))
+    return points, groups
+
+@app.cli.command("dedup-events")
+@click.option("--patient-id", "patient_ids", multiple=True, help="Only these patients (default: all)")
+@click.option("--threshold", default=DEDUP_THRESHOLD, show_default=True, help="Cosine similarity cutoff")
+@click.option("--window-days", default=DEDUP_WINDOW_DAYS, show_default=True, help="Max time between duplicates")
+@click.option("--action", type=click.Choice(["merge", "flag"]),
+              default=DEDUP_ACTION if DEDUP_ACTION in ("merge", "flag") else "merge", show_default=True)
+@click.option("--dry-run", is_flag=True, help="Report duplicates without changing anything")
+def dedup_events(patient_ids, threshold, window_days, action, dry_run):
+    """Merge or flag near-duplicate events already stored in the collection"""
+    # Events with writes still waiting in the ingest journal would be
+    # re-created by the flusher, so they are never merged away.
+    pending_ids = {row[0] for row in local_db().execute("SELECT DISTINCT event_id FROM ingest_journal")}
+    totals = Counter()
+    
+    for route in event_routes():
+        patients = patient_ids or stored_patients(route)
+        for patient_id in patients:
+            points, groups = stored_duplicate_groups(route, patient_id, threshold, window_days, pending_ids)
+            if not points:
+                continue
+            totals["patients"] += 1
+            totals["events"] += len(points)
+            
+            for survivor_index, members in groups.items():
+                survivor = points[survivor_index]
+                duplicates = [points[index] for index, _ in members]
+                totals["duplicates"] += len(duplicates)
+                logger.info(f"   🧬 {patient_id}: {str(survivor.id)[:8]}... has {len(duplicates)} duplicate(s) "
+                            f"(best {max(score for _, score in members):.3f})")
+                if dry_run:
+                    continue
+                
+                # Merging only drops exact copies; anything with different text is flagged
+                flagged = [
+                    (duplicate, score) for duplicate, (_, score) in zip(duplicates, members)
+                    if action == "flag" or not same_content(duplicate_text(survivor.payload), duplicate_text(duplicate.payload))
+                ]
+                for duplicate, score in flagged:
+                    qdrant_client.set_payload(
+                        **route.kwargs(),
+                        payload={"duplicate_of": str(survivor.id), "duplicate_score": round(score, 4)},
+                        points=[duplicate.id]
+                    )
+                totals["flagged"] += len(flagged)
+                flagged_ids = {duplicate.id for duplicate, _ in flagged}
+                duplicates = [d for d in duplicates if d.id not in flagged_ids]
+                if not duplicates:
+                    continue
+                
+                merged_ids = [i for d in duplicates for i in [str(d.id)] + d.payload.get("duplicate_event_ids", [])]
+                qdrant_client.set_payload(
+                    **route.kwargs(),
+                    payload=merged_duplicate_fields(survivor.payload, merged_ids),
+                    points=[survivor.id]
+                )
+                delete_events(route, [str(d.id) for d in duplicates])
+                for duplicate in duplicates:
+                    file_path = duplicate.payload.get("file_path")
+                    if file_path and file_path != survivor.payload.get("file_path"):
+                        remove_upload(file_path)
+            if groups and not dry_run:
+                patient_events_changed([patient_id])
+    
+    if dry_run:
+        logger.info(f"✅ Scanned {totals['events']} events for {totals['patients']} patients; "
+                    f"{totals['duplicates']} duplicates would be {'flagged' if action == 'flag' else 'merged or flagged'}")
+    else:
+        logger.info(f"✅ Scanned {totals['events']} events for {totals['patients']} patients; "
+                    f"{totals['duplicates'] - totals['flagged']} duplicates merged, {totals['flagged']} flagged")
+
+# ==================== COHORT ANALYTICS CLI ====================
+
+@app.cli.command("cohort-refresh")
+@click.option("--full", is_flag=True, help="Rescan every patient instead of only those written since the last refresh")
+def cohort_refresh_command(full):
+    """Recompute the cohort analytics snapshot"""
+    stats = refresh_cohort(full=full)
+    logger.info(f"✅ Cohort snapshot ({stats['mode']}): {stats['patients']} patients, "
+                f"{stats['events']} events in {stats['seconds']}s")
+
+# ==================== STORAGE COMPACTION CLI ====================
+
+@app.cli.command("compact-storage")
+@click.option("--dry-run", is_flag=True, help="Report what would be reclaimed without deleting anything")
+@click.option("--delete-orphans", is_flag=True,
+              help="Delete events whose file is missing (default: flag them with file_missing)")
+def compact_storage_command(dry_run, delete_orphans):
+    """Quarantine orphaned uploads, flag events without a file, archive old uploads and apply retention"""
+    if dry_run:
+        report = compact_storage(dry_run=True, delete_orphans=delete_orphans)
+    else:
+        report = run_storage_compaction(delete_orphans=delete_orphans)
+    if report["orphan_cleanup_skipped"]:
+        logger.warning(f"⚠️  Orphan cleanup skipped: {report['orphan_cleanup_skipped']}")
+    if report["reconcile_skipped"]:
+        logger.warning(f"⚠️  File reconcile skipped: {report['reconcile_skipped']}")
+    verb = "Would reclaim" if dry_run else "Reclaimed"
+    logger.info(f"✅ {verb} {report['reclaimed_bytes']} bytes and {report['reclaimed_points']} points "
+                f"({report['orphan_files']} orphan files quarantined, {report['purged_files']} purged, "
+                f"{report['missing_file_events']} events without a file "
+                f"{'deleted' if delete_orphans else 'flagged'}, "
+                f"{report['expired_points']} expired points, {report['archived_files']} files archived) "
+                f"in {report['seconds']}s")
+
+# ==================== MATERIALIZED TIMELINES CLI ====================
+
+@app.cli.command("rebuild-timelines")
+@click.option("--patient-id", "patient_ids", multiple=True, help="Only these patients (default: all)")
+@click.option("--check", is_flag=True, help="Compare stored views with Qdrant without rewriting them")
+def rebuild_timelines(patient_ids, check):
+    """Rebuild materialized patient timelines from Qdrant, or verify them"""
+    if patient_ids:
+        patients = sorted(set(patient_ids))
+    else:
+        stored = {row[0] for row in local_db().execute("SELECT patient_id FROM patient_timelines")}
+        patients = sorted(stored.union(*(stored_patients(route) for route in event_routes())))
+    
+    totals = Counter()
+    for patient_id in patients:
+        view, version = read_timeline_view(patient_id, max_age=0)
+        points = fetch_timeline_events(patient_id)
+        totals["patients"] += 1
+        
+        if not check:
+            materialize_timeline(patient_id, points, version)
+            totals["rebuilt"] += 1
+            continue
+        
+        fresh = timeline_view(build_patient_timeline(points))
+        if view is None:
+            totals["not_materialized"] += 1
+        elif view != fresh:
+            totals["drifted"] += 1
+            logger.warning(f"   ⚠️  {patient_id}: stored view has {len(view['timeline'])} events, "
+                           f"Qdrant has {len(points)}")
+    
+    if not check:
+        logger.info(f"✅ Rebuilt {totals['rebuilt']} patient timelines")
+        return
+    logger.info(f"🔍 Checked {totals['patients']} patients: {totals['drifted']} drifted, "
+                f"{totals['not_materialized']} not materialized yet")
+    if totals["drifted"]:
+        raise click.ClickException(f"{totals['drifted']} timeline views differ from Qdrant; "
+                                   "run without --check to rebuild them")
 
 # ==================== MAIN ====================
 
+# Replay anything left in the journal by a previous run (not in spawned
+# workers, which have no Qdrant client to flush to)
+if INGEST_JOURNAL and __name__ != "__mp_main__":
+    ensure_journal_flusher()
+
 if __name__ == "__main__":
     logger.info("🚀 Starting development server...")
     logger.info("📍 Access at: http://localhost:5000")
@@ -0,0 +1,370 @@
+"""
+ASGI serving mode for MediTrack.
+
+The I/O-bound routes are served natively async: Qdrant through
+AsyncQdrantClient and AI summaries through AsyncGroq. Embedding, file writes
+and PDF rendering are offloaded to a thread pool. Every other route (auth,
+profile, static pages, admin endpoints) is handled by the Flask app mounted
+underneath, so both modes expose the same API.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+"""
+import contextlib
+import functools
+import os
+import time
+
+import anyio
+from a2wsgi import WSGIMiddleware
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import Filter, FieldCondition, MatchValue
+from starlette.applications import Starlette
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.responses import JSONResponse, Response, FileResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as core
+
+# Threads available for embedding, PDF rendering and the mounted Flask app
+ASGI_THREADPOOL_SIZE = int(os.getenv("ASGI_THREADPOOL_SIZE", "16"))
+
+# Waiting requests are coroutines here, not threads, so the pools can be far
+# larger than under gunicorn. Export and upload run in the thread pool and are
+# sized against ASGI_THREADPOOL_SIZE. ADMISSION_LIMITS overrides apply on top.
+ASGI_ADMISSION_DEFAULTS = {
+    "timeline-summary": {"max_concurrent": 64, "max_queue": 256, "queue_timeout": 10, "per_key": 2},
+    "export-pdf": {"max_concurrent": 4, "max_queue": 32, "queue_timeout": 15, "per_key": 1},
+    "upload-document": {"max_concurrent": 8, "max_queue": 64, "queue_timeout": 10, "per_key": 2}
+}
+core.admission_pools.update(core.build_admission_pools(
+    core.admission_limits(ASGI_ADMISSION_DEFAULTS, core.ADMISSION_OVERRIDES)
+))
+
+logger = core.logger
+async_qdrant = None
+async_groq = None
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    global async_qdrant, async_groq
+
+    anyio.to_thread.current_default_thread_limiter().total_tokens = ASGI_THREADPOOL_SIZE
+    async_qdrant = AsyncQdrantClient(
+        url=os.getenv("QDRANT_URL"),
+        api_key=os.getenv("QDRANT_API_KEY")
+    )
+    if core.groq_client:
+        from groq import AsyncGroq
+        async_groq = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
+
+    # Flask starts these in before_request hooks, which API-only ASGI
+    # deployments may never trigger
+    core.ensure_cohort_refresher()
+    core.ensure_storage_compactor()
+
+    logger.info(f"⚡ ASGI mode ready (thread pool: {ASGI_THREADPOOL_SIZE})")
+    yield
+
+    await async_qdrant.close()
+    if async_groq:
+        await async_groq.close()
+
+
+# ==================== HELPERS ====================
+
+async def load_patient_timeline(patient_id):
+    """Materialized timeline view, rebuilt through the async client on a miss"""
+    view, version = await run_in_threadpool(core.read_timeline_view, patient_id)
+    if view is None:
+        scroll_args = await run_in_threadpool(core.timeline_scroll_args, patient_id)
+        points, offset = [], None
+        while True:
+            page, offset = await async_qdrant.scroll(**scroll_args, offset=offset)
+            points.extend(page)
+            if offset is None:
+                break
+        view = await run_in_threadpool(core.materialize_timeline, patient_id, points, version)
+    return await run_in_threadpool(core.overlay_pending, patient_id, view)
+
+
+async def ai_explain(prompt):
+    """AI explanation using the async Groq client"""
+    try:
+        if not async_groq:
+            logger.warning("Groq client not initialized")
+            return "AI analysis unavailable. Groq API not configured."
+
+        response = await async_groq.chat.completions.create(**core.ai_completion_args(prompt))
+        return core.ai_response_text(response)
+    except Exception as e:
+        return core.ai_error_message(e)
+
+
+def embed_query(text):
+    return list(core.embedding_model.embed([text]))[0].tolist()
+
+
+def session_user_id(request):
+    """The flask-login user id from the Flask session cookie, if it is valid"""
+    cookie = request.cookies.get(core.app.config["SESSION_COOKIE_NAME"])
+    serializer = core.app.session_interface.get_signing_serializer(core.app)
+    if not cookie or serializer is None:
+        return None
+    try:
+        max_age = int(core.app.permanent_session_lifetime.total_seconds())
+        return serializer.loads(cookie, max_age=max_age).get("_user_id")
+    except Exception:
+        return None
+
+
+async def admission_key(request):
+    """Same key as app.admission_key: the logged-in user, else the patient, else the client address"""
+    user_id = session_user_id(request)
+    if user_id:
+        return f"user:{user_id}"
+    patient_id = None
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            patient_id = (await request.json()).get("patient_id")
+        except ValueError:
+            pass
+    elif request.method == "POST":
+        patient_id = (await request.form()).get("patient_id")
+    return f"patient:{patient_id}" if patient_id else f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def admission_controlled(name):
+    """Async counterpart of app.admission_controlled, sharing the same pools"""
+    pool = core.admission_pools[name]
+
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(request):
+            key = await admission_key(request)
+            try:
+                await pool.acquire_async(key)
+            except core.AdmissionRejected as rejection:
+                logger.warning(f"🚦 {name} rejected for {key}: {rejection}")
+                return JSONResponse(
+                    {"error": str(rejection), "retry_after": rejection.retry_after},
+                    status_code=rejection.status_code,
+                    headers={"Retry-After": str(rejection.retry_after)}
+                )
+
+            started = time.monotonic()
+            try:
+                return await endpoint(request)
+            finally:
+                pool.release(key, time.monotonic() - started)
+        return wrapper
+    return decorator
+
+
+# ==================== ROUTES ====================
+
+async def health(request):
+    return JSONResponse({**core.health_status(), "serving_mode": "asgi"})
+
+
+async def ingest(request):
+    try:
+        data = await request.json()
+        required = ["content", "patient_id", "event_type"]
+
+        for field in required:
+            if not data.get(field):
+                return JSONResponse({"error": f"Missing: {field}"}, status_code=400)
+
+        event = core.create_medical_event(
+            data["content"],
+            data["patient_id"],
+            data["event_type"],
+            data.get("timestamp"),
+            data.get("doctor_name", "Unknown"),
+            data.get("hospital_name", "Unknown")
+        )
+
+        if core.INGEST_JOURNAL:
+            status = await run_in_threadpool(core.record_event, event, "text", None, False, data.get("tenant_id"))
+        else:
+            prepared = await run_in_threadpool(
+                core.prepare_event_points, event, "text", None, data.get("tenant_id")
+            )
+            if core.DEDUP_ENABLED:
+                prepared = (await run_in_threadpool(core.dedup_event_points, [prepared]))[0]
+            if prepared:
+                route, points = prepared
+                await async_qdrant.upsert(**route.kwargs(), points=points)
+                await run_in_threadpool(core.apply_timeline_events, points)
+                await run_in_threadpool(core.mark_cohort_dirty, [event.patient_id])
+            status = "stored" if prepared else "merged"
+
+        logger.info(f"📝 Event ingested: {event.event_id[:8]}... ({event.event_type}, {status})")
+
+        return JSONResponse({"status": status, "event_id": event.event_id})
+    except Exception as e:
+        logger.error(f"Ingest error: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@admission_controlled("upload-document")
+async def upload_document(request):
+    try:
+        form = await request.form()
+        file = form.get("file")
+        if file is None or isinstance(file, str):
+            return JSONResponse({"error": "No file uploaded"}, status_code=400)
+
+        patient_id = form.get("patient_id")
+        if not patient_id:
+            return JSONResponse({"error": "patient_id required"}, status_code=400)
+
+        file_content = await file.read()
+        response = await run_in_threadpool(
+            core.store_uploaded_document,
+            file_content,
+            file.filename,
+            patient_id,
+            form.get("doctor_name", "Unknown"),
+            form.get("hospital_name", "Unknown"),
+            form.get("notes", ""),
+            form.get("tenant_id")
+        )
+        return JSONResponse(response)
+    except Exception as e:
+        logger.error(f"Document upload error: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def download_document(request):
+    filename = request.path_params["filename"]
+    try:
+        file_path, tier = await run_in_threadpool(core.upload_location, filename)
+        if not file_path:
+            return JSONResponse({"error": "File not found"}, status_code=404)
+
+        original_filename = filename
+        try:
+            routes = await run_in_threadpool(core.lookup_routes, request.query_params.get("patient_id"))
+            for route in routes:
+                points, _ = await async_qdrant.scroll(
+                    **route.kwargs(),
+                    scroll_filter=Filter(must=[
+                        FieldCondition(key="file_path", match=MatchValue(value=filename))
+                    ]),
+                    limit=1,
+                    with_payload=True
+                )
+                if points:
+                    original_filename = points[0].payload.get("filename", filename)
+                    break
+        except Exception:
+            pass
+
+        logger.info(f"📥 Downloading document: {original_filename} ({tier})")
+        if tier == "hot":
+            return FileResponse(file_path, filename=original_filename)
+        # Cold uploads are gzipped on disk and decompressed while streaming
+        return StreamingResponse(
+            iterate_in_threadpool(core.iter_upload_chunks(file_path, tier)),
+            media_type=core.upload_mimetype(original_filename),
+            headers={"Content-Disposition": core.attachment_disposition(original_filename)}
+        )
+    except Exception as e:
+        logger.error(f"Document download error: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@admission_controlled("timeline-summary")
+async def timeline_summary(request):
+    try:
+        patient_id = (await request.json()).get("patient_id")
+        if not patient_id:
+            return JSONResponse({"error": "Missing patient_id"}, status_code=400)
+
+        view = await load_patient_timeline(patient_id)
+        if not view:
+            return JSONResponse({"error": "No events found"}, status_code=404)
+
+        timeline = view["timeline"]
+        if len(timeline) == 1:
+            return JSONResponse(core.single_event_response(timeline))
+
+        summary = await ai_explain(core.build_overview_prompt(timeline))
+
+        logger.info(f"📊 Timeline generated for {patient_id}: {len(timeline)} events")
+
+        return JSONResponse({
+            "timeline": timeline,
+            "timeline_insights": view["timeline_insights"],
+            "overall_summary": summary,
+            "data_quality": view["data_quality"]
+        })
+    except Exception as e:
+        logger.error(f"Timeline error: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@admission_controlled("export-pdf")
+async def export_pdf(request):
+    try:
+        patient_id = (await request.json()).get("patient_id")
+        if not patient_id:
+            return JSONResponse({"error": "patient_id required"}, status_code=400)
+
+        view = await load_patient_timeline(patient_id)
+        if not view:
+            return JSONResponse({"error": "No events found"}, status_code=404)
+
+        buffer = await run_in_threadpool(core.build_timeline_pdf, patient_id, view["timeline"])
+
+        logger.info(f"📄 PDF exported for {patient_id}")
+
+        return Response(
+            buffer.getvalue(),
+            media_type="application/pdf",
+            headers={"Content-Disposition": f'attachment; filename="{core.pdf_download_name(patient_id)}"'}
+        )
+    except Exception as e:
+        logger.error(f"PDF export error: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def search(request):
+    try:
+        data = await request.json()
+        patient_id = data.get("patient_id")
+        query = data.get("query")
+        limit = int(data.get("limit", 10))
+
+        if not patient_id or not query:
+            return JSONResponse({"error": "patient_id and query required"}, status_code=400)
+
+        query_vector = await run_in_threadpool(embed_query, query)
+        query_args = await run_in_threadpool(core.search_query_args, patient_id, query_vector, limit)
+        response = await async_qdrant.query_points(**query_args)
+        results = core.collapse_search_hits(response.points, limit)
+
+        logger.info(f"🔍 Search for {patient_id}: {len(results)} results")
+
+        return JSONResponse({"query": query, "results": results})
+    except Exception as e:
+        logger.error(f"Search error: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+application = Starlette(
+    routes=[
+        Route("/health", health),
+        Route("/ingest", ingest, methods=["POST"]),
+        Route("/upload-document", upload_document, methods=["POST"]),
+        Route("/download-document/{filename}", download_document),
+        Route("/timeline-summary", timeline_summary, methods=["POST"]),
+        Route("/export-pdf", export_pdf, methods=["POST"]),
+        Route("/search", search, methods=["POST"]),
+        # Auth, profile, static pages and admin endpoints stay on Flask
+        Mount("/", app=WSGIMiddleware(core.app))
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,202 @@
+"""Per-patient timeline metrics, for one timeline or, in pool workers, for a whole partition of events."""
+import os
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+SECONDS_PER_DAY = 86400
+FIELDS = ["patient_id", "timestamp", "event_type", "doctor_name", "hospital_name"]
+PAGE_SIZE = 1000
+
+_qdrant = None
+
+# Activity level thresholds, in events per month
+HIGH_ACTIVITY_RATE = 3
+MODERATE_ACTIVITY_RATE = 1
+
+
+def activity_levels(rates, counts):
+    levels = np.select(
+        [rates >= HIGH_ACTIVITY_RATE, rates >= MODERATE_ACTIVITY_RATE],
+        ["High", "Moderate"],
+        default="Low"
+    ).astype(object)
+    levels[counts < 2] = "N/A"
+    return levels
+
+
+def compute_timeline_insights(timeline):
+    """Calculate meaningful timeline metrics"""
+    if not timeline:
+        return None
+
+    # Sort by timestamp
+    sorted_timeline = sorted(timeline, key=lambda x: datetime.fromisoformat(x["timestamp"]))
+
+    # Calculate time span
+    first_date = datetime.fromisoformat(sorted_timeline[0]["timestamp"])
+    last_date = datetime.fromisoformat(sorted_timeline[-1]["timestamp"])
+    total_days = (last_date - first_date).days + 1
+
+    # Calculate activity rate (events per month)
+    months = max(total_days / 30, 1)  # At least 1 month
+    activity_rate = len(timeline) / months
+
+    # Find longest gap between events
+    max_gap_days = 0
+    for i in range(1, len(sorted_timeline)):
+        prev_date = datetime.fromisoformat(sorted_timeline[i-1]["timestamp"])
+        curr_date = datetime.fromisoformat(sorted_timeline[i]["timestamp"])
+        gap = (curr_date - prev_date).days
+        max_gap_days = max(max_gap_days, gap)
+
+    # Event type breakdown (percentages)
+    event_types = {}
+    for event in timeline:
+        event_type = event["event_type"]
+        event_types[event_type] = event_types.get(event_type, 0) + 1
+
+    event_breakdown = {
+        event_type: round((count / len(timeline)) * 100, 1)
+        for event_type, count in event_types.items()
+    }
+
+    # Unique care providers
+    hospitals = set(e["hospital_name"] for e in timeline if e["hospital_name"] != "Unknown")
+    doctors = set(e["doctor_name"] for e in timeline if e["doctor_name"] != "Unknown")
+
+    # Data completeness (percentage of events with doctor/hospital info)
+    complete_events = sum(1 for e in timeline 
+                         if e["doctor_name"] != "Unknown" and e["hospital_name"] != "Unknown")
+    completeness = round((complete_events / len(timeline)) * 100, 1) if timeline else 0
+
+    # Activity level assessment
+    if activity_rate >= HIGH_ACTIVITY_RATE:
+        activity_level = "High"
+        activity_desc = "Frequent medical visits"
+    elif activity_rate >= MODERATE_ACTIVITY_RATE:
+        activity_level = "Moderate"
+        activity_desc = "Regular checkups"
+    else:
+        activity_level = "Low"
+        activity_desc = "Infrequent visits"
+
+    # Continuity assessment (based on gaps)
+    if max_gap_days <= 14:
+        continuity = "Excellent"
+        continuity_desc = "No significant gaps in care"
+    elif max_gap_days <= 60:
+        continuity = "Good"
+        continuity_desc = "Minor gaps between visits"
+    elif max_gap_days <= 180:
+        continuity = "Fair"
+        continuity_desc = "Some gaps in care history"
+    else:
+        continuity = "Poor"
+        continuity_desc = "Large gaps in documentation"
+
+    return {
+        "activity_rate": round(activity_rate, 1),
+        "activity_level": activity_level,
+        "activity_description": activity_desc,
+        "longest_gap_days": max_gap_days,
+        "continuity": continuity,
+        "continuity_description": continuity_desc,
+        "completeness": completeness,
+        "event_breakdown": event_breakdown,
+        "unique_hospitals": len(hospitals),
+        "unique_doctors": len(doctors),
+        "total_days": total_days,
+        "total_events": len(timeline)
+    }
+
+
+def compute_patient_metrics(columns):
+    """
+    Per-patient timeline metrics for one partition of events.
+
+    columns holds equal-length arrays: patient_id, timestamp (epoch
+    seconds), event_type, doctor_name and hospital_name. Returns
+    (patient_rows, mix_rows) ready for the cohort snapshot tables.
+    """
+    patients = np.asarray(columns["patient_id"], dtype=str)
+    if not len(patients):
+        return [], []
+    timestamps = np.asarray(columns["timestamp"], dtype=np.float64)
+
+    order = np.lexsort((timestamps, patients))
+    patients, timestamps = patients[order], timestamps[order]
+    starts = np.flatnonzero(np.r_[True, patients[1:] != patients[:-1]])
+    ends = np.r_[starts[1:], len(patients)]
+    counts = ends - starts
+
+    first, last = timestamps[starts], timestamps[ends - 1]
+    total_days = np.floor((last - first) / SECONDS_PER_DAY).astype(np.int64) + 1
+    activity_rate = counts / np.maximum(total_days / 30, 1)
+
+    # Whole-day gap to the previous event of the same patient (0 for the first)
+    gaps = np.floor(np.diff(timestamps, prepend=timestamps[0]) / SECONDS_PER_DAY)
+    gaps[starts] = 0
+    longest_gap = np.maximum.reduceat(gaps, starts).astype(np.int64)
+    median_gap = [
+        float(np.median(gaps[start + 1:end])) if end - start > 1 else None
+        for start, end in zip(starts, ends)
+    ]
+
+    levels = activity_levels(activity_rate, counts)
+    patient_rows = [
+        (patients[start], int(count), float(first_ts), float(last_ts), int(days),
+         round(float(rate), 2), level, int(gap), median)
+        for start, count, first_ts, last_ts, days, rate, level, gap, median in zip(
+            starts, counts, first, last, total_days, activity_rate, levels, longest_gap, median_gap
+        )
+    ]
+
+    mix = Counter(zip(
+        columns["patient_id"], columns["hospital_name"], columns["doctor_name"], columns["event_type"]
+    ))
+    mix_rows = [(*key, count) for key, count in mix.items()]
+    return patient_rows, mix_rows
+
+
+def worker_client():
+    """This worker process's own Qdrant client, created on first use"""
+    global _qdrant
+    if _qdrant is None:
+        from qdrant_client import QdrantClient
+        _qdrant = QdrantClient(url=os.getenv("QDRANT_URL"), api_key=os.getenv("QDRANT_API_KEY"))
+    return _qdrant
+
+
+def partition_metrics(scrolls, client=None):
+    """
+    Scroll one partition's events and compute its patient metrics.
+
+    scrolls is a list of qdrant scroll() keyword arguments (collection,
+    shard key and a patient filter) that together cover every event of the
+    partition's patients.
+    """
+    client = client or worker_client()
+    columns = {field: [] for field in FIELDS}
+    for scroll_args in scrolls:
+        offset = None
+        while True:
+            points, offset = client.scroll(
+                **scroll_args, limit=PAGE_SIZE, offset=offset, with_payload=FIELDS, with_vectors=False
+            )
+            for p in points:
+                columns["patient_id"].append(p.payload["patient_id"])
+                columns["timestamp"].append(datetime.fromisoformat(p.payload["timestamp"]).timestamp())
+                for field in ("event_type", "doctor_name", "hospital_name"):
+                    columns[field].append(p.payload.get(field) or "Unknown")
+            if offset is None:
+                break
+    return compute_patient_metrics(columns)
+
+
+def percentiles(values, points=(50, 75, 90, 95, 99)):
+    values = np.asarray([v for v in values if v is not None], dtype=np.float64)
+    if not len(values):
+        return None
+    return {f"p{p}": round(float(v), 1) for p, v in zip(points, np.percentile(values, points))}
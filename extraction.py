@@ -0,0 +1,157 @@
+"""Text extraction for uploaded documents, run in a separate process per file."""
+import csv
+import importlib
+import io
+import os
+
+PDF_EXTENSIONS = {".pdf"}
+TEXT_EXTENSIONS = {".txt", ".text", ".md", ".log", ".hl7"}
+CSV_EXTENSIONS = {".csv", ".tsv"}
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".gif", ".webp"}
+
+MAX_EXTRACTED_CHARS = 200_000
+MAX_CSV_ROWS = 2000
+
+
+def load_ocr_hook(spec):
+    """Resolve an OCR hook given as "module:function"; returns None if unset"""
+    if not spec:
+        return None
+    module_name, _, func_name = spec.partition(":")
+    module = importlib.import_module(module_name)
+    return getattr(module, func_name or "ocr")
+
+
+def decode_bytes(raw):
+    try:
+        from charset_normalizer import from_bytes
+        match = from_bytes(raw).best()
+        if match is not None:
+            return str(match)
+    except ImportError:
+        pass
+    return raw.decode("utf-8", errors="replace")
+
+
+def extract_pdf(file_path):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return None, "pypdf not installed"
+
+    reader = PdfReader(file_path)
+    pages = []
+    for number, page in enumerate(reader.pages, start=1):
+        text = (page.extract_text() or "").strip()
+        if text:
+            pages.append(f"[Page {number}]\n{text}")
+    return "\n\n".join(pages), None
+
+
+def extract_plain_text(file_path):
+    with open(file_path, "rb") as f:
+        return decode_bytes(f.read()).strip(), None
+
+
+def extract_csv(file_path):
+    with open(file_path, "rb") as f:
+        text = decode_bytes(f.read())
+
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t|")
+    except csv.Error:
+        dialect = csv.excel
+
+    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+    lines = []
+    for index, row in enumerate(reader):
+        if index >= MAX_CSV_ROWS:
+            lines.append(f"... truncated after {MAX_CSV_ROWS} rows")
+            break
+        fields = "; ".join(f"{key}: {value}" for key, value in row.items() if key and value)
+        if fields:
+            lines.append(fields)
+    return "\n".join(lines), None
+
+
+def extract_image_metadata(file_path):
+    try:
+        from PIL import Image, ExifTags
+    except ImportError:
+        return None, "pillow not installed"
+
+    with Image.open(file_path) as image:
+        lines = [
+            f"Image format: {image.format}",
+            f"Dimensions: {image.width}x{image.height}",
+            f"Color mode: {image.mode}"
+        ]
+        dpi = image.info.get("dpi")
+        if dpi:
+            lines.append(f"Resolution: {dpi[0]:.0f} dpi")
+
+        for tag_id, value in image.getexif().items():
+            tag = ExifTags.TAGS.get(tag_id, str(tag_id))
+            if isinstance(value, bytes):
+                continue
+            lines.append(f"{tag}: {value}")
+    return "\n".join(lines), None
+
+
+def extract_document_text(file_path, extension, ocr_hook_spec=None):
+    """
+    Extract searchable text from an uploaded file.
+
+    Returns a dict with "status" (done, empty, unsupported or failed),
+    "method" and "text".
+    """
+    extension = extension.lower()
+
+    if extension in PDF_EXTENSIONS:
+        method, extractor = "pdf_text", extract_pdf
+    elif extension in CSV_EXTENSIONS:
+        method, extractor = "csv", extract_csv
+    elif extension in TEXT_EXTENSIONS:
+        method, extractor = "plain_text", extract_plain_text
+    elif extension in IMAGE_EXTENSIONS:
+        method, extractor = "image_metadata", extract_image_metadata
+    else:
+        method, extractor = None, None
+
+    text, error = "", None
+    try:
+        if extractor:
+            text, error = extractor(file_path)
+            text = text or ""
+
+        # Scanned PDFs have no text layer and images only yield metadata, so
+        # both fall through to the OCR hook when one is configured.
+        ocr_hook = load_ocr_hook(ocr_hook_spec)
+        if ocr_hook and (extension in IMAGE_EXTENSIONS or (extension in PDF_EXTENSIONS and not text)):
+            ocr_text = (ocr_hook(file_path) or "").strip()
+            if ocr_text:
+                text = f"{text}\n\n{ocr_text}".strip()
+                method = f"{method}+ocr" if method else "ocr"
+    except Exception as e:
+        return {"status": "failed", "method": method, "text": "", "error": str(e)}
+
+    if not method:
+        return {"status": "unsupported", "method": None, "text": "",
+                "error": f"No extractor for '{extension or os.path.basename(file_path)}'"}
+    if error and not text:
+        return {"status": "unsupported", "method": method, "text": "", "error": error}
+
+    return {
+        "status": "done" if text else "empty",
+        "method": method,
+        "text": text[:MAX_EXTRACTED_CHARS],
+        "error": None
+    }
+
+
+def extraction_process_main(conn, file_path, extension, ocr_hook_spec=None):
+    """Entry point of a one-document extraction process; sends the result over conn"""
+    try:
+        conn.send(extract_document_text(file_path, extension, ocr_hook_spec))
+    finally:
+        conn.close()
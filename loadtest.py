@@ -0,0 +1,91 @@
+"""
+Concurrent load test for comparing the gunicorn (WSGI) and uvicorn (ASGI)
+serving modes against the same Qdrant/Groq backends.
+
+    gunicorn app:app --bind 0.0.0.0:8000 --workers 4 --timeout 120
+    python loadtest.py --url http://localhost:8000 --patients-file patients.txt --concurrency 200
+
+    uvicorn asgi:application --host 0.0.0.0 --port 8001
+    python loadtest.py --url http://localhost:8001 --patients-file patients.txt --concurrency 200
+
+Requests are spread round-robin over the given patients. Admission control
+caps how many requests one patient may have in flight (per_key, 2 for
+/timeline-summary), so a run against a single --patient-id mostly measures
+429 rejections; give at least concurrency / per_key patients.
+
+Use --path /search --body '{"patient_id": "...", "query": "chest pain"}' to
+exercise an endpoint without spending Groq tokens.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+
+import httpx
+import numpy as np
+
+
+async def worker(client, url, bodies, remaining, latencies, statuses):
+    while True:
+        try:
+            index = remaining.pop()
+        except IndexError:
+            return
+
+        body = bodies[index % len(bodies)]
+        started = time.perf_counter()
+        try:
+            response = await client.post(url, json=body)
+            statuses[response.status_code] += 1
+        except httpx.HTTPError as e:
+            statuses[type(e).__name__] += 1
+        latencies.append((time.perf_counter() - started) * 1000)
+
+
+async def run(args):
+    if args.body:
+        bodies = [json.loads(args.body)]
+    else:
+        patient_ids = list(args.patient_ids)
+        if args.patients_file:
+            with open(args.patients_file) as f:
+                patient_ids += [line.strip() for line in f if line.strip()]
+        bodies = [{"patient_id": patient_id} for patient_id in patient_ids or ["MED-00000000"]]
+    url = args.url.rstrip("/") + args.path
+    remaining = list(range(args.requests))
+    latencies, statuses = [], Counter()
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            worker(client, url, bodies, remaining, latencies, statuses)
+            for _ in range(args.concurrency)
+        ])
+        elapsed = time.perf_counter() - started
+
+    latency = np.asarray(latencies)
+    print(f"\n{url}  concurrency={args.concurrency}  requests={args.requests}  bodies={len(bodies)}")
+    print(f"  throughput : {len(latencies) / elapsed:8.1f} req/s  ({elapsed:.1f}s total)")
+    print(f"  latency ms : p50 {np.percentile(latency, 50):.0f}  p95 {np.percentile(latency, 95):.0f}  "
+          f"p99 {np.percentile(latency, 99):.0f}  max {latency.max():.0f}")
+    print(f"  responses  : {dict(statuses)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/timeline-summary")
+    parser.add_argument("--patient-id", dest="patient_ids", action="append", default=[],
+                        help="Patient to request (repeatable)")
+    parser.add_argument("--patients-file", default=None, help="File with one patient id per line")
+    parser.add_argument("--body", default=None, help="JSON request body (default: {\"patient_id\": ...})")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=120)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -503,7 +503,7 @@ async function runTimelineSummary(btn) {
         // Check if this is a document event
         const isDocument = row.file_path && row.filename;
         const eventContent = isDocument 
-          ? `${escapeHtml(row.content)} <br><button onclick="downloadDocument('${row.file_path}', '${escapeHtml(row.filename)}')" class="mt-2 px-3 py-1 bg-blue-500 text-white rounded text-xs hover:bg-blue-600">📥 Download ${escapeHtml(row.filename)}</button>`
+          ? `${escapeHtml(row.content)} <br><button onclick="downloadDocument('${row.file_path}', '${escapeHtml(row.filename)}', '${escapeHtml(patientId)}')" class="mt-2 px-3 py-1 bg-blue-500 text-white rounded text-xs hover:bg-blue-600">📥 Download ${escapeHtml(row.filename)}</button>`
           : escapeHtml(row.content);
         
         tableHTML += `
@@ -676,8 +676,8 @@ function sharePatientLink() {
 
 // ==================== DOCUMENT DOWNLOAD ====================
 
-function downloadDocument(filePath, originalFilename) {
-  window.open(`/download-document/${filePath}`, '_blank');
+function downloadDocument(filePath, originalFilename, patientId) {
+  window.open(`/download-document/${filePath}?patient_id=${encodeURIComponent(patientId)}`, '_blank');
   showNotification(`Downloading ${originalFilename}...`, 'info');
 }
 
@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionPool, AdmissionRejected
+
+
+def make_pool(**limits):
+    return AdmissionPool("test", **{"max_concurrent": 1, "max_queue": 1, "queue_timeout": 0.2, "per_key": 2, **limits})
+
+
+def assert_idle(pool):
+    assert pool.active == 0
+    assert pool.waiting == 0
+    assert not pool.held_by_key
+
+
+def test_acquire_and_release_free_the_slot():
+    pool = make_pool()
+    pool.acquire("a")
+    assert (pool.active, pool.waiting, pool.held_by_key["a"]) == (1, 0, 1)
+    pool.release("a", 0.5)
+    assert_idle(pool)
+    assert pool.admitted == 1
+
+
+def test_full_queue_is_rejected_with_429():
+    pool = make_pool(max_queue=0)
+    pool.acquire("a")
+    with pytest.raises(AdmissionRejected) as rejection:
+        pool.acquire("b")
+    assert rejection.value.status_code == 429
+    assert pool.rejected["queue_full"] == 1
+    assert "b" not in pool.held_by_key
+    pool.release("a", 0.1)
+    assert_idle(pool)
+
+
+def test_per_key_share_counts_queued_requests():
+    pool = make_pool(max_concurrent=1, max_queue=4, per_key=1)
+    pool.acquire("a")
+    with pytest.raises(AdmissionRejected) as rejection:
+        pool.acquire("a")
+    assert rejection.value.status_code == 429
+    assert pool.rejected["per_key"] == 1
+    assert (pool.active, pool.waiting) == (1, 0)
+    pool.release("a", 0.1)
+    assert_idle(pool)
+
+
+def test_queue_timeout_gives_up_its_place():
+    pool = make_pool(queue_timeout=0.05)
+    pool.acquire("a")
+    started = time.monotonic()
+    with pytest.raises(AdmissionRejected) as rejection:
+        pool.acquire("b")
+    assert time.monotonic() - started >= 0.05
+    assert rejection.value.status_code == 503
+    assert rejection.value.retry_after >= 1
+    assert pool.rejected["queue_timeout"] == 1
+    assert (pool.active, pool.waiting) == (1, 0)
+    pool.release("a", 0.1)
+    assert_idle(pool)
+
+
+def test_queued_request_is_promoted_on_release():
+    pool = make_pool(queue_timeout=5)
+    pool.acquire("a")
+    admitted = threading.Event()
+
+    def waiter():
+        pool.acquire("b")
+        admitted.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    while pool.waiting == 0:
+        time.sleep(0.001)
+    assert not admitted.is_set()
+
+    pool.release("a", 0.1)
+    thread.join(5)
+    assert admitted.is_set()
+    assert (pool.active, pool.waiting, pool.admitted) == (1, 0, 2)
+    pool.release("b", 0.1)
+    assert_idle(pool)
+
+
+def test_async_queue_timeout_and_promotion():
+    pool = make_pool(max_queue=2, queue_timeout=0.1)
+
+    async def scenario():
+        await pool.acquire_async("a")
+        with pytest.raises(AdmissionRejected):
+            await pool.acquire_async("b")
+        assert pool.waiting == 0
+
+        waiter = asyncio.create_task(pool.acquire_async("c"))
+        await asyncio.sleep(0.03)
+        assert pool.waiting == 1
+        pool.release("a", 0.1)
+        await waiter
+
+    asyncio.run(scenario())
+    assert (pool.active, pool.waiting) == (1, 0)
+    assert pool.rejected["queue_timeout"] == 1
+    pool.release("c", 0.1)
+    assert_idle(pool)
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    pool = make_pool(queue_timeout=5)
+
+    async def scenario():
+        await pool.acquire_async("a")
+        waiter = asyncio.create_task(pool.acquire_async("b"))
+        await asyncio.sleep(0.03)
+        assert pool.waiting == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(scenario())
+    assert (pool.active, pool.waiting) == (1, 0)
+    assert "b" not in pool.held_by_key
+    pool.release("a", 0.1)
+    assert_idle(pool)
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from cohort import compute_patient_metrics, compute_timeline_insights
+
+START = datetime(2024, 1, 1, 8, 30, tzinfo=timezone.utc)
+
+
+def make_timeline(offsets_days):
+    return [
+        {
+            "timestamp": (START + timedelta(days=offset)).isoformat(),
+            "event_type": "visit" if i % 2 else "lab",
+            "doctor_name": "Dr. Rao",
+            "hospital_name": "City Hospital",
+            "content": "note"
+        }
+        for i, offset in enumerate(offsets_days)
+    ]
+
+
+def columns_for(patient_id, timeline):
+    return {
+        "patient_id": [patient_id] * len(timeline),
+        "timestamp": [datetime.fromisoformat(e["timestamp"]).timestamp() for e in timeline],
+        "event_type": [e["event_type"] for e in timeline],
+        "doctor_name": [e["doctor_name"] for e in timeline],
+        "hospital_name": [e["hospital_name"] for e in timeline]
+    }
+
+
+TIMELINES = {
+    "high": [0, 1, 2, 3.5, 5, 9, 10],
+    "moderate": [0, 12, 25, 40, 58],
+    "low": [0, 200],
+    "fractional-gaps": [0, 0.4, 1.7, 30.9, 31.2, 95.6],
+    "unsorted": [40, 3, 0, 17.25]
+}
+
+
+@pytest.mark.parametrize("name", sorted(TIMELINES))
+def test_patient_metrics_match_timeline_insights(name):
+    timeline = make_timeline(TIMELINES[name])
+    insights = compute_timeline_insights(timeline)
+    (row,), _ = compute_patient_metrics(columns_for("MED-1", timeline))
+    _, events, _, _, total_days, activity_rate, activity_level, longest_gap, _ = row
+
+    assert events == insights["total_events"]
+    assert total_days == insights["total_days"]
+    assert longest_gap == insights["longest_gap_days"]
+    assert activity_level == insights["activity_level"]
+    assert round(activity_rate, 1) == insights["activity_rate"]
+
+
+def test_patients_in_one_partition_are_kept_apart():
+    first, second = make_timeline(TIMELINES["high"]), make_timeline(TIMELINES["low"])
+    columns = columns_for("MED-1", first)
+    for field, values in columns_for("MED-2", second).items():
+        columns[field].extend(values)
+
+    patient_rows, mix_rows = compute_patient_metrics(columns)
+    by_patient = {row[0]: row for row in patient_rows}
+
+    assert by_patient["MED-1"][7] == compute_timeline_insights(first)["longest_gap_days"]
+    assert by_patient["MED-2"][7] == compute_timeline_insights(second)["longest_gap_days"]
+    assert sum(row[-1] for row in mix_rows) == len(first) + len(second)
+
+
+def test_single_event_patient_has_no_activity_level():
+    (row,), _ = compute_patient_metrics(columns_for("MED-1", make_timeline([0])))
+    assert row[6] == "N/A"
+    assert row[8] is None